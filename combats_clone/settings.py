@@ -113,3 +113,49 @@ LOGOUT_REDIRECT_URL = 'login'  # URL для перенаправления по
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+
+# Хранилище активных боёв (game/combat_store.py): состояние боя в памяти,
+# запись в таблицу Combat раз в FLUSH_EVERY ходов (не реже раза в
+# FLUSH_INTERVAL секунд, пока в бою ходят) и в конце боя;
+# TURN_TIMEOUT - секунды на ход, после которых ход делается за игрока
+# (None - без таймаутов); TIMEOUT_WORKER - запускать поток таймаутов в
+# процессе сервера. Включаются вместе, например TURN_TIMEOUT: 120,
+# TIMEOUT_WORKER: True
+COMBAT_STORE = {
+    'BACKEND': 'game.combat_store.LocalMemoryBackend',
+    'OPTIONS': {},
+    'FLUSH_EVERY': 5,
+    'FLUSH_INTERVAL': 60,
+    'TURN_TIMEOUT': None,
+    'TIMEOUT_ACTION': 'auto',
+    'MAX_IDLE_TURNS': 3,
+    'TIMEOUT_WORKER': False,
+}
+
+# Доставка сообщений чата (game/chat.py): брокер раздаёт новые сообщения
+# потокам /chat/stream/ (только под ASGI) и будит долгий опрос get_messages;
+# HEARTBEAT - секунды между пингами, LONG_POLL_TIMEOUT - предел ожидания опроса
+CHAT_BROKER = {
+    'BACKEND': 'game.chat.LocalBroker',
+    'OPTIONS': {'queue_size': 256, 'buffer_size': 200},
+    'HEARTBEAT': 15,
+    'LONG_POLL_TIMEOUT': 25,
+}
+
+# Срок хранения сообщений чата в днях по типу комнаты (game/chat_retention.py,
+# команда purge_chat); None - без ограничения. EXPORT_DIR - куда выгружать
+# удаляемые сообщения (JSONL.gz) для модерации, None - не выгружать
+CHAT_RETENTION = {
+    'TTL_DAYS': {
+        'world': 7,
+        'trade': 7,
+        'location': 7,
+        'groupchat': 14,
+        'group': 14,
+        'private': 90,
+        'clan': None,
+        'alliance': None,
+    },
+    'DEFAULT_TTL_DAYS': 30,
+    'EXPORT_DIR': None,
+}
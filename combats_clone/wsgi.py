@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'combats_clone.settings')
 
 application = get_wsgi_application()
+
+# Таймауты ходов обрабатывает процесс сервера (если включены в COMBAT_STORE)
+from game.combat_timeouts import start_server_timeout_worker  # noqa: E402
+
+start_server_timeout_worker()
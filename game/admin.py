@@ -1,7 +1,8 @@
 # admin.py
 from django.contrib import admin
 from django import forms
-from .models import PriceSettings, ExchangeRates, Transaction
+from .models import PriceSettings, ExchangeRates, Transaction, PriceAggregate, PriceCandle
+from .price_stats import rebuild_price_stats, refresh_average_price
 
 class PriceSettingsAdmin(admin.ModelAdmin):
     list_display = ['resource_type', 'min_price', 'max_price', 'average_price', 'updated_at']
@@ -9,11 +10,10 @@ class PriceSettingsAdmin(admin.ModelAdmin):
     readonly_fields = ['average_price', 'updated_at']
     
     def save_model(self, request, obj, form, change):
-        # Автоматический пересчет средней цены при сохранении
-        transactions = Transaction.objects.filter(resource_type=obj.resource_type)
-        if transactions.exists():
-            total_price = sum(t.price for t in transactions)
-            obj.average_price = total_price / transactions.count()
+        # Средняя цена - из накопительного агрегата сделок (game/price_stats.py)
+        aggregate = PriceAggregate.objects.filter(resource_type=obj.resource_type).first()
+        if aggregate is not None:
+            obj.average_price = aggregate.average_price
         super().save_model(request, obj, form, change)
 
 class ExchangeRatesAdmin(admin.ModelAdmin):
@@ -27,19 +27,42 @@ class TransactionAdmin(admin.ModelAdmin):
     
     def save_model(self, request, obj, form, change):
         obj.total = obj.amount * obj.price
+        old_resource_type = None
+        if change:
+            old_resource_type = Transaction.objects.filter(pk=obj.pk).values_list('resource_type', flat=True).first()
+        # Новая сделка попадает в агрегаты в Transaction.save()
         super().save_model(request, obj, form, change)
         
-        # Обновляем среднюю цену для данного типа ресурса
-        try:
-            price_settings = PriceSettings.objects.get(resource_type=obj.resource_type)
-            transactions = Transaction.objects.filter(resource_type=obj.resource_type)
-            if transactions.exists():
-                total_price = sum(t.price for t in transactions)
-                price_settings.average_price = total_price / transactions.count()
-                price_settings.save()
-        except PriceSettings.DoesNotExist:
-            pass
+        if change:
+            # Правку задним числом не вычесть из минимума/максимума - пересчёт ресурса
+            for resource_type in {old_resource_type, obj.resource_type} - {None}:
+                rebuild_price_stats(resource_type)
+                refresh_average_price(resource_type)
+        else:
+            refresh_average_price(obj.resource_type)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rebuild_price_stats(obj.resource_type)
+        refresh_average_price(obj.resource_type)
+
+    def delete_queryset(self, request, queryset):
+        resource_types = set(queryset.values_list('resource_type', flat=True))
+        super().delete_queryset(request, queryset)
+        for resource_type in resource_types:
+            rebuild_price_stats(resource_type)
+            refresh_average_price(resource_type)
+
+class PriceAggregateAdmin(admin.ModelAdmin):
+    list_display = ['resource_type', 'trade_count', 'volume', 'min_price', 'max_price', 'average_price', 'vwap', 'updated_at']
+    readonly_fields = ['resource_type', 'trade_count', 'volume', 'price_sum', 'turnover', 'min_price', 'max_price', 'updated_at']
+
+class PriceCandleAdmin(admin.ModelAdmin):
+    list_display = ['resource_type', 'interval', 'bucket_start', 'open', 'high', 'low', 'close', 'volume', 'trade_count']
+    list_filter = ['resource_type', 'interval']
 
 admin.site.register(PriceSettings, PriceSettingsAdmin)
 admin.site.register(ExchangeRates, ExchangeRatesAdmin)
-admin.site.register(Transaction, TransactionAdmin)
\ No newline at end of file
+admin.site.register(Transaction, TransactionAdmin)
+admin.site.register(PriceAggregate, PriceAggregateAdmin)
+admin.site.register(PriceCandle, PriceCandleAdmin)
\ No newline at end of file
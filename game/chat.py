@@ -0,0 +1,439 @@
+"""
+Доставка сообщений чата подписчикам комнат без опроса БД.
+
+send_message после сохранения сообщения публикует его в брокер (после
+коммита транзакции), брокер раздаёт его всем подключённым к комнате
+потокам (Server-Sent Events, /chat/stream/). Сообщение сериализуется
+один раз на публикацию, а не на каждого читателя. Ждущий поток не
+делает запросов к БД: запросы только при подключении (комната и
+пропущенные с last_id сообщения).
+
+Настройка (settings.CHAT_BROKER):
+
+    CHAT_BROKER = {
+        'BACKEND': 'game.chat.LocalBroker',
+        'OPTIONS': {'queue_size': 256, 'buffer_size': 200},
+        'HEARTBEAT': 15,
+        'LONG_POLL_TIMEOUT': 25,
+    }
+
+LocalBroker раздаёт сообщения внутри процесса - подходит для одного
+процесса сервера (uvicorn/daphne или WSGI с потоками). Для нескольких
+процессов нужен брокер поверх общей шины и кэша (например, Redis pub/sub
+и списки) с теми же методами subscribe / unsubscribe / publish /
+wait_for_message / recent.
+
+Поток работает только под ASGI: под WSGI каждый открытый поток занимал
+бы рабочий поток сервера, поэтому там клиент остаётся на опросе
+get_messages - долгом (wait): запрос ждёт в wait_for_message, пока
+брокер не опубликует в комнате сообщение новее last_id. Брокер хранит
+номер последнего сообщения каждой комнаты; ждущие одной комнаты спят на
+общем Condition и просыпаются одним notify_all публикации, не опрашивая
+БД. LONG_POLL_TIMEOUT - предел ожидания в секундах.
+
+Последние buffer_size сообщений каждой комнаты брокер держит в кольцевом
+буфере уже сериализованными (JSON и событие SSE) - get_messages отдаёт
+их из буфера, склеивая готовые строки, и идёт в БД только за историей
+старше буфера. Буфер комнаты заполняется из БД при первом чтении и
+дальше пополняется публикациями; перед выдачей он сверяется с БД одним
+запросом MIN/MAX(id) по индексу (room, id): сообщения других процессов и
+созданные мимо send_message дочитываются, после чистки (purge_chat)
+буфер читается заново.
+
+Комнаты ищутся в RoomRegistry: (название, тип) -> id в памяти процесса,
+все комнаты читаются одним запросом при первом обращении, недостающая
+(приват, клан, локация) создаётся под блокировкой. ChatRoom.save() и
+delete() сбрасывают запись комнаты.
+"""
+import asyncio
+import json
+import threading
+from bisect import bisect_right, insort
+from collections import namedtuple
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils.module_loading import import_string
+
+from .models import ChatMessage, ChatRoom
+
+DEFAULT_SETTINGS = {
+    'BACKEND': 'game.chat.LocalBroker',
+    'OPTIONS': {},
+    'HEARTBEAT': 15,
+    'LONG_POLL_TIMEOUT': 25,
+}
+
+# Сообщений в ответе get_messages и при подключении потока
+CATCH_UP_LIMIT = 100
+
+# Вкладки чата - типы комнат; другие названия комнат не создают
+CHAT_TABS = frozenset(room_type for room_type, _ in ChatRoom.ROOM_TYPES)
+
+# Сериализованное сообщение: payload - JSON, text - событие SSE
+ChatEvent = namedtuple('ChatEvent', 'id payload text')
+
+
+def serialize_message(message):
+    return {
+        'id': message.id,
+        'time': message.timestamp.strftime('%H:%M'),
+        'sender': message.sender_name,
+        'text': message.message
+    }
+
+
+def make_event(message):
+    """Событие SSE с id сообщения - по нему браузер передаёт Last-Event-ID при переподключении"""
+    payload = json.dumps(serialize_message(message), ensure_ascii=False)
+    return ChatEvent(message.id, payload, f"id: {message.id}\nevent: message\ndata: {payload}\n\n")
+
+
+def load_events(room_id, limit, after=None):
+    """Последние limit сообщений комнаты (с id больше after) из БД по возрастанию id"""
+    messages = ChatMessage.objects.filter(room_id=room_id)
+    if after is not None:
+        messages = messages.filter(id__gt=after)
+    return [make_event(message) for message in reversed(messages.order_by('-id')[:limit])]
+
+
+def room_bounds(room_id):
+    """(id старейшего, id новейшего) сообщения комнаты в БД - один запрос по индексу (room, id)"""
+    bounds = ChatMessage.objects.filter(room_id=room_id).aggregate(oldest=Min('id'), newest=Max('id'))
+    return bounds['oldest'], bounds['newest']
+
+
+class RoomBuffer:
+    """
+    Последние size событий комнаты по возрастанию id.
+
+    floor - граница полноты: все сообщения комнаты с id больше floor
+    есть в буфере (0 - буфер содержит всю историю комнаты).
+    """
+
+    def __init__(self, size, events):
+        self.size = size
+        self.events = events
+        self.ids = [event.id for event in events]
+        self.floor = events[0].id - 1 if len(events) >= size else 0
+
+    def add(self, event):
+        position = bisect_right(self.ids, event.id)
+        if position and self.ids[position - 1] == event.id:
+            return
+        # Коммиты параллельных отправок могут публиковаться не по порядку id
+        self.ids.insert(position, event.id)
+        self.events.insert(position, event)
+        if len(self.events) > self.size:
+            self.floor = self.ids.pop(0)
+            self.events.pop(0)
+
+    def compare(self, oldest, newest):
+        """
+        Сверка с БД по room_bounds(): 'fresh' - буфер актуален, 'behind' -
+        в БД есть сообщения новее буфера, 'stale' - в буфере есть
+        удалённые из БД сообщения (чистка, удаление).
+        """
+        if not self.ids:
+            return 'fresh' if newest is None else 'behind'
+        if newest is None or self.ids[-1] > newest or self.ids[0] < oldest:
+            return 'stale'
+        return 'behind' if self.ids[-1] < newest else 'fresh'
+
+    def after(self, last_id, limit):
+        """(первые limit событий новее last_id, id новейшего) или None, если last_id старше буфера"""
+        if last_id < self.floor:
+            return None
+        position = bisect_right(self.ids, last_id)
+        newest = self.ids[-1] if position < len(self.ids) else last_id
+        return self.events[position:position + limit], newest
+
+
+class Subscription:
+    """
+    Подписка потока на комнату: очередь событий в цикле asyncio потока.
+
+    Публикация идёт из любого потока (синхронные view), в очередь событие
+    кладётся через call_soon_threadsafe. Переполненная очередь (читатель
+    не успевает) помечается overflowed - поток закрывается, клиент
+    переподключается и добирает пропущенное из БД.
+    """
+
+    def __init__(self, room_id, queue_size):
+        self.room_id = room_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    def deliver(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Цикл потока уже закрыт - подписка снимется в finally потока
+            pass
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout):
+        """Следующее событие (message_id, текст) или None по таймауту"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LocalBroker:
+    """Подписчики комнат в памяти процесса"""
+
+    def __init__(self, queue_size=256, buffer_size=200, **options):
+        self.queue_size = queue_size
+        self.buffer_size = buffer_size
+        self._rooms = {}
+        self._buffers = {}
+        self._lock = threading.Lock()
+        # Номер (id) последнего опубликованного сообщения комнаты
+        self._sequence = {}
+        # Ждущие долгого опроса: комната -> [Condition, число ждущих]
+        self._waiters = {}
+        # Комнаты, буфер которых читается из БД: комната -> [число читающих, опубликованные за это время]
+        self._loading = {}
+
+    def subscribe(self, room_id):
+        """Подписка для текущего цикла asyncio"""
+        subscription = Subscription(room_id, self.queue_size)
+        with self._lock:
+            self._rooms.setdefault(room_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._rooms.get(subscription.room_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._rooms[subscription.room_id]
+
+    def publish(self, room_id, event):
+        with self._lock:
+            subscribers = tuple(self._rooms.get(room_id, ()))
+            if event.id > self._sequence.get(room_id, 0):
+                self._sequence[room_id] = event.id
+            buffer = self._buffers.get(room_id)
+            if buffer is not None:
+                buffer.add(event)
+            loading = self._loading.get(room_id)
+            if loading is not None:
+                loading[1].append(event)
+            waiting = self._waiters.get(room_id)
+            if waiting is not None:
+                waiting[0].notify_all()
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def wait_for_message(self, room_id, last_id, timeout):
+        """Ждёт публикации в комнате сообщения новее last_id; False - вышло время"""
+        with self._lock:
+            waiting = self._waiters.get(room_id)
+            if waiting is None:
+                waiting = self._waiters[room_id] = [threading.Condition(self._lock), 0]
+            waiting[1] += 1
+            try:
+                return waiting[0].wait_for(lambda: self._sequence.get(room_id, 0) > last_id, timeout)
+            finally:
+                waiting[1] -= 1
+                if not waiting[1]:
+                    del self._waiters[room_id]
+
+    def recent(self, room_id, last_id, limit, bounds=None):
+        """
+        События комнаты новее last_id из буфера: (события, id новейшего)
+        или None, если история старше буфера.
+
+        bounds - room_bounds() комнаты: буфер, отставший от БД (сообщения
+        других процессов, системные, созданные мимо send_message),
+        дочитывается, а содержащий удалённые сообщения - читается заново.
+        """
+        since = None
+        with self._lock:
+            buffer = self._buffers.get(room_id)
+            if buffer is not None:
+                state = 'fresh' if bounds is None else buffer.compare(*bounds)
+                if state == 'fresh':
+                    return buffer.after(last_id, limit)
+                if state == 'stale':
+                    del self._buffers[room_id]
+                else:
+                    since = buffer.ids[-1] if buffer.ids else 0
+            loading = self._loading.setdefault(room_id, [0, []])
+            loading[0] += 1
+
+        # Чтение БД идёт без блокировки (она общая для всех комнат);
+        # публикации за время запроса копятся в _loading
+        events = None
+        try:
+            events = load_events(room_id, self.buffer_size, since)
+        finally:
+            with self._lock:
+                loading[0] -= 1
+                if not loading[0]:
+                    del self._loading[room_id]
+                if events is not None:
+                    buffer = self._install(room_id, events, since is None)
+                    if buffer is not None:
+                        # Повторы уже прочитанных из БД сообщений отсекаются по id
+                        for event in loading[1]:
+                            buffer.add(event)
+        return buffer.after(last_id, limit) if buffer is not None else None
+
+    def _install(self, room_id, events, complete):
+        """
+        Буфер комнаты с прочитанными из БД событиями (вызывать под _lock).
+
+        complete - события это последние сообщения комнаты, иначе -
+        дочитанные новее буфера. None - буфер сбросили, пока дочитывали.
+        """
+        buffer = self._buffers.get(room_id)
+        if complete:
+            # Буфер мог поставить параллельный читатель - он не хуже
+            if buffer is None:
+                buffer = self._buffers[room_id] = RoomBuffer(self.buffer_size, events)
+        elif len(events) >= self.buffer_size:
+            # Новых сообщений не меньше размера буфера - они и есть буфер
+            buffer = self._buffers[room_id] = RoomBuffer(self.buffer_size, events)
+        elif buffer is not None:
+            for event in events:
+                buffer.add(event)
+        return buffer
+
+    def forget(self, room_id=None):
+        """Сбрасывает буфер комнаты (или все) - после удаления сообщений из БД"""
+        with self._lock:
+            if room_id is None:
+                self._buffers.clear()
+            else:
+                self._buffers.pop(room_id, None)
+
+    def subscriber_count(self, room_id=None):
+        with self._lock:
+            if room_id is not None:
+                return len(self._rooms.get(room_id, ()))
+            return sum(len(subscribers) for subscribers in self._rooms.values())
+
+
+def get_chat_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'CHAT_BROKER', {})}
+
+
+class RoomRegistry:
+    """Id комнат чата по (названию, типу) в памяти процесса"""
+
+    def __init__(self):
+        self._ids = None
+        self._lock = threading.Lock()
+
+    def room_id(self, name, room_type=None):
+        """Id комнаты; тип по умолчанию совпадает с названием (вкладки world, trade...)"""
+        key = (name, room_type or name)
+        ids = self._ids
+        if ids is not None:
+            room_id = ids.get(key)
+            if room_id is not None:
+                return room_id
+        with self._lock:
+            if self._ids is None:
+                self._ids = {
+                    (room_name, kind): pk for pk, room_name, kind in ChatRoom.objects.values_list('id', 'name', 'room_type')
+                }
+            room_id = self._ids.get(key)
+            if room_id is None:
+                # get_or_create - комнату мог создать другой процесс
+                room_id = ChatRoom.objects.get_or_create(name=key[0], room_type=key[1])[0].pk
+                self._ids[key] = room_id
+            return room_id
+
+    def forget(self, room_id=None):
+        """Сбрасывает записи комнаты (или все) - после переименования или удаления"""
+        with self._lock:
+            if room_id is None or self._ids is None:
+                self._ids = None
+                return
+            for key in [key for key, pk in self._ids.items() if pk == room_id]:
+                del self._ids[key]
+
+
+_registry = RoomRegistry()
+
+
+def get_room_registry():
+    return _registry
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_chat_broker():
+    """Общий брокер процесса по settings.CHAT_BROKER"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                config = get_chat_settings()
+                _broker = import_string(config['BACKEND'])(**config['OPTIONS'])
+    return _broker
+
+
+def publish_message(message):
+    """Публикует сохранённое сообщение подписчикам комнаты после коммита транзакции"""
+    transaction.on_commit(partial(get_chat_broker().publish, message.room_id, make_event(message)))
+
+
+def recent_events(room_id, last_id):
+    """
+    Новые сообщения комнаты для get_messages: (первые CATCH_UP_LIMIT
+    событий после last_id, id новейшего). Из буфера брокера, сверенного
+    с БД запросом room_bounds(), история старше буфера - из БД.
+    """
+    recent = get_chat_broker().recent(room_id, last_id, CATCH_UP_LIMIT, room_bounds(room_id))
+    if recent is not None:
+        return recent
+    newest = ChatMessage.objects.filter(room_id=room_id, id__gt=last_id).order_by('-id').values_list('id', flat=True).first()
+    if newest is None:
+        return [], last_id
+    messages = ChatMessage.objects.filter(room_id=room_id, id__gt=last_id, id__lte=newest).order_by('id')[:CATCH_UP_LIMIT]
+    return [make_event(message) for message in messages], newest
+
+
+async def message_stream(room_id, last_id):
+    """
+    Поток SSE комнаты: сначала сообщения после last_id из БД, затем
+    публикации брокера; раз в HEARTBEAT секунд - комментарий-пинг, чтобы
+    прокси не закрывали соединение.
+    """
+    broker = get_chat_broker()
+    heartbeat = get_chat_settings()['HEARTBEAT']
+    # Подписка раньше чтения из БД - сообщение между ними не потеряется (повтор отсекается по id)
+    subscription = broker.subscribe(room_id)
+    try:
+        yield 'retry: 3000\n\n'
+        missed = ChatMessage.objects.filter(room_id=room_id, id__gt=last_id).order_by('id')[:CATCH_UP_LIMIT]
+        async for message in missed:
+            last_id = message.id
+            yield make_event(message).text
+
+        while not (subscription.overflowed and subscription.queue.empty()):
+            event = await subscription.get(heartbeat)
+            if event is None:
+                yield ': ping\n\n'
+                continue
+            if event.id > last_id:
+                last_id = event.id
+                yield event.text
+    finally:
+        broker.unsubscribe(subscription)
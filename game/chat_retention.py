@@ -0,0 +1,157 @@
+"""
+Срок хранения сообщений чата.
+
+У каждого типа комнаты свой срок (settings.CHAT_RETENTION): общий чат и
+торг живут дни, приваты - месяцы, клановые - без ограничения. Старые
+сообщения удаляются командой purge_chat (периодически, например из cron)
+небольшими пачками по индексу (room, timestamp): каждая пачка - отдельная
+короткая транзакция, поэтому удаление не блокирует чат. Перед удалением
+сообщения можно дописать в суточные файлы
+chat-<тип комнаты>-YYYY-MM-DD.jsonl.gz для модерации
+(search_chat_archive ищет по ним).
+
+    CHAT_RETENTION = {
+        'TTL_DAYS': {'world': 7, 'private': 90, 'clan': None},
+        'DEFAULT_TTL_DAYS': 30,
+        'EXPORT_DIR': None,
+    }
+
+None - хранить без ограничения; DEFAULT_TTL_DAYS - для типов, которых нет
+в TTL_DAYS.
+
+Кольцевые буферы брокера (game/chat.py) замечают удаление при следующей
+сверке с БД в get_messages и читаются заново.
+"""
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChatMessage, ChatRoom
+
+DEFAULT_BATCH_SIZE = 2000
+
+DEFAULT_SETTINGS = {
+    'TTL_DAYS': {},
+    'DEFAULT_TTL_DAYS': None,
+    'EXPORT_DIR': None,
+}
+
+EXPORT_FIELDS = ('id', 'room_id', 'room__name', 'room__room_type', 'user_id', 'sender_name', 'message', 'timestamp', 'is_system')
+
+
+def get_retention_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'CHAT_RETENTION', {})}
+
+
+def _dump(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def room_ttls(config=None):
+    """{id комнаты: срок хранения timedelta} для комнат с ограниченным сроком"""
+    config = config or get_retention_settings()
+    ttls = {}
+    for room_id, room_type in ChatRoom.objects.values_list('id', 'room_type'):
+        days = config['TTL_DAYS'].get(room_type, config['DEFAULT_TTL_DAYS'])
+        if days is not None:
+            ttls[room_id] = timedelta(days=days)
+    return ttls
+
+
+def export_to_files(rows, export_dir):
+    """Дописывает сообщения в суточные файлы export_dir/chat-<тип>-YYYY-MM-DD.jsonl.gz"""
+    os.makedirs(export_dir, exist_ok=True)
+    by_file = {}
+    for row in rows:
+        by_file.setdefault((row['room__room_type'], row['timestamp'].date()), []).append(row)
+
+    for (room_type, day), day_rows in by_file.items():
+        path = os.path.join(export_dir, f'chat-{room_type}-{day.isoformat()}.jsonl.gz')
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for row in day_rows:
+                f.write(_dump({
+                    'id': row['id'],
+                    'room_id': row['room_id'],
+                    'room': row['room__name'],
+                    'room_type': row['room__room_type'],
+                    'user_id': row['user_id'],
+                    'sender': row['sender_name'],
+                    'text': row['message'],
+                    'timestamp': row['timestamp'],
+                    'is_system': row['is_system'],
+                }) + '\n')
+
+
+def purge_batch(room_id, cutoff, batch_size=DEFAULT_BATCH_SIZE, export_dir=None):
+    """
+    Удаляет одну пачку сообщений комнаты старше cutoff.
+
+    Возвращает число удалённых (0 - удалять больше нечего).
+    """
+    with transaction.atomic():
+        ids = list(
+            ChatMessage.objects.filter(room_id=room_id, timestamp__lt=cutoff)
+            .order_by('timestamp').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0
+        if export_dir:
+            # Файл пишется до удаления: при сбое сообщение попадёт в файл повторно, но не пропадёт
+            export_to_files(ChatMessage.objects.filter(id__in=ids).order_by('id').values(*EXPORT_FIELDS), export_dir)
+        ChatMessage.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def purge_expired_messages(batch_size=DEFAULT_BATCH_SIZE, max_batches=None, pause=0.0, export_dir=None, now=None):
+    """
+    Удаляет сообщения старше срока хранения их комнаты пачками по batch_size.
+
+    pause - пауза между пачками (секунды), чтобы освобождать БД для чата.
+    Возвращает {id комнаты: число удалённых сообщений}.
+    """
+    now = now or timezone.now()
+    purged = {}
+    batches = 0
+    for room_id, ttl in room_ttls().items():
+        cutoff = now - ttl
+        while max_batches is None or batches < max_batches:
+            deleted = purge_batch(room_id, cutoff, batch_size, export_dir)
+            if not deleted:
+                break
+            purged[room_id] = purged.get(room_id, 0) + deleted
+            batches += 1
+            if pause:
+                time.sleep(pause)
+    return purged
+
+
+def search_archive(export_dir, since=None, until=None, room_type=None, user_id=None, sender=None, text=None):
+    """
+    Сообщения из файлов выгрузки за дни since..until (даты, включительно).
+
+    Фильтры: тип комнаты, user_id, отправитель и подстрока текста (без учёта регистра).
+    """
+    prefix = f'chat-{room_type}-' if room_type else 'chat-'
+    text = text.lower() if text else None
+    for name in sorted(os.listdir(export_dir)):
+        if not name.startswith(prefix) or not name.endswith('.jsonl.gz'):
+            continue
+        day = name[-len('YYYY-MM-DD.jsonl.gz'):-len('.jsonl.gz')]
+        if (since and day < since.isoformat()) or (until and day > until.isoformat()):
+            continue
+        with gzip.open(os.path.join(export_dir, name), 'rt', encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                if user_id is not None and row['user_id'] != user_id:
+                    continue
+                if sender and row['sender'] != sender:
+                    continue
+                if text and text not in row['text'].lower():
+                    continue
+                yield row
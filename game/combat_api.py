@@ -1,12 +1,111 @@
 import json
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.http import JsonResponse, HttpResponseBadRequest, Http404
-from django.shortcuts import get_object_or_404
-from django.views.decorators.http import require_POST, require_GET
+from django.views.decorators.http import require_POST, require_GET, condition
 from django.contrib.auth.decorators import login_required
 
 from .models import Combat, PlayerProfile
-from .combat_logic import start_battle, handle_player_turn, finish_battle
+from .combat_store import get_combat_store
+from .combat_logic import (
+    ZONES, start_battle, play_turn, new_combat_seed,
+    events_since, render_log,
+)
+from .group_combat import is_group_state, render_group_log
+
+# Поля состояния, которые меняются по ходу боя (остальное - неизменные снимки)
+DYNAMIC_FIELDS = ('status', 'turn', 'winner', 'finish_message')
+
+def public_state(state):
+    """Состояние боя без лога"""
+    return {key: value for key, value in state.items() if key not in ('events', 'log')}
+
+def state_changes(state):
+    """Изменяемая часть состояния боя"""
+    changes = {key: state[key] for key in DYNAMIC_FIELDS if key in state}
+    if is_group_state(state):
+        changes['fighters'] = [
+            {'current_hp': fighter['current_hp'], 'alive': fighter['alive']} for fighter in state['fighters']
+        ]
+        return changes
+    changes['player'] = {'current_hp': state['player']['current_hp']}
+    changes['monster'] = {'current_hp': state['monster']['current_hp']}
+    return changes
+
+def combat_log(state, events=None):
+    """Текстовый лог одиночного или группового боя"""
+    if is_group_state(state):
+        return render_group_log(state, events)
+    return render_log(state, events)
+
+def combat_payload(combat_id, version, state, since=None, **extra):
+    """
+    Ответ API по бою.
+
+    since - версия боя, известная клиенту (версия = число обработанных ходов
+    = номер хода последнего события лога). Без since отдаётся полное
+    состояние и весь лог, иначе - только изменившиеся поля и новые события.
+    """
+    payload = {"combat_id": str(combat_id), "version": version}
+
+    if since is None:
+        payload["state"] = public_state(state)
+        payload["events"] = events_since(state, None)
+        payload["log"] = combat_log(state)
+    elif since >= version:
+        payload["changes"] = {}
+        payload["events"] = []
+        payload["log"] = []
+    else:
+        events = events_since(state, since)
+        payload["changes"] = state_changes(state)
+        payload["events"] = events
+        payload["log"] = combat_log(state, events)
+
+    payload.update(extra)
+    return payload
+
+def combat_response(payload, **kwargs):
+    """JsonResponse без \\u-экранирования кириллицы (лог в 2-3 раза короче)"""
+    return JsonResponse(payload, json_dumps_params={'ensure_ascii': False}, **kwargs)
+
+def combat_etag(combat_id, version):
+    """ETag состояния боя"""
+    return f'"{combat_id}-{version}"'
+
+def _parse_since(value):
+    """Версия из запроса: None, если не передана или некорректна"""
+    try:
+        return int(value) if value is not None else None
+    except (ValueError, TypeError):
+        return None
+
+def _combat_state_etag(request, combat_id):
+    """ETag для api_combat_state без чтения JSON состояния"""
+    entry = get_combat_store().peek(combat_id)
+    if entry is not None:
+        if entry['owner_id'] != request.user.id:
+            return None
+        version = entry['version']
+    else:
+        version = Combat.objects.filter(id=combat_id, owner=request.user).values_list('version', flat=True).first()
+        if version is None:
+            return None
+    return combat_etag(combat_id, version)
+
+def _active_combat(user):
+    """(id, режим) активного боя игрока или None"""
+    return Combat.objects.filter(owner=user, status='active').values_list('id', 'state__mode').first()
+
+def _already_in_combat(combat_id, mode):
+    """
+    Ответ api_hunt, когда у игрока уже идёт бой.
+
+    Групповой бой не отдаётся как already_in_combat: клиент открыл бы его
+    экраном одиночного боя.
+    """
+    if mode == 'group':
+        return JsonResponse({"error": "Вы участвуете в групповом бою"}, status=409)
+    return JsonResponse({"combat_id": str(combat_id), "status": "already_in_combat"})
 
 @require_POST
 @login_required
@@ -16,24 +115,34 @@ def api_hunt(request):
     Запуск боя с монстром
     """
     try:
-        profile = PlayerProfile.objects.get(user=request.user)
+        profile = PlayerProfile.objects.select_related('current_location').get(user=request.user)
     except PlayerProfile.DoesNotExist:
         return HttpResponseBadRequest("Player profile not found")
 
     if profile.current_hp <= 0:
         return JsonResponse({"error": "Вы слишком слабы для боя. Подлечитесь!"}, status=400)
 
-    # Проверяем, нет ли уже активного боя
-    active_combat = Combat.objects.filter(owner=request.user, state__status='active').first()
-    if active_combat:
-        return JsonResponse({"combat_id": str(active_combat.id), "status": "already_in_combat"})
-
-    combat_state = start_battle(profile)
+    # Проверяем, нет ли уже активного боя (индекс по owner + status)
+    active = _active_combat(request.user)
+    if active:
+        return _already_in_combat(*active)
 
-    with transaction.atomic():
-        combat = Combat.objects.create(owner=request.user, state=combat_state)
+    seed = new_combat_seed()
+    combat_state = start_battle(profile, seed=seed)
 
-    return JsonResponse({"combat_id": str(combat.id), "state": combat_state})
+    try:
+        with transaction.atomic():
+            combat = Combat.objects.create(owner=request.user, state=combat_state, seed=seed)
+    except IntegrityError:
+        # Параллельный запрос уже начал бой (unique_active_combat_per_owner)
+        active = _active_combat(request.user)
+        if active is None:
+            # Нарушено другое ограничение - это не гонка за активный бой
+            raise
+        return _already_in_combat(*active)
+    get_combat_store().add(combat)
+
+    return combat_response(combat_payload(combat.id, combat.version, combat_state))
 
 @require_POST
 @login_required
@@ -41,50 +150,56 @@ def api_combat_turn(request, combat_id):
     """
     POST /api/combat/<combat_id>/turn
     Обработка хода игрока
-    Тело: {"attack_zone": 1, "defense_zones": [1, 2]}
+    Тело: {"attack_zone": 1, "defense_zones": [1, 2], "since": 3}
+    В ответе только изменения после версии since (по умолчанию - изменения этого хода).
     """
     try:
         data = json.loads(request.body)
         attack_zone = int(data.get('attack_zone'))
         defense_zones = [int(z) for z in data.get('defense_zones', [])]
-    except (json.JSONDecodeError, ValueError, TypeError):
+        since = _parse_since(data.get('since'))
+    except (json.JSONDecodeError, ValueError, TypeError, AttributeError):
         return HttpResponseBadRequest("Invalid input data")
 
-    if not attack_zone or len(defense_zones) != 2:
+    if attack_zone not in ZONES or len(defense_zones) != 2 or len(set(defense_zones)) != 2 \
+            or not all(zone in ZONES for zone in defense_zones):
         return JsonResponse({"error": "Выберите 1 зону атаки и 2 зоны защиты"}, status=400)
 
-    try:
-        with transaction.atomic():
-            combat_obj = Combat.objects.select_for_update().get(id=combat_id, owner=request.user)
-            state = combat_obj.state
-
-            if state.get('status') != 'active':
-                return JsonResponse({"combat_id": str(combat_obj.id), "state": state, "message": "Бой уже завершен"})
-
-            # Обработка хода
-            new_state = handle_player_turn(state, attack_zone, defense_zones)
+    # Бой берётся из хранилища активных боёв, в БД он пишется раз в несколько ходов
+    store = get_combat_store()
+    with store.turn(combat_id, owner_id=request.user.id) as entry:
+        if entry is None:
+            raise Http404("Combat not found")
+        state = entry['state']
+        if is_group_state(state):
+            return JsonResponse({"error": "Это групповой бой"}, status=400)
 
-            # Если бой завершился на этом ходу
-            message = ""
-            if new_state['status'] in ['victory', 'defeat']:
-                profile = PlayerProfile.objects.get(user=request.user)
-                message = finish_battle(combat_obj, profile)
-                new_state['finish_message'] = message
+        if state.get('status') != 'active':
+            payload = combat_payload(entry['id'], entry['version'], state, since, message="Бой уже завершен")
+            return combat_response(payload)
 
-            combat_obj.state = new_state
-            combat_obj.save(update_fields=["state", "updated_at"])
+        if since is None:
+            since = entry['version']
 
-    except Combat.DoesNotExist:
-        raise Http404("Combat not found")
+        # Игрок сходил сам - счётчик пропущенных по таймауту ходов сбрасывается
+        entry['idle'] = 0
+        message = play_turn(store, entry, attack_zone, defense_zones)
+        # Ответ собирается под блокировкой: запись в кэше общая для запросов
+        payload = combat_payload(entry['id'], entry['version'], state, since, message=message)
 
-    return JsonResponse({"combat_id": str(combat_obj.id), "state": new_state, "message": message})
+    return combat_response(payload)
 
 @require_GET
 @login_required
+@condition(etag_func=_combat_state_etag)
 def api_combat_state(request, combat_id):
     """
-    GET /api/combat/<combat_id>/state
-    Получение текущего состояния боя
+    GET /api/combat/<combat_id>/state?since=3
+    Получение текущего состояния боя (или изменений после версии since).
+    Поддерживает If-None-Match: если бой не изменился, ответ 304.
     """
-    combat = get_object_or_404(Combat, id=combat_id, owner=request.user)
-    return JsonResponse({"combat_id": str(combat.id), "state": combat.state})
+    entry = get_combat_store().load(combat_id, owner_id=request.user.id)
+    if entry is None:
+        raise Http404("Combat not found")
+    since = _parse_since(request.GET.get('since'))
+    return combat_response(combat_payload(entry['id'], entry['version'], entry['state'], since))
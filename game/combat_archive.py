@@ -0,0 +1,126 @@
+"""
+Архивация завершённых боёв.
+
+Завершённые бои старше порога переносятся из Combat в CombatArchive
+небольшими пачками: каждая пачка - отдельная короткая транзакция, поэтому
+архивация не блокирует идущие бои. Полное состояние сжимается (zlib) в
+CombatArchive.payload или дописывается в суточные файлы JSONL.gz.
+"""
+import gzip
+import json
+import os
+import time
+import zlib
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Combat, CombatArchive
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def _dump(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def summarize(combat):
+    """Строка CombatArchive для боя (без сохранения)"""
+    state = combat.state or {}
+    monster = state.get('monster', {})
+    won = combat.status == 'victory'
+    return CombatArchive(
+        id=combat.id,
+        owner_id=combat.owner_id,
+        created_at=combat.created_at,
+        finished_at=combat.updated_at,
+        status=combat.status,
+        winner=state.get('winner'),
+        turns=combat.version,
+        monster_name=monster.get('name', ''),
+        xp_reward=monster.get('xp_reward', 10) if won else 0,
+        coin_reward=monster.get('coin_reward', 5) if won else 0,
+        seed=combat.seed,
+    )
+
+
+def compress(combat):
+    """Сжатое полное состояние боя для CombatArchive.payload"""
+    data = {'state': combat.state, 'inputs': combat.inputs, 'version': combat.version}
+    return zlib.compress(_dump(data).encode('utf-8'), 6)
+
+
+def export_to_files(combats, export_dir):
+    """Дописывает бои в суточные файлы export_dir/combats-YYYY-MM-DD.jsonl.gz"""
+    os.makedirs(export_dir, exist_ok=True)
+    by_day = {}
+    for combat in combats:
+        by_day.setdefault(combat.updated_at.date(), []).append(combat)
+
+    for day, day_combats in by_day.items():
+        path = os.path.join(export_dir, f'combats-{day.isoformat()}.jsonl.gz')
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for combat in day_combats:
+                f.write(_dump({
+                    'id': combat.id,
+                    'owner_id': combat.owner_id,
+                    'created_at': combat.created_at,
+                    'finished_at': combat.updated_at,
+                    'status': combat.status,
+                    'seed': combat.seed,
+                    'version': combat.version,
+                    'inputs': combat.inputs,
+                    'state': combat.state,
+                }) + '\n')
+
+
+def archive_batch(cutoff, batch_size=DEFAULT_BATCH_SIZE, export_dir=None):
+    """
+    Архивирует одну пачку завершённых боёв, обновлённых до cutoff.
+
+    Возвращает число перенесённых боёв (0 - архивировать больше нечего).
+    """
+    with transaction.atomic():
+        combats = list(
+            Combat.objects
+            .filter(updated_at__lt=cutoff)
+            .exclude(status='active')
+            .order_by('updated_at')[:batch_size]
+        )
+        if not combats:
+            return 0
+
+        archives = [summarize(combat) for combat in combats]
+        if export_dir:
+            # Файл пишется до удаления: при сбое бой попадёт в файл повторно, но не пропадёт
+            export_to_files(combats, export_dir)
+        else:
+            for archive, combat in zip(archives, combats):
+                archive.payload = compress(combat)
+
+        CombatArchive.objects.bulk_create(archives, ignore_conflicts=True)
+        Combat.objects.filter(id__in=[combat.id for combat in combats]).delete()
+    return len(combats)
+
+
+def archive_finished_combats(older_than=timedelta(days=7), batch_size=DEFAULT_BATCH_SIZE,
+                             max_batches=None, pause=0.0, export_dir=None):
+    """
+    Архивирует завершённые бои старше older_than пачками по batch_size.
+
+    pause - пауза между пачками (секунды), чтобы освобождать БД для игры.
+    Возвращает общее число перенесённых боёв.
+    """
+    cutoff = timezone.now() - older_than
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        archived = archive_batch(cutoff, batch_size, export_dir)
+        if not archived:
+            break
+        total += archived
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return total
@@ -1,7 +1,10 @@
 import random
+import secrets
+from django.db import transaction
 from django.utils import timezone
-from .npc_templates import MONSTER_TEMPLATES
-from .models import PlayerProfile, InventoryItem, Combat, CurrencyTransaction
+from .ledger import LedgerError, credit
+from .monster_catalog import get_monster_catalog
+from .models import PlayerProfile, Combat
 
 ZONES = {
     1: "Голова",
@@ -10,43 +13,200 @@ ZONES = {
     4: "Ноги"
 }
 
-def start_battle(player_profile):
-    """Инициализация боя с монстром"""
-    monster_template = random.choice(MONSTER_TEMPLATES)
-
-    # Копия монстра для боя
-    monster = monster_template.copy()
-    monster['current_hp'] = monster['hp']
-    monster['max_hp'] = monster['hp']
-
+ARMOR_KEYS = {1: 'armor_head', 2: 'armor_body', 3: 'armor_waist', 4: 'armor_legs'}
+
+# Лог боя хранится как список событий [turn, actor, zone, result, damage, hp_after]
+# и превращается в текст только при выводе (render_log)
+ACTOR_SYSTEM = 0
+ACTOR_PLAYER = 1
+ACTOR_MONSTER = 2
+
+RESULT_CODES = {
+    'hit': 0,
+    'crit': 1,
+    'block': 2,
+    'dodge': 3,
+    'parry': 4,
+    'miss': 5,
+    'start': 6,
+    'victory': 7,
+    'defeat': 8,
+    'death': 9,  # участник группового боя выбыл (group_combat)
+    'abandoned': 10,  # групповой бой прерван по таймауту (combat_timeouts.forfeit)
+}
+RESULT_NAMES = {code: name for name, code in RESULT_CODES.items()}
+
+def new_combat_seed():
+    """Случайный seed для нового боя"""
+    return secrets.randbits(62)
+
+def combat_rng(seed, turn):
+    """
+    Генератор случайных чисел для конкретного хода боя.
+
+    Ход 0 - старт боя (выбор монстра). Генератор зависит только от
+    (seed, turn), поэтому любой ход можно переиграть без хранения
+    состояния генератора.
+    """
+    return random.Random(f"{seed}:{turn}")
+
+def encode_input(attack_zone, defense_zones):
+    """Ход игрока одним числом: 1 23 -> 123 (атака 1, защита 2 и 3)"""
+    first, second = defense_zones
+    return attack_zone * 100 + first * 10 + second
+
+def decode_input(value):
+    """Обратное преобразование encode_input()"""
+    return value // 100, [value // 10 % 10, value % 10]
+
+def build_player_data(player_profile, num_attacks=None):
+    """Снимок характеристик игрока для состояния боя"""
+    derived = player_profile.derived_stats()
     player_data = {
-        'id': player_profile.user.id,
+        'id': player_profile.user_id,
         'name': player_profile.name,
         'level': player_profile.level,
         'current_hp': player_profile.current_hp,
         'max_hp': player_profile.max_hp,
         'stats': player_profile.get_combat_stats(),
-        'strength': player_profile.get_total_strength(),
-        'agility': player_profile.get_total_agility(),
-        'intuition': player_profile.get_total_intuition(),
+        'strength': derived['strength'],
+        'agility': derived['agility'],
+        'intuition': derived['intuition'],
     }
+    # HP на старте нужен для повтора боя
+    player_data['start_hp'] = player_data['current_hp']
+
+    if num_attacks is None:
+        # Количество ударов - по количеству надетого оружия (без отдельного запроса)
+        num_attacks = player_profile.equipped_weapons
+    player_data['num_attacks'] = max(1, num_attacks)
+
+    return player_data
+
+def start_battle(player_profile, seed=None, location=None):
+    """
+    Инициализация боя с монстром.
+
+    Монстр выбирается из каталога по уровню игрока и локации
+    (по умолчанию - текущей локации игрока).
+    """
+    rng = combat_rng(seed, 0) if seed is not None else random
+    if location is None and player_profile.current_location_id:
+        location = player_profile.current_location.name
+    monster = get_monster_catalog().pick(player_profile.level, location, rng).to_state()
+
+    player_data = build_player_data(player_profile)
 
-    # Считаем количество ударов (по количеству оружия)
-    equipped_weapons = InventoryItem.objects.filter(owner=player_profile, is_equipped=True, item__type='weapon').count()
-    player_data['num_attacks'] = max(1, equipped_weapons)
+    return new_combat_state(player_data, monster)
 
+def new_combat_state(player_data, monster):
+    """Начальное состояние боя"""
     combat_state = {
         'player': player_data,
         'monster': monster,
-        'log': ['Бой начался!'],
+        'events': [],
         'status': 'active', # active, victory, defeat
         'turn': 1,
         'winner': None
     }
-
+    add_event(combat_state, ACTOR_SYSTEM, 'start', turn=0)
     return combat_state
 
-def calculate_damage(attacker_stats, defender_stats, attack_zone, defense_zones):
+def add_event(combat_state, actor, result, zone=0, damage=0, hp_after=0, turn=None):
+    """Добавляет событие в лог боя"""
+    if turn is None:
+        turn = combat_state['turn']
+    combat_state.setdefault('events', []).append([turn, actor, zone, RESULT_CODES[result], damage, hp_after])
+
+def render_event(event, combat_state):
+    """Текст одного события лога"""
+    turn, actor, zone, code, damage, hp_after = event
+    result = RESULT_NAMES[code]
+
+    if result == 'start':
+        return "Бой начался!"
+    if result == 'victory':
+        return "Монстр повержен!"
+    if result == 'defeat':
+        return "Вы проиграли..."
+
+    if actor == ACTOR_PLAYER:
+        msg = f"Игрок ударил {ZONES[zone]} монстра"
+        if result == "dodge": return "Монстр увернулся от удара игрока"
+        if result == "parry": return "Монстр парировал удар игрока"
+        if result == "miss": return "Игрок промахнулся"
+        max_hp = combat_state['monster']['max_hp']
+    else:
+        msg = f"Монстр ударил {ZONES[zone]} игрока"
+        if result == "dodge": return "Игрок увернулся от удара монстра"
+        if result == "parry": return "Вы парировали удар монстра"
+        if result == "miss": return "Монстр промахнулся"
+        max_hp = combat_state['player']['max_hp']
+
+    if result == "crit": msg += " (КРИТ)"
+    elif result == "block": msg += " (БЛОК)"
+    return msg + f" на -{damage} HP. [{hp_after}/{max_hp}]"
+
+def events_since(combat_state, last_turn):
+    """События после хода last_turn (None - все события)"""
+    events = combat_state.get('events', [])
+    if last_turn is None:
+        return list(events)
+    return [event for event in events if event[0] > last_turn]
+
+def render_log(combat_state, events=None):
+    """
+    Текстовый лог боя.
+
+    events - подмножество событий (по умолчанию весь лог). Бои, начатые до
+    появления событий, хранят старый текстовый 'log' - он выводится первым.
+    """
+    if events is not None:
+        return [render_event(event, combat_state) for event in events]
+    lines = list(combat_state.get('log', []))
+    lines.extend(render_event(event, combat_state) for event in combat_state.get('events', []))
+    return lines
+
+def player_attacker_stats(player):
+    """Параметры атаки игрока для calculate_damage"""
+    return {
+        'damage_min': player['stats']['phys_damage_min'],
+        'damage_max': player['stats']['phys_damage_max'],
+        'crit_chance': player['stats']['crit_chance'],
+        'strength': player['strength'],
+        'intuition': player['intuition']
+    }
+
+def player_defender_stats(player):
+    """Параметры защиты игрока для calculate_damage"""
+    return {
+        'armor_head': player['stats']['armor_head'],
+        'armor_body': player['stats']['armor_body'],
+        'armor_waist': player['stats']['armor_waist'],
+        'armor_legs': player['stats']['armor_legs'],
+        'dodge_chance': player['stats']['dodge_chance'],
+        'agility': player['agility']
+    }
+
+def monster_attacker_stats(monster):
+    """Параметры атаки монстра для calculate_damage"""
+    return {
+        'damage_min': monster['damage_min'],
+        'damage_max': monster['damage_max'],
+        'crit_chance': monster['crit_chance'],
+        'strength': monster['strength'],
+        'intuition': monster['intuition']
+    }
+
+def monster_defender_stats(monster):
+    """Параметры защиты монстра для calculate_damage"""
+    return {
+        'armor': monster['armor'],
+        'dodge_chance': monster['dodge_chance'],
+        'agility': monster['agility']
+    }
+
+def calculate_damage(attacker_stats, defender_stats, attack_zone, defense_zones, rng=random):
     """Расчет результата одного удара"""
     # attacker_stats: {damage_min, damage_max, crit_chance, strength, intuition, ...}
     # defender_stats: {armor, dodge_chance, agility, ...}
@@ -56,17 +216,17 @@ def calculate_damage(attacker_stats, defender_stats, attack_zone, defense_zones)
     result_type = "hit" # hit, crit, dodge, block, parry, miss
 
     # 1. Промах (базовый шанс 5%)
-    if random.randint(1, 100) <= 5:
+    if rng.randint(1, 100) <= 5:
         return 0, "miss", "Промахнулся"
 
     # 2. Уворот (зависит от ловкости защитника)
     dodge_chance = defender_stats.get('dodge_chance', 0)
-    if random.randint(1, 100) <= dodge_chance:
+    if rng.randint(1, 100) <= dodge_chance:
         return 0, "dodge", "Увернулся"
 
     # 3. Парирование (шанс парирования)
     parry_chance = defender_stats.get('parry', 0)
-    if random.randint(1, 100) <= parry_chance:
+    if rng.randint(1, 100) <= parry_chance:
         return 0, "parry", "Парировал"
 
     # 4. Блок
@@ -76,12 +236,12 @@ def calculate_damage(attacker_stats, defender_stats, attack_zone, defense_zones)
     # 5. Крит (зависит от удачи/интуиции)
     is_crit = False
     crit_chance = attacker_stats.get('crit_chance', 0)
-    if random.randint(1, 100) <= crit_chance:
+    if rng.randint(1, 100) <= crit_chance:
         is_crit = True
         result_type = "crit"
 
     # 4. Урон
-    base_damage = random.randint(attacker_stats.get('damage_min', 1), attacker_stats.get('damage_max', 5))
+    base_damage = rng.randint(attacker_stats.get('damage_min', 1), attacker_stats.get('damage_max', 5))
     # Бонус от силы: +10% за каждую единицу силы выше 3
     strength = attacker_stats.get('strength', 3)
     damage = base_damage * (1 + (max(0, strength - 3) * 0.1))
@@ -94,19 +254,18 @@ def calculate_damage(attacker_stats, defender_stats, attack_zone, defense_zones)
 
     # Вычитаем броню (броня в конкретной зоне?)
     # defender_stats может иметь armor_head, armor_body, etc.
-    armor_keys = {1: 'armor_head', 2: 'armor_body', 3: 'armor_waist', 4: 'armor_legs'}
-    armor = defender_stats.get(armor_keys.get(attack_zone, 'armor'), 0)
+    armor = defender_stats.get(ARMOR_KEYS.get(attack_zone, 'armor'), 0)
     damage = max(1, damage - armor)
 
     return int(damage), result_type, ""
 
-def handle_player_turn(combat_state, attack_zone, defense_zones):
+def handle_player_turn(combat_state, attack_zone, defense_zones, rng=random):
     """Обработка хода игрока"""
     player = combat_state['player']
     monster = combat_state['monster']
 
     # AI монстра для этого хода
-    npc_attack_zone, npc_defense_zones = handle_npc_turn(monster)
+    npc_attack_zone, npc_defense_zones = handle_npc_turn(monster, rng)
 
     # 1. Игрок бьет монстра
     player_attacks = player.get('num_attacks', 1)
@@ -114,34 +273,14 @@ def handle_player_turn(combat_state, attack_zone, defense_zones):
         # Если игрок бьет несколько раз, он может бить в одну зону или разные?
         # В OldBK обычно в одну выбранную зону.
         dmg, res, _ = calculate_damage(
-            attacker_stats={
-                'damage_min': player['stats']['phys_damage_min'],
-                'damage_max': player['stats']['phys_damage_max'],
-                'crit_chance': player['stats']['crit_chance'],
-                'strength': player['strength'],
-                'intuition': player['intuition']
-            },
-            defender_stats={
-                'armor': monster['armor'],
-                'dodge_chance': monster['dodge_chance'],
-                'agility': monster['agility']
-            },
+            attacker_stats=player_attacker_stats(player),
+            defender_stats=monster_defender_stats(monster),
             attack_zone=attack_zone,
-            defense_zones=npc_defense_zones
+            defense_zones=npc_defense_zones,
+            rng=rng
         )
         monster['current_hp'] = max(0, monster['current_hp'] - dmg)
-
-        msg = f"Игрок ударил {ZONES[attack_zone]} монстра"
-        if res == "crit": msg += " (КРИТ)"
-        elif res == "block": msg += " (БЛОК)"
-        elif res == "dodge": msg = "Монстр увернулся от удара игрока"
-        elif res == "parry": msg = "Монстр парировал удар игрока"
-        elif res == "miss": msg = "Игрок промахнулся"
-
-        if res not in ["dodge", "parry", "miss"]:
-            msg += f" на -{dmg} HP. [{monster['current_hp']}/{monster['max_hp']}]"
-
-        combat_state['log'].append(msg)
+        add_event(combat_state, ACTOR_PLAYER, res, attack_zone, dmg, monster['current_hp'])
 
         if monster['current_hp'] <= 0:
             break
@@ -150,81 +289,104 @@ def handle_player_turn(combat_state, attack_zone, defense_zones):
     if monster['current_hp'] <= 0:
         combat_state['status'] = 'victory'
         combat_state['winner'] = 'player'
-        combat_state['log'].append("Монстр повержен!")
+        add_event(combat_state, ACTOR_SYSTEM, 'victory')
         return combat_state
 
     # 2. Монстр бьет игрока
     dmg, res, _ = calculate_damage(
-        attacker_stats={
-            'damage_min': monster['damage_min'],
-            'damage_max': monster['damage_max'],
-            'crit_chance': monster['crit_chance'],
-            'strength': monster['strength'],
-            'intuition': monster['intuition']
-        },
-        defender_stats={
-            'armor_head': player['stats']['armor_head'],
-            'armor_body': player['stats']['armor_body'],
-            'armor_waist': player['stats']['armor_waist'],
-            'armor_legs': player['stats']['armor_legs'],
-            'dodge_chance': player['stats']['dodge_chance'],
-            'agility': player['agility']
-        },
+        attacker_stats=monster_attacker_stats(monster),
+        defender_stats=player_defender_stats(player),
         attack_zone=npc_attack_zone,
-        defense_zones=defense_zones
+        defense_zones=defense_zones,
+        rng=rng
     )
     player['current_hp'] = max(0, player['current_hp'] - dmg)
-
-    msg = f"Монстр ударил {ZONES[npc_attack_zone]} игрока"
-    if res == "crit": msg += " (КРИТ)"
-    elif res == "block": msg += " (БЛОК)"
-    elif res == "dodge": msg = "Игрок увернулся от удара монстра"
-    elif res == "parry": msg = "Вы парировали удар монстра"
-    elif res == "miss": msg = "Монстр промахнулся"
-
-    if res not in ["dodge", "parry", "miss"]:
-        msg += f" на -{dmg} HP. [{player['current_hp']}/{player['max_hp']}]"
-
-    combat_state['log'].append(msg)
+    add_event(combat_state, ACTOR_MONSTER, res, npc_attack_zone, dmg, player['current_hp'])
 
     # Проверка смерти игрока
     if player['current_hp'] <= 0:
         combat_state['status'] = 'defeat'
         combat_state['winner'] = 'monster'
-        combat_state['log'].append("Вы проиграли...")
+        add_event(combat_state, ACTOR_SYSTEM, 'defeat')
 
     combat_state['turn'] += 1
     return combat_state
 
-def handle_npc_turn(monster):
+def handle_npc_turn(monster, rng=random):
     """AI монстра: выбор атаки и защиты"""
-    attack_zone = random.randint(1, 4)
+    attack_zone = rng.randint(1, 4)
     # Выбор 2 уникальных зон защиты
-    defense_zones = random.sample(range(1, 5), 2)
+    defense_zones = rng.sample(range(1, 5), 2)
     return attack_zone, defense_zones
 
-def finish_battle(combat_obj, player_profile):
-    """Завершение боя и выдача наград"""
-    state = combat_obj.state
+def replay_battle(combat_state, seed, inputs):
+    """
+    Повтор боя по seed и списку ходов игрока (encode_input).
+
+    Берёт из combat_state только снимки игрока и монстра, сбрасывает их HP
+    на стартовые и заново разыгрывает все ходы. Возвращает новое состояние,
+    исходное не изменяется.
+    """
+    player = dict(combat_state['player'])
+    player['current_hp'] = player.get('start_hp', player['max_hp'])
+    monster = dict(combat_state['monster'])
+    monster['current_hp'] = monster['max_hp']
+
+    state = new_combat_state(player, monster)
+    for value in inputs:
+        if state['status'] != 'active':
+            break
+        attack_zone, defense_zones = decode_input(value)
+        handle_player_turn(state, attack_zone, defense_zones, rng=combat_rng(seed, state['turn']))
+    return state
+
+def verify_battle(combat_obj):
+    """
+    Сверяет сохранённый исход боя с повтором.
+
+    Возвращает (совпадает ли, повторённое состояние).
+    """
+    if combat_obj.seed is None:
+        raise ValueError("Бой создан без seed и не может быть повторён")
+
+    stored = combat_obj.state
+    if stored.get('mode') == 'group':
+        # Состояние без 'player'/'monster' - повтор через group_combat.replay_group_battle
+        raise ValueError("Групповой бой не повторяется этой проверкой")
+    replayed = replay_battle(stored, combat_obj.seed, combat_obj.inputs)
+    if stored.get('status') == 'abandoned' and replayed['status'] == 'active':
+        # Бой прерван по таймауту хода (combat_timeouts.forfeit)
+        replayed['status'] = 'abandoned'
+        replayed['winner'] = stored.get('winner')
+        add_event(replayed, ACTOR_SYSTEM, 'defeat')
+    keys = ('status', 'winner', 'turn', 'events')
+    matches = (
+        all(stored.get(key) == replayed[key] for key in keys)
+        and stored['player']['current_hp'] == replayed['player']['current_hp']
+        and stored['monster']['current_hp'] == replayed['monster']['current_hp']
+    )
+    return matches, replayed
+
+def finish_battle(state, player_profile):
+    """Завершение боя и выдача наград (вызывать в транзакции)"""
     if state['status'] == 'victory':
         xp = state['monster'].get('xp_reward', 10)
         gold = state['monster'].get('coin_reward', 5)
 
-        player_profile.gain_experience(xp)
-        player_profile.coins += gold
+        # Монеты - проводкой леджера (блокировка строки, лимит, запись журнала)
+        try:
+            credit(player_profile, 'coins', gold, f"Награда за победу над {state['monster']['name']}",
+                   transaction_type='reward')
+        except LedgerError:
+            gold = 0
+
+        # Опыт, HP и уровень - один UPDATE изменённых полей (монеты уже записаны)
+        player_profile.gain_experience(xp, save=False)
         player_profile.current_hp = state['player']['current_hp']
         player_profile.save()
 
-        # Лог транзакции
-        CurrencyTransaction.objects.create(
-            player=player_profile,
-            currency_type='coins',
-            amount=gold,
-            transaction_type='reward',
-            balance_after=player_profile.coins,
-            description=f"Награда за победу над {state['monster']['name']}"
-        )
-
+        if not gold:
+            return f"Победа! Получено {xp} опыта. Монеты не начислены: достигнут лимит."
         return f"Победа! Получено {xp} опыта и {gold} монет."
     elif state['status'] == 'defeat':
         player_profile.current_hp = 1 # Оставляем 1 HP после поражения
@@ -232,3 +394,34 @@ def finish_battle(combat_obj, player_profile):
         return "Поражение. Вы были тяжело ранены."
 
     return "Бой завершен."
+
+def play_turn(store, entry, attack_zone, defense_zones):
+    """
+    Ход игрока в бою из CombatStore (вызывать внутри store.turn() - при
+    ошибке он запишет в БД состояние до хода и вытеснит бой из кэша).
+
+    Если бой завершился - выдаёт награды и сразу записывает бой в БД в
+    одной транзакции. Возвращает сообщение об итоге боя ('' - бой идёт).
+    """
+    state = entry['state']
+    # Обработка хода (seed боя делает ход воспроизводимым)
+    if entry['seed'] is not None:
+        rng = combat_rng(entry['seed'], state['turn'])
+        entry['inputs'].append(encode_input(attack_zone, defense_zones))
+    else:
+        rng = random
+    handle_player_turn(state, attack_zone, defense_zones, rng=rng)
+    entry['version'] += 1
+
+    # Если бой завершился на этом ходу - награда и запись боя в одной транзакции
+    message = ""
+    if state['status'] in ['victory', 'defeat']:
+        with transaction.atomic():
+            profile = PlayerProfile.objects.get(user_id=entry['owner_id'])
+            message = finish_battle(state, profile)
+            state['finish_message'] = message
+            store.save(entry, flush=True)
+        store.evict(entry['id'])
+    else:
+        store.save(entry)
+    return message
@@ -0,0 +1,281 @@
+"""
+Пакетный симулятор боёв (Монте-Карло) для настройки монстров.
+
+Повторяет правила calculate_damage()/handle_player_turn(), но разыгрывает
+тысячи боёв одновременно: все броски одного хода делаются одним вызовом
+NumPy для всех ещё идущих боёв, а не по одному удару за раз.
+
+Игрок выбирает зоны атаки и защиты случайно (так же, как ИИ монстра)
+и всегда начинает бой с полным здоровьем.
+"""
+import copy
+import random
+import time
+
+import numpy as np
+
+from .combat_logic import (
+    ARMOR_KEYS, build_player_data, handle_player_turn, new_combat_state,
+    player_attacker_stats, player_defender_stats,
+    monster_attacker_stats, monster_defender_stats,
+)
+from .models import PlayerProfile
+from .npc_templates import MONSTER_TEMPLATES
+
+# Квантили, которые попадают в отчёт
+PERCENTILES = (50, 90, 99)
+
+DEFAULT_MAX_TURNS = 500
+DEFAULT_BATCH_SIZE = 200000
+
+
+def make_player_data(profile=None, num_attacks=None, **overrides):
+    """
+    Блок характеристик игрока в формате combat_state['player'].
+
+    profile - PlayerProfile (не сохраняется); если не передан, берётся
+    новый персонаж со значениями по умолчанию. overrides - поля модели
+    (strength_base, phys_damage_max, armor_head, ...), которые нужно
+    подменить перед расчётом.
+    """
+    if profile is None:
+        profile = PlayerProfile(name='Симуляция', classification='warrior')
+        if num_attacks is None:
+            num_attacks = 1
+
+    for field, value in overrides.items():
+        setattr(profile, field, value)
+
+    profile.max_hp = profile.calculate_max_hp()
+    profile.current_hp = profile.max_hp
+    return build_player_data(profile, num_attacks=num_attacks)
+
+
+def monster_data(template):
+    """Копия шаблона монстра в формате combat_state['monster']"""
+    monster = dict(template)
+    monster['current_hp'] = monster['hp']
+    monster['max_hp'] = monster['hp']
+    return monster
+
+
+def _pick_defense(rng, size):
+    """Две разные зоны защиты (аналог random.sample(range(1, 5), 2))"""
+    first = rng.integers(1, 5, size)
+    second = rng.integers(1, 4, size)
+    second += second >= first
+    return first, second
+
+
+def _swing(rng, attacker, defender, attack_zone, defense_a, defense_b):
+    """
+    Векторная версия calculate_damage() для массива ударов.
+
+    Возвращает (урон, попал ли удар). Урон непопавших ударов равен 0.
+    """
+    size = attack_zone.shape[0]
+
+    # Промах 5%, уворот, парирование
+    landed = rng.integers(1, 101, size) > 5
+    landed &= rng.integers(1, 101, size) > defender.get('dodge_chance', 0)
+    landed &= rng.integers(1, 101, size) > defender.get('parry', 0)
+
+    # Крит перекрывает блок так же, как в calculate_damage()
+    crit = rng.integers(1, 101, size) <= attacker.get('crit_chance', 0)
+    block = ~crit & ((attack_zone == defense_a) | (attack_zone == defense_b))
+
+    base_damage = rng.integers(attacker.get('damage_min', 1), attacker.get('damage_max', 5) + 1, size)
+    strength = attacker.get('strength', 3)
+    damage = base_damage * (1 + (max(0, strength - 3) * 0.1))
+    damage[crit] *= 2
+    damage[block] *= 0.25
+
+    armor_by_zone = np.array(
+        [0] + [defender.get(ARMOR_KEYS[zone], 0) for zone in sorted(ARMOR_KEYS)],
+        dtype=np.float64,
+    )
+    damage = np.maximum(1, damage - armor_by_zone[attack_zone]).astype(np.int64)
+    damage[~landed] = 0
+    return damage, landed
+
+
+def _add_histogram(histogram, values):
+    """Добавляет значения в гистограмму (массив счётчиков по значению)"""
+    if values.size == 0:
+        return histogram
+    counts = np.bincount(values)
+    if counts.size > histogram.size:
+        counts[:histogram.size] += histogram
+        return counts
+    histogram[:counts.size] += counts
+    return histogram
+
+
+def _histogram_summary(histogram):
+    """Среднее, квантили и максимум по гистограмме"""
+    total = int(histogram.sum())
+    if total == 0:
+        return {'count': 0, 'mean': 0.0, 'max': 0, **{f'p{q}': 0 for q in PERCENTILES}}
+
+    values = np.arange(histogram.size)
+    cumulative = np.cumsum(histogram)
+    summary = {
+        'count': total,
+        'mean': round(float((values * histogram).sum()) / total, 2),
+        'max': int(np.flatnonzero(histogram)[-1]),
+    }
+    for q in PERCENTILES:
+        summary[f'p{q}'] = int(np.searchsorted(cumulative, total * q / 100.0))
+    return summary
+
+
+def _simulate_batch(rng, player, monster, size, max_turns, stats):
+    """Разыгрывает size боёв одновременно и копит результаты в stats"""
+    player_attack = player_attacker_stats(player)
+    player_defense = player_defender_stats(player)
+    monster_attack = monster_attacker_stats(monster)
+    monster_defense = monster_defender_stats(monster)
+    num_attacks = player.get('num_attacks', 1)
+
+    player_hp = np.full(size, player['max_hp'], dtype=np.int64)
+    monster_hp = np.full(size, monster['max_hp'], dtype=np.int64)
+    active = np.arange(size)
+
+    for turn in range(1, max_turns + 1):
+        if active.size == 0:
+            break
+        count = active.size
+
+        # Ход монстра выбирается до ударов, как в handle_player_turn()
+        npc_attack_zone = rng.integers(1, 5, count)
+        npc_defense_a, npc_defense_b = _pick_defense(rng, count)
+        attack_zone = rng.integers(1, 5, count)
+        defense_a, defense_b = _pick_defense(rng, count)
+
+        # 1. Игрок бьёт монстра (num_attacks раз, пока монстр жив)
+        hp = monster_hp[active]
+        for _ in range(num_attacks):
+            alive = hp > 0
+            damage, landed = _swing(rng, player_attack, monster_defense, attack_zone, npc_defense_a, npc_defense_b)
+            landed &= alive
+            damage[~alive] = 0
+            hp = np.maximum(0, hp - damage)
+            stats['player_damage'] = _add_histogram(stats['player_damage'], damage[landed])
+        monster_hp[active] = hp
+
+        won = hp <= 0
+        stats['wins'] += int(won.sum())
+        stats['turns'] = _add_histogram(stats['turns'], np.full(int(won.sum()), turn, dtype=np.int64))
+        active = active[~won]
+        if active.size == 0:
+            break
+
+        # 2. Монстр бьёт игрока
+        keep = ~won
+        damage, landed = _swing(
+            rng, monster_attack, player_defense,
+            npc_attack_zone[keep], defense_a[keep], defense_b[keep],
+        )
+        stats['monster_damage'] = _add_histogram(stats['monster_damage'], damage[landed])
+        hp = np.maximum(0, player_hp[active] - damage)
+        player_hp[active] = hp
+
+        lost = hp <= 0
+        stats['losses'] += int(lost.sum())
+        stats['turns'] = _add_histogram(stats['turns'], np.full(int(lost.sum()), turn, dtype=np.int64))
+        active = active[~lost]
+
+    stats['timeouts'] += int(active.size)
+
+
+def simulate_matchup(player, monster_template, fights=100000, max_turns=DEFAULT_MAX_TURNS,
+                     seed=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Разыгрывает fights боёв игрока против одного шаблона монстра.
+
+    player - блок в формате combat_state['player'] (см. make_player_data).
+    Бои, не закончившиеся за max_turns ходов, считаются ничьей (timeouts).
+    """
+    rng = np.random.default_rng(seed)
+    monster = monster_data(monster_template)
+    stats = {
+        'wins': 0,
+        'losses': 0,
+        'timeouts': 0,
+        'turns': np.zeros(0, dtype=np.int64),
+        'player_damage': np.zeros(0, dtype=np.int64),
+        'monster_damage': np.zeros(0, dtype=np.int64),
+    }
+
+    started = time.perf_counter()
+    remaining = fights
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        _simulate_batch(rng, player, monster, size, max_turns, stats)
+        remaining -= size
+    elapsed = time.perf_counter() - started
+
+    return {
+        'monster': monster['name'],
+        'monster_level': monster.get('level'),
+        'fights': fights,
+        'wins': stats['wins'],
+        'losses': stats['losses'],
+        'timeouts': stats['timeouts'],
+        'win_rate': stats['wins'] / fights if fights else 0.0,
+        'turns': _histogram_summary(stats['turns']),
+        'player_damage': _histogram_summary(stats['player_damage']),
+        'monster_damage': _histogram_summary(stats['monster_damage']),
+        'elapsed': elapsed,
+    }
+
+
+def simulate_all(player, templates=None, **kwargs):
+    """Прогоняет simulate_matchup() по всем шаблонам монстров"""
+    if templates is None:
+        templates = MONSTER_TEMPLATES
+    return [simulate_matchup(player, template, **kwargs) for template in templates]
+
+
+def simulate_matchup_reference(player, monster_template, fights=1000, max_turns=DEFAULT_MAX_TURNS):
+    """
+    Эталонный прогон через handle_player_turn() по одному бою.
+
+    Нужен для сверки результатов и сравнения скорости с simulate_matchup().
+    """
+    wins = losses = timeouts = 0
+    turns = []
+
+    started = time.perf_counter()
+    for _ in range(fights):
+        player_state = copy.deepcopy(player)
+        player_state['current_hp'] = player_state['max_hp']
+        state = new_combat_state(player_state, monster_data(monster_template))
+        for turn in range(1, max_turns + 1):
+            handle_player_turn(state, random.randint(1, 4), random.sample(range(1, 5), 2))
+            state['events'].clear()
+            if state['status'] != 'active':
+                break
+
+        if state['status'] == 'victory':
+            wins += 1
+        elif state['status'] == 'defeat':
+            losses += 1
+        else:
+            timeouts += 1
+            continue
+        turns.append(turn)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'monster': monster_template['name'],
+        'monster_level': monster_template.get('level'),
+        'fights': fights,
+        'wins': wins,
+        'losses': losses,
+        'timeouts': timeouts,
+        'win_rate': wins / fights if fights else 0.0,
+        'turns': _histogram_summary(np.bincount(np.array(turns, dtype=np.int64))) if turns
+                 else _histogram_summary(np.zeros(0, dtype=np.int64)),
+        'elapsed': elapsed,
+    }
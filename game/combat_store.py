@@ -0,0 +1,297 @@
+"""
+Хранилище активных боёв с отложенной записью в таблицу Combat.
+
+Состояние идущего боя живёт в памяти (или в общем кэше), ход боя читает и
+меняет его без обращения к БД. В Combat состояние пишется раз в
+FLUSH_EVERY ходов (но не реже раза в FLUSH_INTERVAL секунд, пока игрок
+ходит) и обязательно в конце боя.
+
+Настройка (settings.COMBAT_STORE):
+
+    COMBAT_STORE = {
+        'BACKEND': 'game.combat_store.LocalMemoryBackend',
+        'OPTIONS': {},
+        'FLUSH_EVERY': 5,
+        'FLUSH_INTERVAL': 60,
+        'TURN_TIMEOUT': 120,
+        'TIMEOUT_ACTION': 'auto',
+        'MAX_IDLE_TURNS': 3,
+        'TIMEOUT_WORKER': True,
+    }
+
+TURN_TIMEOUT - секунды на ход (None - без таймаутов). По истечении времени
+фоновый поток (combat_timeouts) делает ход за игрока (TIMEOUT_ACTION
+'auto') или засчитывает ему поражение ('forfeit'); после MAX_IDLE_TURNS
+пропущенных подряд ходов бой прерывается в любом случае. Поток запускает
+точка входа сервера (asgi.py/wsgi.py) и только при TIMEOUT_WORKER = True:
+shell и команды управления за игроков не ходят.
+
+LocalMemoryBackend хранит бои в памяти процесса: подходит для одного
+процесса или при «липкой» маршрутизации игрока на процесс. Для нескольких
+процессов используйте CacheBackend поверх общего кэша Django (Redis,
+memcached) - OPTIONS: {'alias': 'default', 'timeout': 3600}.
+"""
+import atexit
+import copy
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Combat
+from .turn_scheduler import TurnScheduler
+
+DEFAULT_SETTINGS = {
+    'BACKEND': 'game.combat_store.LocalMemoryBackend',
+    'OPTIONS': {},
+    'FLUSH_EVERY': 5,
+    'FLUSH_INTERVAL': 60,
+    'TURN_TIMEOUT': None,
+    'TIMEOUT_ACTION': 'auto',
+    'MAX_IDLE_TURNS': 3,
+    'TIMEOUT_WORKER': False,
+}
+
+# Поля Combat, которые хранит запись боя
+ENTRY_FIELDS = ('id', 'owner_id', 'seed', 'inputs', 'version', 'state')
+
+
+class LocalMemoryBackend:
+    """Бои в памяти процесса"""
+
+    LOCK_STRIPES = 256
+
+    def __init__(self, **options):
+        self._entries = {}
+        self._entries_lock = threading.Lock()
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, entry):
+        with self._entries_lock:
+            self._entries[key] = entry
+
+    def delete(self, key):
+        with self._entries_lock:
+            self._entries.pop(key, None)
+
+    @contextmanager
+    def lock(self, key):
+        with self._locks[hash(key) % self.LOCK_STRIPES]:
+            yield
+
+
+class CacheBackend:
+    """Бои в общем кэше Django (например, Redis) - общий для всех процессов"""
+
+    KEY_PREFIX = 'combat_store:'
+    LOCK_TIMEOUT = 10
+
+    def __init__(self, alias='default', timeout=3600, **options):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(self.KEY_PREFIX + key)
+
+    def set(self, key, entry):
+        self.cache.set(self.KEY_PREFIX + key, entry, self.timeout)
+
+    def delete(self, key):
+        self.cache.delete(self.KEY_PREFIX + key)
+
+    @contextmanager
+    def lock(self, key):
+        lock_key = f'{self.KEY_PREFIX}lock:{key}'
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        while not self.cache.add(lock_key, 1, self.LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Не удалось заблокировать бой {key}")
+            time.sleep(0.005)
+        try:
+            yield
+        finally:
+            self.cache.delete(lock_key)
+
+
+class CombatStore:
+    """
+    Кэш активных боёв.
+
+    Запись боя - словарь с полями ENTRY_FIELDS и счётчиком 'dirty' (ходов,
+    ещё не записанных в БД). Изменять запись можно только под lock().
+    'active_at' - time.time() последнего хода, 'flushed_at' - последней
+    записи в БД: идущий бой пишется в БД не реже раза в flush_interval
+    секунд, поэтому по updated_at его видят и процессы без доступа к кэшу.
+
+    При turn_timeout у записи есть 'deadline' (time.time() конца хода), а
+    каждый бой стоит в планировщике scheduler.
+
+    Id боёв с незаписанными ходами, сделанными в этом процессе, хранятся в
+    самом хранилище: flush_all() при остановке сбрасывает их с любым
+    бэкендом, в том числе с общим кэшем, который не умеет перечислять ключи.
+    """
+
+    def __init__(self, backend, flush_every=5, turn_timeout=None,
+                 timeout_action='auto', max_idle_turns=3, flush_interval=60):
+        self.backend = backend
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self.turn_timeout = turn_timeout
+        self.timeout_action = timeout_action
+        self.max_idle_turns = max_idle_turns
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self.scheduler = TurnScheduler() if turn_timeout else None
+
+    def lock(self, combat_id):
+        return self.backend.lock(str(combat_id))
+
+    @contextmanager
+    def turn(self, combat_id, owner_id=None, cached_only=False):
+        """
+        Ход боя: блокировка боя и его запись, прочитанная под ней (None,
+        если боя нет). cached_only - только из кэша, без чтения БД.
+
+        Если ход упал, запись могла измениться наполовину: в БД пишется
+        состояние до хода (вместе с ещё не записанными ходами), а запись
+        вытесняется из кэша - следующий ход перечитает бой из БД.
+        """
+        with self.lock(combat_id):
+            entry = self.peek(combat_id) if cached_only else self.load(combat_id, owner_id=owner_id)
+            # Копия нужна, только если в кэше есть ходы, которых нет в БД
+            before = copy.deepcopy(entry) if entry is not None and entry['dirty'] else None
+            try:
+                yield entry
+            except Exception:
+                if before is not None:
+                    self.flush(before)
+                self.evict(combat_id)
+                raise
+
+    def peek(self, combat_id):
+        """Запись из кэша без обращения к БД"""
+        return self.backend.get(str(combat_id))
+
+    def load(self, combat_id, owner_id=None):
+        """Запись боя из кэша, при промахе - из БД (None, если боя нет)"""
+        entry = self.peek(combat_id)
+        if entry is None:
+            entry = Combat.objects.filter(id=combat_id).values(*ENTRY_FIELDS).first()
+            if entry is None:
+                return None
+            entry['id'] = str(entry['id'])
+            entry['dirty'] = 0
+            entry['flushed_at'] = time.time()
+            if entry['state'].get('status') == 'active':
+                self.touch(entry)
+                self.backend.set(entry['id'], entry)
+
+        if owner_id is not None and entry['owner_id'] != owner_id:
+            return None
+        return entry
+
+    def add(self, combat):
+        """Кладёт в кэш только что созданный бой"""
+        entry = {field: getattr(combat, field) for field in ENTRY_FIELDS}
+        entry['id'] = str(combat.id)
+        entry['dirty'] = 0
+        entry['flushed_at'] = time.time()
+        self.touch(entry)
+        self.backend.set(entry['id'], entry)
+        return entry
+
+    def save(self, entry, flush=False):
+        """
+        Сохраняет ход: в кэш всегда, в БД - раз в flush_every ходов,
+        если с прошлой записи прошло flush_interval секунд, или сразу
+        при flush=True.
+        """
+        entry['dirty'] += 1
+        overdue = time.time() - entry.get('flushed_at', 0) >= self.flush_interval
+        if flush or overdue or entry['dirty'] >= self.flush_every:
+            self.flush(entry)
+        else:
+            with self._dirty_lock:
+                self._dirty.add(entry['id'])
+        self.touch(entry)
+        self.backend.set(entry['id'], entry)
+
+    def touch(self, entry):
+        """Отмечает активность боя и начинает отсчёт времени на следующий ход"""
+        entry['active_at'] = time.time()
+        if self.scheduler is None or entry['state'].get('status') != 'active':
+            return
+        entry['deadline'] = time.time() + self.turn_timeout
+        self.scheduler.schedule(entry['id'], entry['deadline'])
+
+    def put(self, entry):
+        """Обновляет запись в кэше, не считая это ходом (без записи в БД)"""
+        self.backend.set(entry['id'], entry)
+
+    def flush(self, entry):
+        """Записывает бой в таблицу Combat одним UPDATE"""
+        Combat.objects.filter(id=entry['id']).update(
+            state=entry['state'],
+            status=entry['state'].get('status', 'active'),
+            inputs=entry['inputs'],
+            version=entry['version'],
+            updated_at=timezone.now(),
+        )
+        entry['dirty'] = 0
+        entry['flushed_at'] = time.time()
+        with self._dirty_lock:
+            self._dirty.discard(entry['id'])
+
+    def evict(self, combat_id):
+        self.backend.delete(str(combat_id))
+        with self._dirty_lock:
+            self._dirty.discard(str(combat_id))
+        if self.scheduler is not None:
+            self.scheduler.cancel(str(combat_id))
+
+    def flush_all(self):
+        """Сбрасывает в БД все незаписанные бои этого процесса"""
+        with self._dirty_lock:
+            keys = list(self._dirty)
+        for key in keys:
+            with self.backend.lock(key):
+                entry = self.backend.get(key)
+                if entry is not None and entry['dirty']:
+                    self.flush(entry)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'COMBAT_STORE', {})}
+
+
+def get_combat_store():
+    """Общий экземпляр CombatStore по settings.COMBAT_STORE"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = get_store_settings()
+                backend = import_string(config['BACKEND'])(**config['OPTIONS'])
+                store = CombatStore(
+                    backend,
+                    flush_every=config['FLUSH_EVERY'],
+                    flush_interval=config['FLUSH_INTERVAL'],
+                    turn_timeout=config['TURN_TIMEOUT'],
+                    timeout_action=config['TIMEOUT_ACTION'],
+                    max_idle_turns=config['MAX_IDLE_TURNS'],
+                )
+                # Несохранённые ходы процесса не должны теряться при остановке
+                atexit.register(store.flush_all)
+                _store = store
+    return _store
@@ -0,0 +1,185 @@
+"""
+Таймауты ходов.
+
+Каждый активный бой CombatStore стоит в планировщике (TurnScheduler) с
+дедлайном хода. Фоновый поток процесса сервера (запускается из asgi.py/wsgi.py
+при COMBAT_STORE['TIMEOUT_WORKER']) ждёт ближайший дедлайн и по его
+истечении:
+
+- в обычном бою делает ход за игрока случайными зонами (TIMEOUT_ACTION
+  'auto') или прерывает бой поражением игрока ('forfeit');
+- в групповом бою разрешает раунд, не дожидаясь молчащих игроков (они
+  ходят как ИИ).
+
+После MAX_IDLE_TURNS ходов подряд без действий игрока бой прерывается
+(статус 'abandoned'), и игрок может начать новую охоту.
+
+Бои, которых нет в памяти ни одного процесса (например, после
+перезапуска), закрывает команда expire_combats.
+"""
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .combat_logic import ACTOR_SYSTEM, RESULT_CODES, add_event, handle_npc_turn, play_turn
+from .combat_store import get_combat_store, get_store_settings
+from .group_combat import GROUP_ACTOR_SYSTEM, is_group_state, resolve_group_round
+from .models import Combat
+
+logger = logging.getLogger(__name__)
+
+FORFEIT_MESSAGE = "Бой прерван: время хода истекло."
+
+
+def forfeit(store, entry):
+    """Прерывает бой из-за бездействия игрока и сразу пишет его в БД"""
+    state = entry['state']
+    state['status'] = 'abandoned'
+    state['finish_message'] = FORFEIT_MESSAGE
+    if is_group_state(state):
+        state['events'].append([state['turn'], GROUP_ACTOR_SYSTEM, 0, RESULT_CODES['abandoned'], 0, 0, GROUP_ACTOR_SYSTEM])
+    else:
+        state['winner'] = 'monster'
+        add_event(state, ACTOR_SYSTEM, 'defeat')
+    entry['version'] += 1
+    store.save(entry, flush=True)
+    store.evict(entry['id'])
+
+
+def timeout_turn(store, entry):
+    """
+    Действие по истёкшему ходу (вызывать под store.lock).
+
+    Возвращает 'auto', 'forfeit' или '' (бой уже не активен).
+    """
+    state = entry['state']
+    if state.get('status') != 'active':
+        store.evict(entry['id'])
+        return ''
+
+    entry['idle'] = entry.get('idle', 0) + 1
+    if entry['idle'] > store.max_idle_turns or (
+            store.timeout_action == 'forfeit' and not is_group_state(state)):
+        forfeit(store, entry)
+        return 'forfeit'
+
+    if is_group_state(state):
+        resolve_group_round(store, entry)
+    else:
+        # Ход за игрока записывается в inputs, поэтому повтор боя не ломается
+        attack_zone, defense_zones = handle_npc_turn(state['player'], random)
+        play_turn(store, entry, attack_zone, defense_zones)
+    return 'auto'
+
+
+def expire_turn(store, combat_id, now=None):
+    """Обрабатывает истёкший дедлайн боя combat_id"""
+    with store.turn(combat_id, cached_only=True) as entry:
+        if entry is None:
+            # Бой ушёл из кэша (завершён или вытеснен) - дедлайн больше не нужен
+            return ''
+        deadline = entry.get('deadline')
+        if deadline is not None and deadline > (time.time() if now is None else now):
+            # Ход сделан в другом процессе (общий кэш) - ждём новый дедлайн
+            store.scheduler.schedule(entry['id'], deadline)
+            return ''
+        return timeout_turn(store, entry)
+
+
+class TimeoutWorker(threading.Thread):
+    """Фоновый поток: ждёт дедлайны планировщика и обрабатывает истёкшие"""
+
+    def __init__(self, store):
+        super().__init__(name='combat-timeouts', daemon=True)
+        self.store = store
+        self.stopped = threading.Event()
+
+    def run(self):
+        scheduler = self.store.scheduler
+        while not self.stopped.is_set():
+            expired = scheduler.wait_expired(max_wait=1.0)
+            if not expired:
+                continue
+            close_old_connections()
+            for combat_id in expired:
+                try:
+                    expire_turn(self.store, combat_id)
+                except Exception as e:
+                    logger.error(f"Error expiring turn of combat {combat_id}: {str(e)}", exc_info=True)
+            close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
+        self.store.scheduler.wake()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_timeout_worker(store=None):
+    """Запускает поток таймаутов процесса (один на процесс); без TURN_TIMEOUT - None"""
+    global _worker
+    store = store or get_combat_store()
+    if store.scheduler is None:
+        return None
+    with _worker_lock:
+        if _worker is None:
+            _worker = TimeoutWorker(store)
+            _worker.start()
+    return _worker
+
+
+def start_server_timeout_worker():
+    """Для точек входа сервера: поток таймаутов, если включён COMBAT_STORE['TIMEOUT_WORKER']"""
+    if get_store_settings()['TIMEOUT_WORKER']:
+        return start_timeout_worker()
+    return None
+
+
+def stale_after(store):
+    """
+    Через сколько без записи в БД бой считается брошенным.
+
+    Идущий бой пишется в БД хотя бы раз в flush_every ходов и не реже раза
+    в flush_interval секунд, а каждый ход (сделанный игроком или по
+    таймауту) длится не дольше turn_timeout.
+    """
+    timeout = store.turn_timeout or 120
+    seconds = timeout * (store.flush_every + store.max_idle_turns + 1)
+    return timedelta(seconds=max(seconds, 2 * store.flush_interval))
+
+
+def active_combats(updated_after=None):
+    """(id, updated_at) активных боёв, обновлённых в БД после updated_after"""
+    qs = Combat.objects.filter(status='active')
+    if updated_after is not None:
+        qs = qs.filter(updated_at__gt=updated_after)
+    return qs.values_list('id', 'updated_at').iterator(chunk_size=2000)
+
+
+def expire_if_stale(store, combat_id, older_than):
+    """
+    Прерывает бой, если он всё ещё активен и не обновлялся дольше older_than.
+
+    Такие бои не держит ни один процесс (их таймеры пропали вместе с
+    процессом). Бой, в котором по кэшу ходили недавно, не трогаем, даже
+    если его ходы ещё не записаны в БД. Возвращает True, если бой прерван.
+    """
+    with store.lock(combat_id):
+        cached = store.peek(combat_id)
+        if cached is not None and time.time() - cached.get('active_at', 0) < older_than.total_seconds():
+            return False
+        updated_at = Combat.objects.filter(id=combat_id, status='active').values_list('updated_at', flat=True).first()
+        if updated_at is None or updated_at >= timezone.now() - older_than:
+            return False
+        entry = store.load(combat_id)
+        if entry is None:
+            return False
+        forfeit(store, entry)
+    return True
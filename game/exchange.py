@@ -0,0 +1,352 @@
+"""
+Биржа ресурсов: книга заявок в памяти процесса.
+
+Ресурсы (серебро, золото, пыль) торгуются за монеты. По каждому ресурсу
+своя книга: уровни цен с очередями заявок, приоритет цена-время - лучшая
+цена первой, на одном уровне раньше пришедшая заявка первой. Сделка
+проходит по цене стоящей в книге заявки; покупателю, давшему цену выше,
+разница возвращается.
+
+Команды (PlaceOrder, CancelOrder) обрабатываются пачкой: Exchange.submit()
+сопоставляет все заявки пачки в памяти и записывает результат одной
+транзакцией:
+
+- балансы участников пачки блокируются одним select_for_update;
+- новые заявки - bulk_create, изменённые - UPDATE на группу заявок с
+  одинаковыми статусом и остатком;
+- сделки - bulk_create в ExchangeFill (журнал только на добавление) и в
+  Transaction (лента цен, game/price_stats.py);
+- резервы, выплаты и возвраты - проводки леджера (game/ledger.py),
+  свёрнутые по игроку, валюте и типу операции.
+
+Если транзакция не прошла, книга перечитывается из БД; если пачку
+отклонил леджер (лимит баланса), команды повторяются по одной.
+
+Книга одна на процесс (как LocalMemoryBackend CombatStore): биржу должен
+обслуживать один процесс, иначе книги процессов разойдутся.
+"""
+import heapq
+import threading
+from collections import deque, namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .ledger import Leg, LedgerError, apply_legs, currency_genitive
+from .models import ExchangeFill, ExchangeOrder, ExchangeRates, PlayerProfile, Transaction
+from .price_stats import record_trades
+
+EXCHANGE_RESOURCES = ('silver', 'silver_dust', 'gold', 'gold_dust')
+QUOTE_CURRENCY = 'coins'
+
+PlaceOrder = namedtuple('PlaceOrder', 'player_id resource_type side price quantity')
+CancelOrder = namedtuple('CancelOrder', 'player_id order_id')
+
+
+class ExchangeError(Exception):
+    """Команда биржи отклонена"""
+
+
+class OrderBook:
+    """Книга заявок одного ресурса"""
+
+    def __init__(self, resource_type):
+        self.resource_type = resource_type
+        # Сторона -> {цена: очередь заявок}
+        self.levels = {'buy': {}, 'sell': {}}
+        # Кучи цен уровней (покупка - с минусом); удалённые уровни вычищаются лениво
+        self.prices = {'buy': [], 'sell': []}
+
+    def add(self, order):
+        levels = self.levels[order.side]
+        level = levels.get(order.price)
+        if level is None:
+            level = levels[order.price] = deque()
+            heapq.heappush(self.prices[order.side], -order.price if order.side == 'buy' else order.price)
+        level.append(order)
+
+    def remove(self, order):
+        levels = self.levels[order.side]
+        level = levels[order.price]
+        level.remove(order)
+        if not level:
+            del levels[order.price]
+
+    def best_price(self, side):
+        heap = self.prices[side]
+        levels = self.levels[side]
+        while heap:
+            price = -heap[0] if side == 'buy' else heap[0]
+            if price in levels:
+                return price
+            heapq.heappop(heap)
+        return None
+
+    def match(self, order):
+        """
+        Исполняет заявку о встречные заявки книги.
+
+        Возвращает [(встречная заявка, количество, цена)]; исполненные
+        встречные заявки убираются из книги, остаток заявки - нет.
+        """
+        opposite = 'sell' if order.side == 'buy' else 'buy'
+        levels = self.levels[opposite]
+        fills = []
+        while order.remaining:
+            price = self.best_price(opposite)
+            if price is None or (price > order.price if order.side == 'buy' else price < order.price):
+                break
+            level = levels[price]
+            while order.remaining and level:
+                maker = level[0]
+                quantity = min(order.remaining, maker.remaining)
+                order.remaining -= quantity
+                maker.remaining -= quantity
+                fills.append((maker, quantity, price))
+                if not maker.remaining:
+                    level.popleft()
+            if not level:
+                del levels[price]
+        return fills
+
+    def depth(self, side, limit=10):
+        """Лучшие уровни стороны: [(цена, количество)]"""
+        prices = sorted(self.levels[side], reverse=side == 'buy')[:limit]
+        return [(price, sum(order.remaining for order in self.levels[side][price])) for price in prices]
+
+
+class Batch:
+    """Изменения одной пачки команд, записываемые одной транзакцией"""
+
+    def __init__(self, now, balances):
+        self.now = now
+        self.balances = balances
+        self.new_orders = []
+        self.touched = {}
+        self.fills = []
+        self.trades = []
+        # (игрок, валюта, тип) -> [сумма, число операций, описание первой]
+        self.legs = {}
+        self.last_prices = {}
+
+    def leg(self, player_id, currency, amount, transaction_type, description):
+        # Проводки пачки сворачиваются по игроку, валюте и типу - подробности в ExchangeFill
+        leg = self.legs.setdefault((player_id, currency, transaction_type), [0, 0, description])
+        leg[0] += amount
+        leg[1] += 1
+        # Баланс участника пачки меняется сразу - следующие его заявки видят остаток
+        if player_id in self.balances:
+            self.balances[player_id][currency] += amount
+
+    def persist(self):
+        ExchangeOrder.objects.bulk_create(self.new_orders, batch_size=500)
+        # Изменённые заявки - один UPDATE на пару (статус, остаток), а не CASE на каждую строку
+        updates = {}
+        for order in self.touched.values():
+            updates.setdefault((order.status, order.remaining), []).append(order.pk)
+        for (status, remaining), ids in updates.items():
+            ExchangeOrder.objects.filter(pk__in=ids).update(status=status, remaining=remaining, updated_at=self.now)
+        if self.fills:
+            ExchangeFill.objects.bulk_create(self.fills, batch_size=500)
+            record_trades(Transaction.objects.bulk_create(self.trades, batch_size=500))
+            for resource_type, price in self.last_prices.items():
+                ExchangeRates.objects.filter(resource_type=resource_type).update(rate=price, updated_at=self.now)
+        if self.legs:
+            apply_legs([
+                Leg(player_id, currency, amount, transaction_type, description if count == 1 else f"Биржа: операций {count}")
+                for (player_id, currency, transaction_type), (amount, count, description) in self.legs.items()
+            ])
+
+
+def order_cost(side, resource_type, price, quantity):
+    """Что резервирует заявка: (валюта, количество)"""
+    if side == 'buy':
+        return QUOTE_CURRENCY, price * quantity
+    return resource_type, quantity
+
+
+class Exchange:
+    def __init__(self, player_ids=None):
+        self.lock = threading.Lock()
+        self.books = {}
+        # Открытые заявки книги по id
+        self.orders = {}
+        self.loaded = False
+        # Книга только из заявок этих игроков (например, для бенчмарка:
+        # с заявками реальных игроков она сводиться не должна)
+        self.player_ids = player_ids
+
+    def load(self):
+        """Книги из открытых заявок БД (порядок id - порядок поступления)"""
+        self.books = {resource_type: OrderBook(resource_type) for resource_type in EXCHANGE_RESOURCES}
+        self.orders = {}
+        orders = ExchangeOrder.objects.filter(status='open')
+        if self.player_ids is not None:
+            orders = orders.filter(player_id__in=self.player_ids)
+        for order in orders.order_by('id').iterator(chunk_size=2000):
+            self.books[order.resource_type].add(order)
+            self.orders[order.pk] = order
+        self.loaded = True
+
+    def depth(self, resource_type, limit=10):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            book = self.books[resource_type]
+            return {'buy': book.depth('buy', limit), 'sell': book.depth('sell', limit)}
+
+    def submit(self, commands):
+        """
+        Выполняет пачку команд.
+
+        Возвращает по результату на команду: {'ok', 'message', 'order',
+        'fills'}; заявка - сохранённый ExchangeOrder.
+        """
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            return self._submit(commands)
+
+    def _submit(self, commands):
+        try:
+            return self._execute(commands)
+        except LedgerError as e:
+            # Транзакция откатилась, а книга в памяти уже изменена - перечитываем
+            self.load()
+            if len(commands) == 1:
+                return [_result(False, str(e))]
+            # Пачку отклонил леджер (например, лимит баланса получателя) - по одной команде
+            return [self._submit([command])[0] for command in commands]
+        except Exception:
+            self.load()
+            raise
+
+    def _execute(self, commands):
+        now = timezone.now()
+        player_ids = sorted({command.player_id for command in commands})
+        with transaction.atomic():
+            balances = {
+                row['id']: row
+                for row in PlayerProfile.objects.select_for_update()
+                .filter(id__in=player_ids).order_by('id').values('id', QUOTE_CURRENCY, *EXCHANGE_RESOURCES)
+            }
+            batch = Batch(now, balances)
+            results = []
+            for command in commands:
+                try:
+                    if isinstance(command, PlaceOrder):
+                        results.append(self._place(command, batch))
+                    else:
+                        results.append(self._cancel(command, batch))
+                except ExchangeError as e:
+                    results.append(_result(False, str(e)))
+            batch.persist()
+
+        for order in batch.new_orders:
+            if order.status == 'open':
+                self.orders[order.pk] = order
+        return results
+
+    def _place(self, command, batch):
+        player_id, resource_type, side, price, quantity = command
+        if resource_type not in EXCHANGE_RESOURCES:
+            raise ExchangeError("Этот ресурс не торгуется на бирже")
+        if side not in ('buy', 'sell'):
+            raise ExchangeError("Неизвестная сторона заявки")
+        if price <= 0 or quantity <= 0:
+            raise ExchangeError("Цена и количество должны быть больше нуля")
+        if player_id not in batch.balances:
+            raise ExchangeError("Игрок не найден")
+
+        currency, cost = order_cost(side, resource_type, price, quantity)
+        if batch.balances[player_id][currency] < cost:
+            raise ExchangeError(f"Недостаточно {currency_genitive(currency)}")
+        verb = 'покупку' if side == 'buy' else 'продажу'
+        batch.leg(player_id, currency, -cost, 'exchange_out', f"Биржа: заявка на {verb} {quantity} {resource_type} по {price}")
+
+        order = ExchangeOrder(
+            player_id=player_id, resource_type=resource_type, side=side, price=price,
+            quantity=quantity, remaining=quantity, created_at=batch.now, updated_at=batch.now,
+        )
+        batch.new_orders.append(order)
+
+        book = self.books[resource_type]
+        fills = []
+        for maker, filled, fill_price in book.match(order):
+            buy_order, sell_order = (order, maker) if side == 'buy' else (maker, order)
+            batch.leg(buy_order.player_id, resource_type, filled, 'exchange_in', f"Биржа: куплено {filled} {resource_type} по {fill_price}")
+            batch.leg(sell_order.player_id, QUOTE_CURRENCY, filled * fill_price, 'exchange_in', f"Биржа: продано {filled} {resource_type} по {fill_price}")
+            if buy_order.price > fill_price:
+                batch.leg(buy_order.player_id, QUOTE_CURRENCY, (buy_order.price - fill_price) * filled, 'exchange_in', "Биржа: возврат разницы цены")
+
+            maker.updated_at = batch.now
+            if not maker.remaining:
+                maker.status = 'filled'
+                self.orders.pop(maker.pk, None)
+            if maker.pk is not None:
+                batch.touched[maker.pk] = maker
+
+            batch.fills.append(ExchangeFill(
+                resource_type=resource_type, buy_order=buy_order, sell_order=sell_order,
+                taker_side=side, price=fill_price, quantity=filled, created_at=batch.now,
+            ))
+            batch.trades.append(Transaction(
+                resource_type=resource_type, amount=filled, price=Decimal(fill_price),
+                total=Decimal(fill_price * filled), transaction_type=side,
+            ))
+            batch.last_prices[resource_type] = fill_price
+            fills.append({'price': fill_price, 'quantity': filled})
+
+        if order.remaining:
+            book.add(order)
+        else:
+            order.status = 'filled'
+        return _result(True, "Заявка размещена", order, fills)
+
+    def _cancel(self, command, batch):
+        player_id, order_id = command
+        order = self.orders.get(order_id)
+        if order is None or order.player_id != player_id:
+            raise ExchangeError("Заявка не найдена")
+
+        self.books[order.resource_type].remove(order)
+        del self.orders[order_id]
+        order.status = 'cancelled'
+        order.updated_at = batch.now
+        batch.touched[order.pk] = order
+
+        currency, refund = order_cost(order.side, order.resource_type, order.price, order.remaining)
+        batch.leg(player_id, currency, refund, 'exchange_in', f"Биржа: отмена заявки #{order.pk}")
+        return _result(True, "Заявка отменена", order)
+
+
+def _result(ok, message, order=None, fills=None):
+    return {'ok': ok, 'message': message, 'order': order, 'fills': fills or []}
+
+
+def serialize_order(order):
+    return {
+        'id': order.pk,
+        'resource_type': order.resource_type,
+        'side': order.side,
+        'price': order.price,
+        'quantity': order.quantity,
+        'remaining': order.remaining,
+        'status': order.status,
+        'created_at': order.created_at.isoformat(),
+    }
+
+
+_exchange = None
+_exchange_lock = threading.Lock()
+
+
+def get_exchange():
+    """Общий экземпляр биржи процесса"""
+    global _exchange
+    if _exchange is None:
+        with _exchange_lock:
+            if _exchange is None:
+                _exchange = Exchange()
+    return _exchange
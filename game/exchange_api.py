@@ -0,0 +1,88 @@
+import json
+import logging
+
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse, HttpResponseBadRequest
+from django.views.decorators.http import require_GET, require_POST, require_http_methods
+
+from .exchange import EXCHANGE_RESOURCES, CancelOrder, PlaceOrder, get_exchange, serialize_order
+from .models import ExchangeOrder, PlayerProfile
+
+logger = logging.getLogger(__name__)
+
+def _player_id(request):
+    return PlayerProfile.objects.filter(user=request.user).values_list('id', flat=True).first()
+
+def _command_response(result):
+    payload = {'message': result['message'], 'fills': result['fills']}
+    if result['order'] is not None:
+        payload['order'] = serialize_order(result['order'])
+    return JsonResponse(payload, status=200 if result['ok'] else 400)
+
+@require_http_methods(["GET", "POST"])
+@login_required
+def api_exchange_orders(request):
+    """
+    GET /api/exchange/orders/
+    Открытые заявки игрока.
+
+    POST /api/exchange/orders/
+    Тело: {"resource_type": "gold", "side": "buy", "price": 12, "quantity": 5}
+    Заявка сразу сопоставляется с книгой; в ответе - заявка и её сделки.
+    """
+    if request.method == 'GET':
+        orders = ExchangeOrder.objects.filter(player__user=request.user, status='open').order_by('-id')
+        return JsonResponse({'orders': [serialize_order(order) for order in orders]})
+
+    try:
+        data = json.loads(request.body)
+        resource_type = data['resource_type']
+        side = data['side']
+        price = int(data['price'])
+        quantity = int(data['quantity'])
+    except (json.JSONDecodeError, KeyError, ValueError, TypeError):
+        return HttpResponseBadRequest("Invalid input data")
+
+    player_id = _player_id(request)
+    if player_id is None:
+        return HttpResponseBadRequest("Player profile not found")
+
+    try:
+        result = get_exchange().submit([PlaceOrder(player_id, resource_type, side, price, quantity)])[0]
+    except Exception as e:
+        logger.error(f"Error in api_exchange_orders: {str(e)}", exc_info=True)
+        return JsonResponse({'error': str(e)}, status=500)
+    return _command_response(result)
+
+@require_POST
+@login_required
+def api_cancel_order(request, order_id):
+    """
+    POST /api/exchange/orders/<order_id>/cancel/
+    Остаток заявки снимается с книги, резерв возвращается.
+    """
+    player_id = _player_id(request)
+    if player_id is None:
+        return HttpResponseBadRequest("Player profile not found")
+
+    try:
+        result = get_exchange().submit([CancelOrder(player_id, order_id)])[0]
+    except Exception as e:
+        logger.error(f"Error in api_cancel_order: {str(e)}", exc_info=True)
+        return JsonResponse({'error': str(e)}, status=500)
+    return _command_response(result)
+
+@require_GET
+@login_required
+def api_order_book(request, resource_type):
+    """
+    GET /api/exchange/book/<resource_type>/?depth=10
+    Лучшие уровни цен книги: [[цена, количество], ...].
+    """
+    if resource_type not in EXCHANGE_RESOURCES:
+        return JsonResponse({'error': 'Этот ресурс не торгуется на бирже'}, status=404)
+    try:
+        depth = max(1, min(int(request.GET.get('depth', 10)), 50))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid depth")
+    return JsonResponse({'resource_type': resource_type, **get_exchange().depth(resource_type, depth)})
@@ -0,0 +1,433 @@
+"""
+Групповые бои: много участников в одном Combat (рейды, командная арена).
+
+Состояние группового боя:
+
+    {
+        'mode': 'group',
+        'fighters': [...],   # снимки игроков (build_player_data) и монстров
+                             # с ключами 'team', 'kind' ('player'/'monster'), 'alive'
+        'pending': {...},    # ходы игроков текущего раунда: {индекс: [encode_input, цель]}
+        'events': [...],     # [turn, actor, zone, result, damage, hp_after, target]
+        'status', 'turn', 'winner',   # winner - номер победившей команды
+    }
+
+Раунд разрешается за один проход: удары всех живых участников
+считаются одновременно (как в calculate_damage(), но массивами NumPy),
+урон суммируется по целям, выбывшие определяются после раунда. В Combat
+пишется одно UPDATE на раунд - ходы игроков до конца раунда живут в
+CombatStore.
+
+Статус боя считается с точки зрения команды 0: 'victory' - победила
+команда 0, 'defeat' - другая команда или взаимное уничтожение.
+"""
+import numpy as np
+from django.db import transaction
+
+from .combat_logic import (
+    ARMOR_KEYS, RESULT_CODES, RESULT_NAMES, ZONES,
+    build_player_data, combat_rng, decode_input, encode_input, new_combat_seed,
+    player_attacker_stats, player_defender_stats,
+    monster_attacker_stats, monster_defender_stats,
+)
+from .combat_store import get_combat_store
+from .ledger import credit_each
+from .models import Combat, PlayerProfile
+from .monster_catalog import get_monster_catalog
+
+# Актор системных событий группового боя (индексы участников начинаются с 0)
+GROUP_ACTOR_SYSTEM = -1
+
+# Коды результатов удара в порядке проверки calculate_damage()
+HIT = RESULT_CODES['hit']
+CRIT = RESULT_CODES['crit']
+BLOCK = RESULT_CODES['block']
+DODGE = RESULT_CODES['dodge']
+PARRY = RESULT_CODES['parry']
+MISS = RESULT_CODES['miss']
+
+
+class GroupCombatError(Exception):
+    """Недопустимый ход в групповом бою"""
+
+
+def is_group_state(combat_state):
+    return combat_state.get('mode') == 'group'
+
+
+def player_fighter(player_profile, team, num_attacks=None):
+    """Участник-игрок для new_group_state()"""
+    fighter = build_player_data(player_profile, num_attacks=num_attacks)
+    fighter.update(team=team, kind='player', alive=fighter['current_hp'] > 0)
+    return fighter
+
+
+def monster_fighter(template, team):
+    """Участник-монстр из шаблона каталога (MonsterTemplate)"""
+    fighter = template.to_state()
+    fighter.update(team=team, kind='monster', alive=True)
+    return fighter
+
+
+def new_group_state(fighters):
+    """Начальное состояние группового боя"""
+    if len({fighter['team'] for fighter in fighters}) < 2:
+        raise GroupCombatError("В бою должно быть хотя бы две команды")
+
+    combat_state = {
+        'mode': 'group',
+        'fighters': fighters,
+        'pending': {},
+        'events': [[0, GROUP_ACTOR_SYSTEM, 0, RESULT_CODES['start'], 0, 0, GROUP_ACTOR_SYSTEM]],
+        'status': 'active',
+        'turn': 1,
+        'winner': None,
+    }
+    return combat_state
+
+
+def group_rng(seed, turn):
+    """Генератор NumPy для раунда; зависит только от (seed, turn), как combat_rng()"""
+    return np.random.default_rng(combat_rng(seed, turn).getrandbits(64))
+
+
+def fighter_index(combat_state, user_id):
+    """Индекс участника-игрока по user_id (None, если игрок не участвует)"""
+    for i, fighter in enumerate(combat_state['fighters']):
+        if fighter['kind'] == 'player' and fighter['id'] == user_id:
+            return i
+    return None
+
+
+def submit_move(combat_state, index, attack_zone, defense_zones, target=None):
+    """Запоминает ход игрока на текущий раунд"""
+    if combat_state['status'] != 'active':
+        raise GroupCombatError("Бой завершен")
+    fighters = combat_state['fighters']
+    fighter = fighters[index]
+    if not fighter['alive']:
+        raise GroupCombatError("Участник выбыл из боя")
+    if attack_zone not in ZONES or len(set(defense_zones)) != 2 or not set(defense_zones) <= set(ZONES):
+        raise GroupCombatError("Неверные зоны атаки или защиты")
+    if target is not None:
+        if not 0 <= target < len(fighters) or fighters[target]['team'] == fighter['team']:
+            raise GroupCombatError("Неверная цель")
+
+    combat_state['pending'][str(index)] = [encode_input(attack_zone, defense_zones), target]
+
+
+def round_ready(combat_state):
+    """Все живые игроки сделали ход"""
+    pending = combat_state['pending']
+    return all(
+        str(i) in pending
+        for i, fighter in enumerate(combat_state['fighters'])
+        if fighter['kind'] == 'player' and fighter['alive']
+    )
+
+
+def _pick_defense(rng, size):
+    """Две разные зоны защиты (аналог random.sample(range(1, 5), 2))"""
+    first = rng.integers(1, 5, size)
+    second = rng.integers(1, 4, size)
+    second += second >= first
+    return first, second
+
+
+def _fighter_arrays(fighters):
+    """Характеристики участников массивами для пакетного расчёта"""
+    attack = []
+    defense = []
+    for fighter in fighters:
+        if fighter['kind'] == 'player':
+            attack.append(player_attacker_stats(fighter))
+            defense.append(player_defender_stats(fighter))
+        else:
+            attack.append(monster_attacker_stats(fighter))
+            defense.append(monster_defender_stats(fighter))
+
+    return {
+        'damage_min': np.array([a.get('damage_min', 1) for a in attack], dtype=np.int64),
+        'damage_max': np.array([a.get('damage_max', 5) for a in attack], dtype=np.int64),
+        'crit_chance': np.array([a.get('crit_chance', 0) for a in attack], dtype=np.int64),
+        'strength': np.array([a.get('strength', 3) for a in attack], dtype=np.float64),
+        'dodge_chance': np.array([d.get('dodge_chance', 0) for d in defense], dtype=np.int64),
+        'parry': np.array([d.get('parry', 0) for d in defense], dtype=np.int64),
+        # armor[участник, зона]; столбец 0 не используется
+        'armor': np.array(
+            [[0] + [d.get(ARMOR_KEYS[zone], 0) for zone in sorted(ARMOR_KEYS)] for d in defense],
+            dtype=np.float64,
+        ),
+    }
+
+
+def _resolve_swings(rng, stats, attacker, target, zone, defense_a, defense_b):
+    """
+    Векторная версия calculate_damage() для всех ударов раунда.
+
+    Возвращает (урон, код результата) массивами по ударам.
+    """
+    size = attacker.shape[0]
+    miss = rng.integers(1, 101, size) <= 5
+    dodge = rng.integers(1, 101, size) <= stats['dodge_chance'][target]
+    parry = rng.integers(1, 101, size) <= stats['parry'][target]
+    crit = rng.integers(1, 101, size) <= stats['crit_chance'][attacker]
+    block = ~crit & ((zone == defense_a) | (zone == defense_b))
+
+    base_damage = rng.integers(stats['damage_min'][attacker], stats['damage_max'][attacker] + 1)
+    damage = base_damage * (1 + np.maximum(0, stats['strength'][attacker] - 3) * 0.1)
+    damage[crit] *= 2
+    damage[block] *= 0.25
+    damage = np.maximum(1, damage - stats['armor'][target, zone]).astype(np.int64)
+
+    result = np.full(size, HIT, dtype=np.int64)
+    result[block] = BLOCK
+    result[crit] = CRIT
+    # Порядок как в calculate_damage(): промах, уворот, парирование
+    result[parry] = PARRY
+    result[dodge] = DODGE
+    result[miss] = MISS
+    damage[miss | dodge | parry] = 0
+    return damage, result
+
+
+def resolve_round(combat_state, rng):
+    """
+    Разрешает раунд группового боя.
+
+    Игроки без хода в pending (например, по таймауту) ходят как ИИ.
+    Возвращает ходы раунда {индекс: [encode_input, цель]} для повтора боя.
+    """
+    fighters = combat_state['fighters']
+    turn = combat_state['turn']
+    count = len(fighters)
+    pending = combat_state['pending']
+
+    alive = np.array([fighter['alive'] for fighter in fighters], dtype=bool)
+    team = np.array([fighter['team'] for fighter in fighters], dtype=np.int64)
+
+    # Выбор ИИ делается для всех сразу, затем заменяется ходами игроков
+    attack_zone = rng.integers(1, 5, count)
+    defense_a, defense_b = _pick_defense(rng, count)
+    target = np.full(count, -1, dtype=np.int64)
+    for key, (code, chosen) in pending.items():
+        i = int(key)
+        zone, (first, second) = decode_input(code)
+        attack_zone[i], defense_a[i], defense_b[i] = zone, first, second
+        if chosen is not None and fighters[chosen]['alive']:
+            target[i] = chosen
+
+    # Цели по умолчанию - случайный живой противник
+    for side in np.unique(team[alive]):
+        enemies = np.flatnonzero(alive & (team != side))
+        need = np.flatnonzero(alive & (team == side) & (target < 0))
+        if enemies.size and need.size:
+            target[need] = enemies[rng.integers(0, enemies.size, need.size)]
+
+    # Удары: каждый живой участник бьёт свою цель num_attacks раз
+    attackers = np.flatnonzero(alive & (target >= 0))
+    repeats = np.array([max(1, fighters[i].get('num_attacks', 1)) for i in attackers], dtype=np.int64)
+    swing_attacker = np.repeat(attackers, repeats)
+    swing_target = target[swing_attacker]
+    swing_zone = attack_zone[swing_attacker]
+
+    stats = _fighter_arrays(fighters)
+    damage, result = _resolve_swings(
+        rng, stats, swing_attacker, swing_target, swing_zone,
+        defense_a[swing_target], defense_b[swing_target],
+    )
+
+    # Удары раунда одновременны: урон применяется ко всем целям сразу
+    hp = np.array([fighter['current_hp'] for fighter in fighters], dtype=np.int64)
+    events = combat_state['events']
+    for a, t, z, code, dmg in zip(swing_attacker.tolist(), swing_target.tolist(), swing_zone.tolist(),
+                                  result.tolist(), damage.tolist()):
+        hp[t] = max(0, hp[t] - dmg)
+        events.append([turn, a, z, code, dmg, int(hp[t]), t])
+
+    for i, fighter in enumerate(fighters):
+        fighter['current_hp'] = int(hp[i])
+        if fighter['alive'] and hp[i] <= 0:
+            fighter['alive'] = False
+            events.append([turn, i, 0, RESULT_CODES['death'], 0, 0, GROUP_ACTOR_SYSTEM])
+
+    moves = dict(pending)
+    combat_state['pending'] = {}
+    _check_finish(combat_state)
+    if combat_state['status'] == 'active':
+        combat_state['turn'] += 1
+    return moves
+
+
+def _check_finish(combat_state):
+    """Завершает бой, если в живых осталась одна команда (или никого)"""
+    teams_alive = {fighter['team'] for fighter in combat_state['fighters'] if fighter['alive']}
+    if len(teams_alive) > 1:
+        return
+
+    winner = teams_alive.pop() if teams_alive else None
+    combat_state['winner'] = winner
+    combat_state['status'] = 'victory' if winner == 0 else 'defeat'
+    combat_state['events'].append([
+        combat_state['turn'], GROUP_ACTOR_SYSTEM, 0, RESULT_CODES[combat_state['status']],
+        0, 0, GROUP_ACTOR_SYSTEM,
+    ])
+
+
+def render_group_event(event, combat_state):
+    """Текст одного события группового боя"""
+    turn, actor, zone, code, damage, hp_after, target = event
+    result = RESULT_NAMES[code]
+    fighters = combat_state['fighters']
+
+    if result == 'start':
+        return "Бой начался!"
+    if result == 'abandoned' or (result == 'defeat' and combat_state.get('status') == 'abandoned'):
+        # Бои, прерванные до появления 'abandoned', закрыты событием 'defeat'
+        return "Бой прерван: время хода истекло."
+    if result in ('victory', 'defeat'):
+        winner = combat_state.get('winner')
+        return "Ничья - никто не выжил" if winner is None else f"Победила команда {winner + 1}!"
+    if result == 'death':
+        return f"{fighters[actor]['name']} выбывает из боя"
+
+    attacker = fighters[actor]['name']
+    defender = fighters[target]
+    if result == 'dodge': return f"{defender['name']} увернулся от удара {attacker}"
+    if result == 'parry': return f"{defender['name']} парировал удар {attacker}"
+    if result == 'miss': return f"{attacker} промахнулся"
+
+    msg = f"{attacker} ударил {ZONES[zone]} {defender['name']}"
+    if result == 'crit': msg += " (КРИТ)"
+    elif result == 'block': msg += " (БЛОК)"
+    return msg + f" на -{damage} HP. [{hp_after}/{defender['max_hp']}]"
+
+
+def render_group_log(combat_state, events=None):
+    if events is None:
+        events = combat_state['events']
+    return [render_group_event(event, combat_state) for event in events]
+
+
+def replay_group_battle(combat_state, seed, inputs):
+    """Повтор группового боя по seed и ходам раундов (Combat.inputs)"""
+    fighters = []
+    for fighter in combat_state['fighters']:
+        fighter = dict(fighter)
+        fighter['current_hp'] = fighter.get('start_hp', fighter['max_hp'])
+        fighter['alive'] = fighter['current_hp'] > 0
+        fighters.append(fighter)
+
+    state = new_group_state(fighters)
+    for moves in inputs:
+        if state['status'] != 'active':
+            break
+        state['pending'] = dict(moves)
+        resolve_round(state, group_rng(seed, state['turn']))
+    return state
+
+
+def start_group_battle(owner, player_profiles, monster_count=None, seed=None):
+    """
+    Создаёт рейд: игроки (команда 0) против монстров из каталога (команда 1).
+
+    monster_count по умолчанию равен числу игроков, уровень монстров - по
+    среднему уровню группы. Возвращает созданный Combat.
+    """
+    if seed is None:
+        seed = new_combat_seed()
+    rng = combat_rng(seed, 0)
+
+    fighters = [player_fighter(profile, team=0) for profile in player_profiles]
+    level = round(sum(profile.level for profile in player_profiles) / len(player_profiles))
+    catalog = get_monster_catalog()
+    for _ in range(monster_count or len(player_profiles)):
+        fighters.append(monster_fighter(catalog.pick(level, rng=rng), team=1))
+
+    combat = Combat.objects.create(owner=owner, state=new_group_state(fighters), seed=seed)
+    get_combat_store().add(combat)
+    return combat
+
+
+def submit_group_move(combat_id, user_id, attack_zone, defense_zones, target=None, force=False):
+    """
+    Ход игрока в групповом бою.
+
+    Пока не сходили все живые игроки, ход хранится только в CombatStore.
+    Последний ход (или force=True) разрешает раунд и записывает бой в БД
+    одним UPDATE. Возвращает запись боя из CombatStore.
+    """
+    store = get_combat_store()
+    with store.turn(combat_id) as entry:
+        if entry is None or not is_group_state(entry['state']):
+            raise GroupCombatError("Бой не найден")
+        state = entry['state']
+
+        index = fighter_index(state, user_id)
+        if index is None:
+            raise GroupCombatError("Вы не участвуете в этом бою")
+        submit_move(state, index, attack_zone, defense_zones, target)
+        entry['idle'] = 0
+
+        if not (force or round_ready(state)):
+            store.put(entry)
+            return entry
+
+        resolve_group_round(store, entry)
+    return entry
+
+
+def resolve_group_round(store, entry):
+    """Разрешает раунд и сохраняет бой (вызывать под store.lock)"""
+    state = entry['state']
+    moves = resolve_round(state, group_rng(entry['seed'], state['turn']))
+    entry['inputs'].append(moves)
+    entry['version'] += 1
+
+    if state['status'] == 'active':
+        store.save(entry, flush=True)
+        return
+
+    with transaction.atomic():
+        finish_group_battle(state)
+        store.save(entry, flush=True)
+    store.evict(entry['id'])
+
+
+def finish_group_battle(combat_state):
+    """
+    Награды группового боя.
+
+    Выжившие и павшие игроки победившей команды делят поровну награды за
+    монстров проигравших команд; HP игроков сохраняется, проигравшим
+    остаётся 1 HP, как в finish_battle().
+    """
+    fighters = combat_state['fighters']
+    winner = combat_state['winner']
+    players = [fighter for fighter in fighters if fighter['kind'] == 'player']
+    winners = [fighter for fighter in players if fighter['team'] == winner]
+    defeated_monsters = [fighter for fighter in fighters
+                         if fighter['kind'] == 'monster' and fighter['team'] != winner]
+
+    xp_share = coin_share = 0
+    if winners:
+        xp_share = sum(m.get('xp_reward', 10) for m in defeated_monsters) // len(winners)
+        coin_share = sum(m.get('coin_reward', 5) for m in defeated_monsters) // len(winners)
+
+    profiles = PlayerProfile.objects.in_bulk([fighter['id'] for fighter in players], field_name='user_id')
+    if coin_share:
+        # Монеты всем победителям - одна операция леджера
+        credit_each(
+            [profiles[fighter['id']] for fighter in winners if fighter['id'] in profiles],
+            'coins', coin_share, "Награда за групповой бой", transaction_type='reward',
+        )
+    for fighter in players:
+        profile = profiles.get(fighter['id'])
+        if profile is None:
+            continue
+        if fighter['team'] == winner:
+            profile.gain_experience(xp_share, save=False)
+            profile.current_hp = max(1, fighter['current_hp'])
+        else:
+            profile.current_hp = 1
+        profile.save()
@@ -0,0 +1,277 @@
+"""
+Операции с инвентарём игрока: выдача предметов со складыванием в стопки,
+разделение и объединение стопок, перемещение, сортировка и уплотнение.
+
+Каждая операция - одна транзакция из нескольких запросов на весь набор
+предметов: строка игрока блокируется (параллельные операции одного
+игрока идут по очереди), инвентарь читается одним запросом, изменения
+пишутся bulk_update / bulk_create / одним DELETE. Выдача 1000 зелий -
+несколько запросов, а не строка и запрос на каждую единицу.
+
+Инвентарь листается по ключу: курсор - пара (inventory_position, id)
+последнего показанного предмета (ячейки могут совпадать), фильтры по типу идут по копиям item_type /
+item_subtype в строке инвентаря (индекс owner, item_type, item_subtype,
+inventory_position) без JOIN с Item.
+"""
+from django.db import transaction
+from django.db.models import Q
+
+from .models import EQUIPPABLE_TYPES, InventoryItem, PlayerProfile, equipment_slot_for
+
+INVENTORY_PAGE_SIZE = 50
+MAX_INVENTORY_PAGE_SIZE = 200
+
+# Лёгкий режим: только поля строки инвентаря, статика предмета - отдельно по item_id
+LEAN_FIELDS = (
+    'id', 'item_id', 'item_type', 'item_subtype', 'quantity', 'inventory_position',
+    'current_durability', 'max_durability', 'is_equipped',
+)
+
+
+class InventoryError(Exception):
+    """Операция с инвентарём невозможна (нет места, не та стопка и т.п.)"""
+
+
+def _lock_owner(owner):
+    list(PlayerProfile.objects.select_for_update().filter(pk=owner.pk).values_list('pk', flat=True))
+
+
+def _free_positions(owner, used):
+    for position in range(owner.get_total_inventory_slots()):
+        if position not in used:
+            yield position
+
+
+def _take_position(free):
+    position = next(free, None)
+    if position is None:
+        raise InventoryError("Недостаточно места в инвентаре")
+    return position
+
+
+def _can_stack(inv_item):
+    return inv_item.item.is_stackable and inv_item.item.max_stack > 1 and not inv_item.is_equipped
+
+
+def add_items(owner, grants):
+    """
+    Выдаёт предметы игроку: grants - [(Item, количество)].
+
+    Складываемые предметы сначала дополняют неполные стопки, остаток
+    раскладывается новыми стопками по max_stack в свободные ячейки.
+    Всё или ничего: при нехватке места бросает InventoryError.
+    Возвращает (новые строки, дополненные стопки).
+    """
+    totals = {}
+    for item, quantity in grants:
+        if quantity <= 0:
+            raise InventoryError("Количество должно быть больше нуля")
+        totals[item.pk] = (item, totals.get(item.pk, (item, 0))[1] + quantity)
+
+    with transaction.atomic():
+        _lock_owner(owner)
+        rows = InventoryItem.objects.filter(owner=owner).values_list(
+            'id', 'item_id', 'quantity', 'inventory_position', 'is_equipped',
+        )
+        used = set()
+        partial = {}
+        for inv_id, item_id, quantity, position, is_equipped in rows:
+            used.add(position)
+            item = totals.get(item_id, (None,))[0]
+            if item is not None and item.is_stackable and not is_equipped and quantity < item.max_stack:
+                partial.setdefault(item_id, []).append((inv_id, quantity))
+
+        free = _free_positions(owner, used)
+        topped_up = []
+        created = []
+        for item, quantity in totals.values():
+            stack_size = item.max_stack if item.is_stackable and item.max_stack > 1 else 1
+            for inv_id, have in partial.get(item.pk, ()):
+                if not quantity:
+                    break
+                added = min(stack_size - have, quantity)
+                topped_up.append(InventoryItem(pk=inv_id, quantity=have + added))
+                quantity -= added
+            while quantity:
+                size = min(stack_size, quantity)
+                created.append(InventoryItem(
+                    owner=owner, item=item, quantity=size, inventory_position=_take_position(free),
+                    item_type=item.type, item_subtype=item.subtype,
+                ))
+                quantity -= size
+
+        if topped_up:
+            InventoryItem.objects.bulk_update(topped_up, ['quantity'])
+        InventoryItem.objects.bulk_create(created, batch_size=500)
+    return created, topped_up
+
+
+def split_stack(owner, inv_item_id, quantity, position=None):
+    """Отделяет quantity предметов стопки в новую стопку (в ячейку position или первую свободную)"""
+    with transaction.atomic():
+        _lock_owner(owner)
+        try:
+            stack = InventoryItem.objects.select_related('item').get(pk=inv_item_id, owner=owner)
+        except InventoryItem.DoesNotExist:
+            raise InventoryError("Предмет не найден")
+        if not _can_stack(stack):
+            raise InventoryError("Эту стопку нельзя разделить")
+        if not 0 < quantity < stack.quantity:
+            raise InventoryError("Неверное количество")
+
+        used = set(InventoryItem.objects.filter(owner=owner).values_list('inventory_position', flat=True))
+        if position is None:
+            position = _take_position(_free_positions(owner, used))
+        elif not 0 <= position < owner.get_total_inventory_slots():
+            raise InventoryError("Нет такой ячейки")
+        elif position in used:
+            raise InventoryError("Ячейка занята")
+
+        stack.quantity -= quantity
+        stack.save(update_fields=['quantity'])
+        return InventoryItem.objects.create(
+            owner=owner, item=stack.item, quantity=quantity, inventory_position=position,
+            current_durability=stack.current_durability, max_durability=stack.max_durability,
+            item_type=stack.item_type, item_subtype=stack.item_subtype,
+        )
+
+
+def merge_stacks(owner, source_id, target_id):
+    """Перекладывает предметы из стопки source в target (сколько поместится). Возвращает число перенесённых"""
+    with transaction.atomic():
+        _lock_owner(owner)
+        stacks = InventoryItem.objects.select_related('item').filter(owner=owner).in_bulk([source_id, target_id])
+        source, target = stacks.get(source_id), stacks.get(target_id)
+        if source is None or target is None or source_id == target_id:
+            raise InventoryError("Предмет не найден")
+        if source.item_id != target.item_id or not _can_stack(source) or not _can_stack(target):
+            raise InventoryError("Эти предметы нельзя сложить")
+
+        moved = min(source.quantity, target.item.max_stack - target.quantity)
+        if moved <= 0:
+            raise InventoryError("Стопка заполнена")
+        target.quantity += moved
+        source.quantity -= moved
+        if source.quantity:
+            InventoryItem.objects.bulk_update([source, target], ['quantity'])
+        else:
+            target.save(update_fields=['quantity'])
+            source.delete()
+        return moved
+
+
+def move_item(owner, inv_item_id, position):
+    """Перемещает предмет в ячейку; предмет из занятой ячейки встаёт на его место"""
+    if not 0 <= position < owner.get_total_inventory_slots():
+        raise InventoryError("Нет такой ячейки")
+    with transaction.atomic():
+        _lock_owner(owner)
+        rows = list(InventoryItem.objects.filter(Q(pk=inv_item_id) | Q(inventory_position=position), owner=owner))
+        moving = next((row for row in rows if row.pk == inv_item_id), None)
+        if moving is None:
+            raise InventoryError("Предмет не найден")
+        occupant = next((row for row in rows if row.pk != inv_item_id), None)
+
+        changed = [moving]
+        if occupant is not None:
+            occupant.inventory_position = moving.inventory_position
+            changed.append(occupant)
+        moving.inventory_position = position
+        InventoryItem.objects.bulk_update(changed, ['inventory_position'])
+        return occupant
+
+
+def _sort_key(inv_item):
+    return (not inv_item.is_equipped, inv_item.item.type, inv_item.item.name, -inv_item.quantity, inv_item.pk)
+
+
+def compact_inventory(owner, sort=True):
+    """
+    Уплотняет инвентарь: неполные стопки одного предмета сливаются,
+    опустевшие строки удаляются, предметы занимают ячейки с 0 подряд
+    (sort - по надетости, типу и названию, иначе в прежнем порядке).
+    Возвращает число удалённых строк.
+    """
+    with transaction.atomic():
+        _lock_owner(owner)
+        rows = list(
+            InventoryItem.objects.filter(owner=owner).select_related('item').order_by('inventory_position', 'id')
+        )
+        original = {row.pk: (row.quantity, row.inventory_position) for row in rows}
+
+        stacks = {}
+        for row in rows:
+            if _can_stack(row):
+                stacks.setdefault(row.item_id, []).append(row)
+        emptied = []
+        for group in stacks.values():
+            total = sum(row.quantity for row in group)
+            for row in group:
+                row.quantity = min(row.item.max_stack, total)
+                total -= row.quantity
+                if not row.quantity:
+                    emptied.append(row.pk)
+
+        kept = [row for row in rows if row.quantity]
+        if sort:
+            kept.sort(key=_sort_key)
+        for position, row in enumerate(kept):
+            row.inventory_position = position
+
+        changed = [row for row in kept if original[row.pk] != (row.quantity, row.inventory_position)]
+        if changed:
+            InventoryItem.objects.bulk_update(changed, ['quantity', 'inventory_position'], batch_size=500)
+        if emptied:
+            InventoryItem.objects.filter(pk__in=emptied).delete()
+        return len(emptied)
+
+
+def inventory_queryset(owner, item_type=None, item_subtype=None):
+    """Инвентарь игрока с фильтрами по типу и подтипу предмета"""
+    queryset = InventoryItem.objects.filter(owner=owner)
+    if item_type and item_type != 'all':
+        queryset = queryset.filter(item_type=item_type)
+    if item_subtype:
+        queryset = queryset.filter(item_subtype=item_subtype)
+    return queryset
+
+
+def format_cursor(position, item_id):
+    return f'{position}:{item_id}'
+
+
+def parse_cursor(value):
+    """Курсор страницы 'ячейка:id' -> (ячейка, id); ValueError, если он некорректен"""
+    position, item_id = value.split(':')
+    return int(position), int(item_id)
+
+
+def inventory_page(owner, item_type=None, item_subtype=None, after=None, limit=INVENTORY_PAGE_SIZE, lean=False):
+    """
+    Страница инвентаря по возрастанию (ячейка, id): предметы после курсора
+    after - пары (inventory_position, id), см. parse_cursor().
+
+    lean - словари LEAN_FIELDS с can_equip и equipment_slot вместо
+    объектов InventoryItem с подгруженным Item.
+    Возвращает (предметы, курсор следующей страницы 'ячейка:id' или None).
+    """
+    limit = max(1, min(limit, MAX_INVENTORY_PAGE_SIZE))
+    queryset = inventory_queryset(owner, item_type, item_subtype)
+    if after is not None:
+        position, item_id = after
+        queryset = queryset.filter(
+            Q(inventory_position__gt=position) | Q(inventory_position=position, id__gt=item_id)
+        )
+    queryset = queryset.order_by('inventory_position', 'id')
+    if lean:
+        rows = list(queryset.values(*LEAN_FIELDS)[:limit + 1])
+        for row in rows:
+            row['can_equip'] = row['item_type'] in EQUIPPABLE_TYPES
+            row['equipment_slot'] = equipment_slot_for(row['item_type'], row['item_subtype'])
+        last = rows[limit - 1] if len(rows) > limit else None
+        next_cursor = format_cursor(last['inventory_position'], last['id']) if last else None
+    else:
+        rows = list(queryset.select_related('item')[:limit + 1])
+        last = rows[limit - 1] if len(rows) > limit else None
+        next_cursor = format_cursor(last.inventory_position, last.id) if last else None
+    return rows[:limit], next_cursor
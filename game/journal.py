@@ -0,0 +1,55 @@
+"""
+Журнал валютных операций (CurrencyTransaction).
+
+record() сразу вставляет записи операции одним многострочным INSERT и
+обновляет дневные сводки (game/statements.py) в транзакции вызывающего
+кода - той же, в которой меняются балансы. Ошибка записи журнала
+откатывает и изменение баланса. ContentType связанных объектов
+резолвится один раз на модель.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from .models import CurrencyTransaction
+from .statements import apply_rollups
+
+_content_type_ids = {}
+
+
+def content_type_id(obj):
+    """id ContentType модели объекта (кешируется на процесс)"""
+    model = obj._meta.concrete_model
+    ct_id = _content_type_ids.get(model)
+    if ct_id is None:
+        ct_id = _content_type_ids[model] = ContentType.objects.get_for_model(model).id
+    return ct_id
+
+
+def build_entry(player_id, currency_type, amount, transaction_type, balance_after, description='', related_object=None):
+    """Несохранённая запись журнала"""
+    entry = CurrencyTransaction(
+        player_id=player_id,
+        currency_type=currency_type,
+        amount=amount,
+        transaction_type=transaction_type,
+        balance_after=balance_after,
+        description=description,
+    )
+    if related_object is not None:
+        entry.related_object_id = related_object.pk
+        entry.related_content_type_id = content_type_id(related_object)
+    return entry
+
+
+def record(*entries):
+    """
+    Пишет записи операции в журнал одним bulk_create и обновляет дневные сводки.
+
+    Вызывать внутри транзакции, меняющей балансы: исключение откатывает
+    операцию целиком.
+    """
+    if not entries:
+        return
+    with transaction.atomic():
+        CurrencyTransaction.objects.bulk_create(entries, batch_size=500)
+        apply_rollups(entries)
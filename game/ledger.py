@@ -0,0 +1,243 @@
+"""
+Леджер валют игроков.
+
+Любая денежная операция - набор проводок (Leg): игрок, валюта, изменение
+баланса, тип и описание записи журнала. apply_legs() применяет все
+проводки операции в одной транзакции:
+
+1. блокирует строки игроков (select_for_update, по возрастанию id, чтобы
+   встречные переводы не взаимоблокировались) и проверяет балансы;
+2. меняет балансы одним UPDATE на игрока через F() с условием
+   «баланс не уйдёт в минус» прямо в запросе;
+3. последним запросом транзакции пишет записи CurrencyTransaction одним
+   bulk_create (game/journal.py) - журнал фиксируется вместе с балансами.
+
+Перевод с комиссией - 2 UPDATE и 1 INSERT вместо 5+ отдельных записей.
+"""
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import F
+
+from .journal import build_entry, record
+from .models import PlayerProfile
+
+# Валюты, которыми можно оперировать через леджер (как в add_currency)
+LEDGER_CURRENCIES = ('coins', 'silver', 'silver_dust', 'gold', 'gold_dust')
+
+# Названия валют в сообщениях («Недостаточно монет»)
+CURRENCY_GENITIVE = {
+    'coins': 'монет',
+    'silver': 'серебра',
+    'silver_dust': 'серебряной пыли',
+    'gold': 'золота',
+    'gold_dust': 'золотой пыли',
+}
+
+# amount - изменение баланса: > 0 зачисление, < 0 списание.
+# В журнал пишется модуль суммы, направление задаёт transaction_type.
+Leg = namedtuple('Leg', 'player_id currency amount transaction_type description related_object')
+Leg.__new__.__defaults__ = ('', None)
+
+
+class LedgerError(Exception):
+    """Операция не может быть проведена (недостаточно средств, превышен лимит)"""
+
+
+class InsufficientFunds(LedgerError):
+    """Баланс игрока player_id в валюте currency ушёл бы в минус"""
+
+    def __init__(self, player_id, currency):
+        super().__init__(f"Недостаточно {currency_genitive(currency)}")
+        self.player_id = player_id
+        self.currency = currency
+
+
+def currency_genitive(currency):
+    return CURRENCY_GENITIVE.get(currency, currency)
+
+
+def currency_limit(currency):
+    """Максимальный баланс валюты (PlayerProfile.MAX_*)"""
+    return getattr(PlayerProfile, f'MAX_{currency.upper()}', None)
+
+
+def apply_legs(legs, journal=True):
+    """
+    Атомарно проводит операцию из нескольких проводок.
+
+    Возвращает новые балансы {player_id: {валюта: баланс}}; при нехватке
+    средств или превышении лимита бросает LedgerError (InsufficientFunds),
+    ничего не меняя. journal=False - без записей CurrencyTransaction.
+    """
+    for leg in legs:
+        if leg.currency not in LEDGER_CURRENCIES:
+            raise LedgerError(f"Валюта {leg.currency} не поддерживается")
+
+    deltas = {}
+    for leg in legs:
+        player_deltas = deltas.setdefault(leg.player_id, {})
+        player_deltas[leg.currency] = player_deltas.get(leg.currency, 0) + leg.amount
+    currencies = sorted({leg.currency for leg in legs})
+
+    with transaction.atomic():
+        balances = {
+            row['id']: row
+            for row in PlayerProfile.objects.select_for_update()
+            .filter(id__in=deltas).order_by('id').values('id', *currencies)
+        }
+        missing = set(deltas) - set(balances)
+        if missing:
+            raise LedgerError(f"Игрок не найден: {', '.join(map(str, sorted(missing)))}")
+
+        for player_id, player_deltas in deltas.items():
+            for currency, delta in player_deltas.items():
+                new_balance = balances[player_id][currency] + delta
+                limit = currency_limit(currency)
+                if new_balance < 0:
+                    raise InsufficientFunds(player_id, currency)
+                if limit is not None and new_balance > limit:
+                    raise LedgerError(f"Превышен лимит {currency_genitive(currency)}")
+
+        for player_id in sorted(deltas):
+            player_deltas = {currency: delta for currency, delta in deltas[player_id].items() if delta}
+            if not player_deltas:
+                continue
+            # Условие в WHERE - защита от гонки там, где select_for_update не блокирует (SQLite)
+            guard = {f'{currency}__gte': -delta for currency, delta in player_deltas.items() if delta < 0}
+            updated = PlayerProfile.objects.filter(id=player_id, **guard).update(
+                **{currency: F(currency) + delta for currency, delta in player_deltas.items()}
+            )
+            if not updated:
+                raise LedgerError("Баланс изменился во время операции")
+
+        # Баланс после каждой проводки - в порядке проводок
+        running = {player_id: dict(row) for player_id, row in balances.items()}
+        entries = []
+        for leg in legs:
+            running[leg.player_id][leg.currency] += leg.amount
+            entries.append(journal_entry(leg, running[leg.player_id][leg.currency]))
+        if journal:
+            record(*entries)
+
+    return {
+        player_id: {currency: row[currency] for currency in currencies}
+        for player_id, row in running.items()
+    }
+
+
+def journal_entry(leg, balance_after):
+    """Несохранённая запись CurrencyTransaction для проводки"""
+    return build_entry(
+        leg.player_id, leg.currency, abs(leg.amount), leg.transaction_type,
+        balance_after, leg.description, leg.related_object,
+    )
+
+
+def _sync(profile, balances):
+    """Переносит новые балансы в объект профиля (без записи в БД)"""
+    for currency, value in balances.get(profile.pk, {}).items():
+        setattr(profile, currency, value)
+        # Значение уже в БД - следующий save() не должен писать его повторно
+        loaded = profile.__dict__.get('_loaded_values')
+        if loaded is not None:
+            loaded[currency] = value
+
+
+def credit(profile, currency, amount, description='', related_object=None, transaction_type='add'):
+    """Зачисление на баланс игрока (в журнал - только с описанием или объектом, как раньше)"""
+    balances = apply_legs(
+        [Leg(profile.pk, currency, amount, transaction_type, description, related_object)],
+        journal=bool(description or related_object),
+    )
+    _sync(profile, balances)
+
+
+def debit(profile, currency, amount, description='', related_object=None, transaction_type='subtract'):
+    """Списание с баланса игрока (в журнал - только с описанием или объектом, как раньше)"""
+    balances = apply_legs(
+        [Leg(profile.pk, currency, -amount, transaction_type, description, related_object)],
+        journal=bool(description or related_object),
+    )
+    _sync(profile, balances)
+
+
+def credit_each(profiles, currency, amount, description='', transaction_type='add'):
+    """
+    Одинаковое зачисление нескольким игрокам одной операцией леджера.
+
+    Если кому-то зачисление не позволяет лимит, остальным оно проводится
+    по одному. Возвращает игроков, которым зачислено.
+    """
+    legs = [Leg(profile.pk, currency, amount, transaction_type, description) for profile in profiles]
+    try:
+        balances = apply_legs(legs)
+    except LedgerError:
+        paid = []
+        for profile in profiles:
+            try:
+                credit(profile, currency, amount, description, transaction_type=transaction_type)
+            except LedgerError:
+                continue
+            paid.append(profile)
+        return paid
+    for profile in profiles:
+        _sync(profile, balances)
+    return list(profiles)
+
+
+def transfer_legs(sender, receiver, currency, amount):
+    """
+    Проводки перевода между игроками (правила PlayerProfile.transfer_to_player).
+
+    Монеты: отправитель платит сумму и комиссию player_to_player сверху.
+    Ресурсы: ресурс переходит целиком, комиссия resource_sale от его
+    стоимости в монетах списывается монетами.
+    """
+    if currency == 'coins':
+        fee = int(amount * PlayerProfile.TRANSACTION_FEE_RATES['player_to_player'])
+        fee_description = "Комиссия за перевод монет"
+        transfer_description = f"Перевод игроку {receiver.name}"
+    else:
+        resource_value = int(amount * PlayerProfile.RESOURCE_RATES[currency])
+        fee = int(resource_value * PlayerProfile.TRANSACTION_FEE_RATES['resource_sale'])
+        fee_description = f"Комиссия за перевод {currency} игроку {receiver.name}"
+        transfer_description = f"Перевод {currency} игроку {receiver.name}"
+
+    legs = [
+        Leg(sender.pk, currency, -amount, 'transfer', transfer_description, receiver),
+        Leg(receiver.pk, currency, amount, 'add', f"Получено от {sender.name}", sender),
+    ]
+    if fee > 0:
+        legs.append(Leg(sender.pk, 'coins', -fee, 'fee', fee_description))
+    return legs
+
+
+def transfer(sender, receiver, currency, amount):
+    """
+    Перевод между игроками одной транзакцией.
+
+    Возвращает (успех, сообщение) как PlayerProfile.transfer_to_player.
+    """
+    if currency not in LEDGER_CURRENCIES:
+        return False, "Эта валюта не может быть передана"
+    if amount <= 0:
+        return False, "Сумма перевода должна быть больше нуля"
+    if sender.pk == receiver.pk:
+        return False, "Нельзя перевести самому себе"
+
+    try:
+        balances = apply_legs(transfer_legs(sender, receiver, currency, amount))
+    except InsufficientFunds as e:
+        if e.player_id == sender.pk and e.currency == 'coins':
+            # Монет не хватило на сумму с комиссией или на саму комиссию
+            if currency == 'coins':
+                return False, "Недостаточно монет с учетом комиссии"
+            return False, "Недостаточно монет для оплаты комиссии"
+        return False, str(e)
+    except LedgerError as e:
+        return False, str(e)
+
+    _sync(sender, balances)
+    _sync(receiver, balances)
+    return True, "Перевод успешно выполнен"
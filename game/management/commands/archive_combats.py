@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from game.combat_archive import DEFAULT_BATCH_SIZE, archive_finished_combats
+
+
+class Command(BaseCommand):
+    help = 'Move finished fights older than --days into CombatArchive (run periodically, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help='Archive fights finished more than N days ago')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Fights per transaction')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after N batches')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+        parser.add_argument('--export-dir', default=None,
+                            help='Write full fight states to daily JSONL.gz files here instead of the archive table')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        archived = archive_finished_combats(
+            older_than=timedelta(days=options['days']),
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            pause=options['pause'],
+            export_dir=options['export_dir'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Заархивировано боёв: {archived}'))
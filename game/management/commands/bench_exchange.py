@@ -0,0 +1,95 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from game.exchange import CancelOrder, Exchange, PlaceOrder, order_cost
+from game.models import ExchangeOrder, PlayerProfile
+
+
+class Command(BaseCommand):
+    help = 'Order book throughput: random orders around a mid price, matched in memory and persisted in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=50)
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--batch', type=int, default=500, help='Commands per persisted batch')
+        parser.add_argument('--resource', default='gold')
+        parser.add_argument('--mid', type=int, default=100, help='Mid price in coins')
+        parser.add_argument('--cancel-rate', type=float, default=0.1)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark players and orders afterwards')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        resource = options['resource']
+        stamp = int(time.time() * 1000)
+        users = [User.objects.create_user(f'exchange_bench_{i}_{stamp}') for i in range(options['players'])]
+        profiles = [
+            PlayerProfile.objects.create(
+                user=user, name=user.username, classification='warrior', coins=5000000, **{resource: 50000},
+            )
+            for user in users
+        ]
+        ids = [profile.pk for profile in profiles]
+        before = self.holdings(ids, resource)
+
+        # Отдельный экземпляр с заявками только игроков бенчмарка: сделки
+        # с реальными игроками списали бы их монеты и ресурсы
+        exchange = Exchange(player_ids=ids)
+        exchange.load()
+        placed = fills = rejected = 0
+        open_orders = []
+        started = time.perf_counter()
+        remaining = options['orders']
+        while remaining > 0:
+            commands = []
+            for _ in range(min(options['batch'], remaining)):
+                player_id = rng.choice(ids)
+                if open_orders and rng.random() < options['cancel_rate']:
+                    order = open_orders.pop(rng.randrange(len(open_orders)))
+                    commands.append(CancelOrder(order.player_id, order.pk))
+                    continue
+                side = rng.choice(('buy', 'sell'))
+                # Покупки чуть ниже середины, продажи чуть выше - часть заявок встаёт в книгу
+                offset = rng.randint(-5, 5) + (-2 if side == 'buy' else 2)
+                commands.append(PlaceOrder(player_id, resource, side, max(1, options['mid'] + offset), rng.randint(1, 20)))
+            remaining -= len(commands)
+
+            for command, result in zip(commands, exchange.submit(commands)):
+                if not result['ok']:
+                    rejected += 1
+                elif isinstance(command, PlaceOrder):
+                    placed += 1
+                    fills += len(result['fills'])
+                    open_orders.append(result['order'])
+            open_orders = [order for order in open_orders if order.status == 'open']
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"{options['orders']} команд за {elapsed:.2f} с ({options['orders'] / elapsed:.0f}/с), "
+            f"пачка {options['batch']}: заявок {placed}, сделок {fills}, отклонено {rejected}"
+        )
+
+        after = self.holdings(ids, resource)
+        self.stdout.write(f"До: {before}, после (с резервами открытых заявок): {after}")
+        if before == after:
+            self.stdout.write(self.style.SUCCESS('Монеты и ресурс сохранились'))
+        else:
+            self.stdout.write(self.style.ERROR('Баланс не сходится'))
+
+        if not options['keep']:
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def holdings(self, ids, resource):
+        """Монеты и ресурс игроков вместе с зарезервированными в открытых заявках"""
+        totals = PlayerProfile.objects.filter(id__in=ids).aggregate(coins=Sum('coins'), resource=Sum(resource))
+        coins, amount = totals['coins'], totals['resource']
+        for side, price, remaining in ExchangeOrder.objects.filter(player_id__in=ids, status='open').values_list('side', 'price', 'remaining'):
+            currency, reserved = order_cost(side, resource, price, remaining)
+            if currency == 'coins':
+                coins += reserved
+            else:
+                amount += reserved
+        return {'coins': coins, resource: amount}
@@ -0,0 +1,85 @@
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from game.models import PlayerProfile, CurrencyTransaction
+from game.ledger import transfer
+
+
+class Command(BaseCommand):
+    help = 'Concurrent player-to-player coin transfers through the ledger: throughput and balance invariant'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=20)
+        parser.add_argument('--transfers', type=int, default=2000, help='Total transfers across all threads')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--balance', type=int, default=10000, help='Starting coins per player')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark players afterwards')
+
+    def handle(self, *args, **options):
+        users = [
+            User.objects.create_user(f'ledger_bench_{i}_{int(time.time() * 1000)}')
+            for i in range(options['players'])
+        ]
+        profiles = [
+            PlayerProfile.objects.create(user=user, name=user.username, classification='warrior', coins=options['balance'])
+            for user in users
+        ]
+        ids = [profile.pk for profile in profiles]
+        total_before = options['balance'] * len(profiles)
+
+        counters = {'ok': 0, 'rejected': 0, 'retries': 0}
+        lock = threading.Lock()
+        per_thread = options['transfers'] // options['threads']
+
+        def worker(seed):
+            rng = random.Random(seed)
+            local = {'ok': 0, 'rejected': 0, 'retries': 0}
+            try:
+                for _ in range(per_thread):
+                    sender, receiver = rng.sample(profiles, 2)
+                    amount = rng.randint(1, 500)
+                    while True:
+                        try:
+                            ok, _ = transfer(sender, receiver, 'coins', amount)
+                            break
+                        except OperationalError:
+                            # SQLite: транзакцию нельзя повысить до записи, пока пишет другой поток - повтор
+                            local['retries'] += 1
+                            time.sleep(rng.random() * 0.005)
+                    local['ok' if ok else 'rejected'] += 1
+            finally:
+                connection.close()
+                with lock:
+                    for key, value in local.items():
+                        counters[key] += value
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        total_after = PlayerProfile.objects.filter(id__in=ids).aggregate(total=Sum('coins'))['total']
+        fees = CurrencyTransaction.objects.filter(player_id__in=ids, transaction_type='fee').aggregate(total=Sum('amount'))['total'] or 0
+        negative = PlayerProfile.objects.filter(id__in=ids, coins__lt=0).count()
+
+        self.stdout.write(
+            f"{counters['ok']} переводов за {elapsed:.2f} с ({counters['ok'] / elapsed:.0f}/с), "
+            f"отклонено {counters['rejected']}, повторов из-за блокировок {counters['retries']}"
+        )
+        consistent = total_before - fees == total_after and negative == 0
+        self.stdout.write(f"Монет до {total_before}, комиссии {fees}, после {total_after}, отрицательных балансов {negative}")
+        if consistent:
+            self.stdout.write(self.style.SUCCESS('Баланс сходится'))
+        else:
+            self.stdout.write(self.style.ERROR('Баланс не сходится'))
+
+        if not options['keep']:
+            User.objects.filter(id__in=[user.id for user in users]).delete()
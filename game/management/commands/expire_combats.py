@@ -0,0 +1,59 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from game.models import Combat
+from game.combat_store import get_combat_store
+from game.combat_timeouts import active_combats, expire_if_stale, stale_after
+from game.turn_scheduler import TurnScheduler
+
+# Перекрытие окон опроса: запись, закоммиченная чуть позже своего updated_at, не теряется
+POLL_OVERLAP = timedelta(seconds=5)
+
+
+class Command(BaseCommand):
+    help = 'Abandon active fights that no process is driving (no DB update for longer than the stale threshold)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-seconds', type=int, default=None,
+                            help='Idle threshold (default: TURN_TIMEOUT * (FLUSH_EVERY + MAX_IDLE_TURNS + 1), at least 2 * FLUSH_INTERVAL)')
+        parser.add_argument('--loop', action='store_true',
+                            help='Run as a worker: keep a deadline heap of all active fights')
+        parser.add_argument('--poll', type=float, default=10.0, help='Seconds between DB polls in --loop mode')
+
+    def handle(self, *args, **options):
+        store = get_combat_store()
+        older_than = timedelta(seconds=options['stale_seconds']) if options['stale_seconds'] else stale_after(store)
+
+        if options['loop']:
+            self.run_worker(store, older_than, options['poll'])
+            return
+
+        cutoff = timezone.now() - older_than
+        stale_ids = Combat.objects.filter(status='active', updated_at__lt=cutoff).values_list('id', flat=True)
+        expired = sum(1 for combat_id in list(stale_ids) if expire_if_stale(store, combat_id, older_than))
+        self.stdout.write(self.style.SUCCESS(f'Прервано боёв: {expired}'))
+
+    def run_worker(self, store, older_than, poll):
+        """Дедлайн боя - updated_at + older_than; куча обновляется опросом БД"""
+        scheduler = TurnScheduler()
+        updated_after = None
+        next_poll = 0.0
+        self.stdout.write(f'Таймауты боёв: порог {older_than}, опрос раз в {poll} с')
+
+        while True:
+            if time.monotonic() >= next_poll:
+                polled_at = timezone.now()
+                for combat_id, updated_at in active_combats(updated_after):
+                    scheduler.schedule(str(combat_id), (updated_at + older_than).timestamp())
+                updated_after = polled_at - POLL_OVERLAP
+                next_poll = time.monotonic() + poll
+                close_old_connections()
+
+            expired = scheduler.wait_expired(max_wait=max(0.0, next_poll - time.monotonic()))
+            for combat_id in expired:
+                # Бой мог обновиться после опроса - тогда его новый дедлайн придёт следующим опросом
+                if expire_if_stale(store, combat_id, older_than):
+                    self.stdout.write(f'Бой {combat_id} прерван')
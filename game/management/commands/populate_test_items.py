@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from game.models import PlayerProfile, Item, InventoryItem
+from game.inventory import InventoryError, add_items
 
 class Command(BaseCommand):
     help = 'Populate test items for players'
@@ -84,36 +85,38 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING('⚠ Нет игроков для добавления предметов'))
             return
             
+        # Предметы в позиции 0, 1, 2, 3, 4, 5 (по порядку списка)
+        item_names = [
+            'Стальной меч',
+            'Кожаный доспех',
+            'Малое зелье здоровья',
+            'Деревянный щит',
+            'Кожаные перчатки',
+            'Железный шлем',
+        ]
+        items_by_name = {item.name: item for item in Item.objects.filter(name__in=item_names)}
+        for item_name in item_names:
+            if item_name not in items_by_name:
+                self.stdout.write(self.style.ERROR(f'  ✗ Предмет "{item_name}" не найден'))
+        grants = [
+            (items_by_name[name], 3 if items_by_name[name].is_stackable else 1)
+            for name in item_names if name in items_by_name
+        ]
+
         for player in players:
             self.stdout.write(f'Добавляем предметы игроку: {player.name}')
             
             # Очищаем старые предметы (опционально)
             InventoryItem.objects.filter(owner=player).delete()
             
-            # Добавляем предметы в позиции 0, 1, 2, 3, 4, 5
-            items_to_add = [
-                ('Стальной меч', 0),
-                ('Кожаный доспех', 1),
-                ('Малое зелье здоровья', 2),
-                ('Деревянный щит', 3),
-                ('Кожаные перчатки', 4),
-                ('Железный шлем', 5)
-            ]
-            
-            for item_name, position in items_to_add:
-                try:
-                    item_obj = Item.objects.get(name=item_name)
-                    inv_item = InventoryItem.objects.create(
-                        owner=player,
-                        item=item_obj,
-                        inventory_position=position,
-                        quantity=3 if item_obj.is_stackable else 1,
-                        current_durability=100,
-                        max_durability=100
-                    )
-                    self.stdout.write(f'  ✓ Добавлен: {item_obj.name} в позицию {position}')
-                except Item.DoesNotExist:
-                    self.stdout.write(self.style.ERROR(f'  ✗ Предмет "{item_name}" не найден'))
+            # Выдача всех предметов - один bulk_create
+            try:
+                created, _ = add_items(player, grants)
+            except InventoryError as e:
+                self.stdout.write(self.style.ERROR(f'  ✗ {e}'))
+                continue
+            for inv_item in created:
+                self.stdout.write(f'  ✓ Добавлен: {inv_item.item.name} в позицию {inv_item.inventory_position}')
         
         self.stdout.write(self.style.SUCCESS(
             f'✅ Готово! Создано {created_count} предметов, добавлены предметы {players.count()} игрокам'
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from game.chat_retention import DEFAULT_BATCH_SIZE, get_retention_settings, purge_expired_messages
+
+
+class Command(BaseCommand):
+    help = 'Delete chat messages older than the retention period of their room type (settings.CHAT_RETENTION)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Messages per transaction')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after N batches')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+        parser.add_argument('--export-dir', default=None,
+                            help='Append purged messages to daily JSONL.gz files here (default: CHAT_RETENTION EXPORT_DIR)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        purged = purge_expired_messages(
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            pause=options['pause'],
+            export_dir=options['export_dir'] or get_retention_settings()['EXPORT_DIR'],
+        )
+        for room_id, count in sorted(purged.items()):
+            self.stdout.write(f'Комната {room_id}: удалено {count}')
+        self.stdout.write(self.style.SUCCESS(f'Удалено сообщений: {sum(purged.values())}'))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from game.models import Combat, CombatArchive
+from game.combat_logic import verify_battle, render_log
+
+
+class Command(BaseCommand):
+    help = 'Replay a fight from its seed and player inputs and verify the stored outcome'
+
+    def add_arguments(self, parser):
+        parser.add_argument('combat_id', help='Combat UUID')
+        parser.add_argument('--log', action='store_true', help='Print the replayed combat log')
+
+    def get_combat(self, combat_id):
+        """Бой из Combat, а если он уже заархивирован - из CombatArchive"""
+        try:
+            return Combat.objects.get(id=combat_id)
+        except Combat.DoesNotExist:
+            pass
+        except ValueError:
+            raise CommandError(f"Combat {combat_id} not found")
+
+        try:
+            return CombatArchive.objects.get(id=combat_id).to_combat()
+        except CombatArchive.DoesNotExist:
+            raise CommandError(f"Combat {combat_id} not found")
+        except ValueError as e:
+            raise CommandError(str(e))
+
+    def handle(self, *args, **options):
+        combat = self.get_combat(options['combat_id'])
+
+        try:
+            matches, replayed = verify_battle(combat)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['log']:
+            for line in render_log(replayed):
+                self.stdout.write(line)
+
+        stored = combat.state
+        self.stdout.write(
+            f"Сохранено: {stored.get('status')}, ход {stored.get('turn')}, "
+            f"HP {stored['player']['current_hp']}/{stored['monster']['current_hp']}"
+        )
+        self.stdout.write(
+            f"Повтор:    {replayed['status']}, ход {replayed['turn']}, "
+            f"HP {replayed['player']['current_hp']}/{replayed['monster']['current_hp']}"
+        )
+        if matches:
+            self.stdout.write(self.style.SUCCESS('Исход боя совпадает'))
+        else:
+            raise CommandError('Исход боя не совпадает с повтором')
@@ -0,0 +1,34 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from game.chat_retention import get_retention_settings, search_archive
+
+
+class Command(BaseCommand):
+    help = 'Search purged chat messages in the JSONL.gz export files (for moderation)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--export-dir', default=None, help='Export directory (default: CHAT_RETENTION EXPORT_DIR)')
+        parser.add_argument('--since', type=date.fromisoformat, default=None, help='First day, YYYY-MM-DD')
+        parser.add_argument('--until', type=date.fromisoformat, default=None, help='Last day, YYYY-MM-DD')
+        parser.add_argument('--room-type', default=None)
+        parser.add_argument('--user-id', type=int, default=None)
+        parser.add_argument('--sender', default=None)
+        parser.add_argument('--text', default=None, help='Case-insensitive substring of the message')
+        parser.add_argument('--limit', type=int, default=100)
+
+    def handle(self, *args, **options):
+        export_dir = options['export_dir'] or get_retention_settings()['EXPORT_DIR']
+        if not export_dir:
+            raise CommandError('Set --export-dir or CHAT_RETENTION EXPORT_DIR')
+
+        found = 0
+        for row in search_archive(
+            export_dir, since=options['since'], until=options['until'], room_type=options['room_type'],
+            user_id=options['user_id'], sender=options['sender'], text=options['text'],
+        ):
+            self.stdout.write(f"[{row['timestamp']}] {row['room_type']}/{row['room']} {row['sender']}: {row['text']}")
+            found += 1
+            if found >= options['limit']:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Найдено сообщений: {found}'))
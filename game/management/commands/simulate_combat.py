@@ -0,0 +1,128 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from game.models import PlayerProfile
+from game.npc_templates import MONSTER_TEMPLATES
+from game.combat_sim import (
+    DEFAULT_BATCH_SIZE, DEFAULT_MAX_TURNS,
+    make_player_data, simulate_matchup, simulate_matchup_reference,
+)
+
+# Опция команды -> поле PlayerProfile
+STAT_OPTIONS = {
+    'strength': 'strength_base',
+    'agility': 'agility_base',
+    'intuition': 'intuition_base',
+    'endurance': 'endurance_base',
+    'damage_min': 'phys_damage_min',
+    'damage_max': 'phys_damage_max',
+    'crit_chance': 'crit_chance',
+    'dodge_chance': 'dodge_chance',
+}
+
+ARMOR_FIELDS = ('armor_head', 'armor_body', 'armor_waist', 'armor_legs')
+
+
+class Command(BaseCommand):
+    help = 'Monte Carlo simulation of player vs monster fights for every MONSTER_TEMPLATES entry'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fights', type=int, default=100000, help='Fights per matchup')
+        parser.add_argument('--player', help='Username whose PlayerProfile stats are used')
+        parser.add_argument('--monster', help='Simulate only the monster with this name')
+        parser.add_argument('--max-turns', type=int, default=DEFAULT_MAX_TURNS)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--attacks', type=int, default=None, help='Override number of attacks per turn')
+        parser.add_argument('--armor', type=int, default=None, help='Override armor in every zone')
+        for option in STAT_OPTIONS:
+            parser.add_argument(f"--{option.replace('_', '-')}", dest=option, type=int, default=None)
+        parser.add_argument('--reference', type=int, default=0,
+                            help='Also run N fights through handle_player_turn() for comparison')
+        parser.add_argument('--json', action='store_true', help='Print raw JSON reports')
+
+    def handle(self, *args, **options):
+        profile = None
+        if options['player']:
+            try:
+                profile = PlayerProfile.objects.get(user__username=options['player'])
+            except PlayerProfile.DoesNotExist:
+                raise CommandError(f"Player profile '{options['player']}' not found")
+
+        overrides = {
+            field: options[option]
+            for option, field in STAT_OPTIONS.items()
+            if options[option] is not None
+        }
+        if options['armor'] is not None:
+            overrides.update({field: options['armor'] for field in ARMOR_FIELDS})
+
+        player = make_player_data(profile, num_attacks=options['attacks'], **overrides)
+
+        templates = MONSTER_TEMPLATES
+        if options['monster']:
+            templates = [t for t in MONSTER_TEMPLATES if t['name'] == options['monster']]
+            if not templates:
+                raise CommandError(f"Monster '{options['monster']}' not found")
+
+        self.stdout.write(
+            f"Игрок: {player['name']} [{player['level']}], HP {player['max_hp']}, "
+            f"ударов за ход: {player['num_attacks']}"
+        )
+
+        for template in templates:
+            report = simulate_matchup(
+                player, template,
+                fights=options['fights'],
+                max_turns=options['max_turns'],
+                seed=options['seed'],
+                batch_size=options['batch_size'],
+            )
+            if options['json']:
+                self.stdout.write(json.dumps(report, ensure_ascii=False))
+            else:
+                self._print_report(report)
+
+            if options['reference']:
+                reference = simulate_matchup_reference(
+                    player, template,
+                    fights=options['reference'],
+                    max_turns=options['max_turns'],
+                )
+                if options['json']:
+                    self.stdout.write(json.dumps(reference, ensure_ascii=False))
+                else:
+                    self._print_reference(report, reference)
+
+    def _print_report(self, report):
+        turns = report['turns']
+        player_damage = report['player_damage']
+        monster_damage = report['monster_damage']
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['monster']} [{report['monster_level']}]: "
+            f"победы {report['win_rate']:.2%} "
+            f"({report['wins']}/{report['losses']}/{report['timeouts']} в/п/н)"
+        ))
+        self.stdout.write(
+            f"  ходы: среднее {turns['mean']}, p50 {turns['p50']}, p90 {turns['p90']}, "
+            f"p99 {turns['p99']}, макс {turns['max']}"
+        )
+        self.stdout.write(
+            f"  урон игрока: p50 {player_damage['p50']}, p90 {player_damage['p90']}, "
+            f"p99 {player_damage['p99']}, макс {player_damage['max']}"
+        )
+        self.stdout.write(
+            f"  урон монстра: p50 {monster_damage['p50']}, p90 {monster_damage['p90']}, "
+            f"p99 {monster_damage['p99']}, макс {monster_damage['max']}"
+        )
+        self.stdout.write(f"  {report['fights']} боёв за {report['elapsed']:.2f} с")
+
+    def _print_reference(self, report, reference):
+        per_fight = report['elapsed'] / report['fights'] if report['fights'] else 0
+        reference_per_fight = reference['elapsed'] / reference['fights'] if reference['fights'] else 0
+        speedup = reference_per_fight / per_fight if per_fight else 0
+        self.stdout.write(
+            f"  эталон (handle_player_turn): победы {reference['win_rate']:.2%}, "
+            f"ходы p50 {reference['turns']['p50']}, "
+            f"{reference['fights']} боёв за {reference['elapsed']:.2f} с, ускорение x{speedup:.0f}"
+        )
@@ -21,4 +21,4 @@ class UpdateLastOnlineMiddleware:
                 logger = logging.getLogger(__name__)
                 logger.error(f"Error updating last_online: {str(e)}")
         
-        return response
\ No newline at end of file
+        return response
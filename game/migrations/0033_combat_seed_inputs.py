@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0032_combat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='combat',
+            name='inputs',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='combat',
+            name='seed',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
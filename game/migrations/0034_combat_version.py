@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:52
+
+from django.db import migrations, models
+
+
+def backfill_version(apps, schema_editor):
+    """Версия боя = число обработанных ходов"""
+    Combat = apps.get_model('game', 'Combat')
+    for combat in Combat.objects.iterator():
+        state = combat.state or {}
+        if combat.inputs:
+            version = len(combat.inputs)
+        else:
+            version = max(0, state.get('turn', 1) - 1)
+        if version:
+            Combat.objects.filter(pk=combat.pk).update(version=version)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0033_combat_seed_inputs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='combat',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_version, migrations.RunPython.noop),
+    ]
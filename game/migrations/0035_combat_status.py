@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_status(apps, schema_editor):
+    """
+    Переносит state['status'] в колонку status.
+
+    Если у игрока несколько активных боёв, активным остаётся последний,
+    остальные помечаются брошенными - иначе не создать ограничение
+    unique_active_combat_per_owner.
+    """
+    Combat = apps.get_model('game', 'Combat')
+    valid = {'active', 'victory', 'defeat', 'abandoned'}
+
+    batch = []
+    for combat in Combat.objects.only('id', 'state').iterator(chunk_size=500):
+        status = (combat.state or {}).get('status')
+        if status in valid and status != 'active':
+            combat.status = status
+            batch.append(combat)
+        if len(batch) >= 500:
+            Combat.objects.bulk_update(batch, ['status'])
+            batch = []
+    if batch:
+        Combat.objects.bulk_update(batch, ['status'])
+
+    seen_owners = set()
+    active = Combat.objects.filter(status='active', owner__isnull=False).order_by('owner_id', '-created_at')
+    for combat in active.only('id', 'owner_id', 'state').iterator(chunk_size=500):
+        if combat.owner_id in seen_owners:
+            combat.state['status'] = 'abandoned'
+            Combat.objects.filter(pk=combat.pk).update(status='abandoned', state=combat.state)
+        seen_owners.add(combat.owner_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0034_combat_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='combat',
+            name='status',
+            field=models.CharField(choices=[('active', 'Идёт'), ('victory', 'Победа'), ('defeat', 'Поражение'), ('abandoned', 'Брошен')], default='active', max_length=10),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='combat',
+            index=models.Index(fields=['owner', 'status'], name='game_combat_owner_i_aeedc3_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='combat',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'active')), fields=('owner',), name='unique_active_combat_per_owner'),
+        ),
+    ]
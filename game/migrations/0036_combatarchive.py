@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0035_combat_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CombatArchive',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('active', 'Идёт'), ('victory', 'Победа'), ('defeat', 'Поражение'), ('abandoned', 'Брошен')], max_length=10)),
+                ('winner', models.CharField(blank=True, max_length=10, null=True)),
+                ('turns', models.PositiveIntegerField(default=0)),
+                ('monster_name', models.CharField(blank=True, max_length=100)),
+                ('xp_reward', models.IntegerField(default=0)),
+                ('coin_reward', models.IntegerField(default=0)),
+                ('seed', models.BigIntegerField(blank=True, null=True)),
+                ('payload', models.BinaryField(blank=True, null=True)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_combats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'finished_at'], name='game_combat_owner_i_ebbca6_idx')],
+            },
+        ),
+    ]
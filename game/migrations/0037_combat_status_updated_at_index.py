@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0036_combatarchive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='combat',
+            index=models.Index(fields=['status', 'updated_at'], name='game_combat_status_4c2ebe_idx'),
+        ),
+    ]
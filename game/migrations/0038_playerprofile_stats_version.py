@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0037_combat_status_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playerprofile',
+            name='stats_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
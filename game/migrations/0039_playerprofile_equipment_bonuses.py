@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0038_playerprofile_stats_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playerprofile',
+            name='equipment_bonuses',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Копия EquipmentSlot.SLOT_CAPACITY на момент миграции
+SLOT_CAPACITY = {'weapon': 2}
+
+
+def equipment_slot(item):
+    """Копия InventoryItem.get_equipment_slot()"""
+    if item.type == 'weapon':
+        return 'weapon'
+    if item.type in ('armor', 'jewelry'):
+        return item.subtype
+    return None
+
+
+def backfill_slots(apps, schema_editor):
+    """
+    Раскладывает надетые предметы по слотам.
+
+    Предметы сверх вместимости слота (раньше equip_item мог надеть два
+    шлема) снимаются.
+    """
+    InventoryItem = apps.get_model('game', 'InventoryItem')
+    EquipmentSlot = apps.get_model('game', 'EquipmentSlot')
+    PlayerProfile = apps.get_model('game', 'PlayerProfile')
+
+    slots = []
+    extra_ids = []
+    taken = {}
+    weapons = {}
+    equipped = InventoryItem.objects.filter(is_equipped=True).select_related('item').order_by('owner_id', '-created_at')
+    for inv in equipped.iterator(chunk_size=500):
+        slot = equipment_slot(inv.item)
+        key = (inv.owner_id, slot)
+        position = taken.get(key, 0)
+        if slot is None or position >= SLOT_CAPACITY.get(slot, 1):
+            extra_ids.append(inv.id)
+            continue
+        taken[key] = position + 1
+        slots.append(EquipmentSlot(owner_id=inv.owner_id, slot=slot, position=position, inventory_item_id=inv.id))
+        if slot == 'weapon':
+            weapons[inv.owner_id] = weapons.get(inv.owner_id, 0) + 1
+
+    EquipmentSlot.objects.bulk_create(slots, batch_size=500)
+    InventoryItem.objects.filter(id__in=extra_ids).update(is_equipped=False)
+    for owner_id, count in weapons.items():
+        PlayerProfile.objects.filter(id=owner_id).update(equipped_weapons=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0039_playerprofile_equipment_bonuses'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playerprofile',
+            name='equipped_weapons',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='EquipmentSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.CharField(max_length=20)),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('inventory_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='equipment_slot', to='game.inventoryitem')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='equipment_slots', to='game.playerprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('owner', 'slot', 'position'), name='unique_equipment_slot_position')],
+            },
+        ),
+        migrations.RunPython(backfill_slots, migrations.RunPython.noop),
+    ]
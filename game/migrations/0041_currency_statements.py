@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_rollups(apps, schema_editor):
+    """Дневные сводки по уже накопленному журналу (копия statements.apply_rollups)"""
+    CurrencyTransaction = apps.get_model('game', 'CurrencyTransaction')
+    CurrencyDailyRollup = apps.get_model('game', 'CurrencyDailyRollup')
+
+    groups = {}
+    rows = CurrencyTransaction.objects.order_by('id').values_list(
+        'id', 'player_id', 'timestamp', 'currency_type', 'transaction_type', 'amount', 'balance_after',
+    )
+    for tx_id, player_id, timestamp, currency_type, transaction_type, amount, balance_after in rows.iterator(chunk_size=2000):
+        key = (player_id, timezone.localdate(timestamp), currency_type, transaction_type)
+        count, total, _, _ = groups.get(key, (0, 0, 0, 0))
+        groups[key] = (count + 1, total + amount, tx_id, balance_after)
+
+    CurrencyDailyRollup.objects.bulk_create([
+        CurrencyDailyRollup(
+            player_id=player_id, day=day, currency_type=currency_type, transaction_type=transaction_type,
+            count=count, total_amount=total, last_transaction_id=last_id, closing_balance=balance,
+        )
+        for (player_id, day, currency_type, transaction_type), (count, total, last_id, balance) in groups.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('game', '0040_equipmentslot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('currency_type', models.CharField(max_length=20)),
+                ('transaction_type', models.CharField(choices=[('add', 'Пополнение'), ('subtract', 'Списание'), ('transfer', 'Перевод'), ('reward', 'Награда'), ('purchase', 'Покупка'), ('sale', 'Продажа'), ('fee', 'Комиссия'), ('bank_deposit', 'Банк: внесение'), ('bank_withdraw', 'Банк: снятие'), ('exchange_out', 'Обмен: отдано'), ('exchange_in', 'Обмен: получено')], max_length=15)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.BigIntegerField(default=0)),
+                ('last_transaction_id', models.BigIntegerField(default=0)),
+                ('closing_balance', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='currencytransaction',
+            index=models.Index(fields=['player', '-id'], name='currtx_player_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='currencytransaction',
+            index=models.Index(fields=['player', 'currency_type', '-id'], name='currtx_player_currency_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='currencydailyrollup',
+            name='player',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='currency_rollups', to='game.playerprofile'),
+        ),
+        migrations.AddIndex(
+            model_name='currencydailyrollup',
+            index=models.Index(fields=['player', 'currency_type', '-day'], name='rollup_player_currency_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='currencydailyrollup',
+            constraint=models.UniqueConstraint(fields=('player', 'day', 'currency_type', 'transaction_type'), name='unique_currency_daily_rollup'),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
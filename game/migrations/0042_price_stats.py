@@ -0,0 +1,94 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:54
+
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+# Копия price_stats.CANDLE_SECONDS на момент миграции
+CANDLE_SECONDS = {'1h': 3600, '1d': 86400}
+
+
+def backfill_price_stats(apps, schema_editor):
+    """Агрегаты и свечи по уже накопленным сделкам (как price_stats.rebuild_price_stats)"""
+    Transaction = apps.get_model('game', 'Transaction')
+    PriceAggregate = apps.get_model('game', 'PriceAggregate')
+    PriceCandle = apps.get_model('game', 'PriceCandle')
+
+    summaries = Transaction.objects.values('resource_type').annotate(
+        trade_count=Count('id'), volume=Sum('amount'), price_sum=Sum('price'),
+        turnover=Sum('total'), min_price=Min('price'), max_price=Max('price'),
+    )
+    PriceAggregate.objects.bulk_create([PriceAggregate(**summary) for summary in summaries])
+
+    candles = {}
+    for trade in Transaction.objects.order_by('id').iterator(chunk_size=2000):
+        price = Decimal(trade.price)
+        timestamp = int(trade.created_at.timestamp())
+        for interval, seconds in CANDLE_SECONDS.items():
+            start = datetime.fromtimestamp(timestamp - timestamp % seconds, tz=dt_timezone.utc)
+            candle = candles.get((trade.resource_type, interval, start))
+            if candle is None:
+                candles[(trade.resource_type, interval, start)] = PriceCandle(
+                    resource_type=trade.resource_type, interval=interval, bucket_start=start,
+                    open=price, high=price, low=price, close=price,
+                    volume=trade.amount, turnover=trade.total, trade_count=1,
+                    first_transaction_id=trade.id, last_transaction_id=trade.id,
+                )
+                continue
+            candle.high = max(candle.high, price)
+            candle.low = min(candle.low, price)
+            candle.close = price
+            candle.volume += trade.amount
+            candle.turnover += trade.total
+            candle.trade_count += 1
+            candle.last_transaction_id = trade.id
+    PriceCandle.objects.bulk_create(candles.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0041_currency_statements'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=20, unique=True)),
+                ('trade_count', models.PositiveIntegerField(default=0)),
+                ('volume', models.BigIntegerField(default=0)),
+                ('price_sum', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('turnover', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('min_price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('max_price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PriceCandle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=20)),
+                ('interval', models.CharField(choices=[('1h', 'Час'), ('1d', 'День')], max_length=3)),
+                ('bucket_start', models.DateTimeField()),
+                ('open', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('high', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('low', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('close', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('volume', models.BigIntegerField(default=0)),
+                ('turnover', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('trade_count', models.PositiveIntegerField(default=0)),
+                ('first_transaction_id', models.BigIntegerField()),
+                ('last_transaction_id', models.BigIntegerField()),
+            ],
+            options={
+                'ordering': ['-bucket_start'],
+                'constraints': [models.UniqueConstraint(fields=('resource_type', 'interval', 'bucket_start'), name='unique_price_candle')],
+            },
+        ),
+        migrations.RunPython(backfill_price_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:55
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0042_price_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=20)),
+                ('side', models.CharField(choices=[('buy', 'Покупка'), ('sell', 'Продажа')], max_length=4)),
+                ('price', models.PositiveIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('remaining', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('open', 'Открыта'), ('filled', 'Исполнена'), ('cancelled', 'Отменена')], default='open', max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exchange_orders', to='game.playerprofile')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExchangeFill',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=20)),
+                ('taker_side', models.CharField(choices=[('buy', 'Покупка'), ('sell', 'Продажа')], max_length=4)),
+                ('price', models.PositiveIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('buy_order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buy_fills', to='game.exchangeorder')),
+                ('sell_order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sell_fills', to='game.exchangeorder')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='exchangeorder',
+            index=models.Index(fields=['status', 'resource_type', 'id'], name='exchange_open_orders_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangeorder',
+            index=models.Index(fields=['player', 'status'], name='exchange_player_orders_idx'),
+        ),
+    ]
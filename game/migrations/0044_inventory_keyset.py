@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:03
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_item_types(apps, schema_editor):
+    Item = apps.get_model('game', 'Item')
+    InventoryItem = apps.get_model('game', 'InventoryItem')
+    items = Item.objects.filter(pk=OuterRef('item_id'))
+    InventoryItem.objects.update(
+        item_type=Subquery(items.values('type')[:1]),
+        item_subtype=Subquery(items.values('subtype')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0043_exchange_order_book'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventoryitem',
+            name='item_subtype',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='inventoryitem',
+            name='item_type',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='inventoryitem',
+            index=models.Index(fields=['owner', 'inventory_position'], name='inventory_owner_position_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventoryitem',
+            index=models.Index(fields=['owner', 'item_type', 'item_subtype', 'inventory_position'], name='inventory_owner_type_idx'),
+        ),
+        migrations.RunPython(backfill_item_types, migrations.RunPython.noop),
+    ]
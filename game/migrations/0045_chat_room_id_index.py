@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0044_inventory_keyset'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['room', 'id'], name='chatmsg_room_id_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:00
+
+from django.db import migrations
+
+
+def abandon_invalid_statuses(apps, schema_editor):
+    """
+    Бои со статусом состояния вне допустимых 0035 оставила активными
+    (status='active' по умолчанию): они помечаются брошенными и не
+    занимают место активного боя игрока.
+    """
+    Combat = apps.get_model('game', 'Combat')
+    valid = {'active', 'victory', 'defeat', 'abandoned'}
+    for combat in Combat.objects.filter(status='active').only('id', 'state').iterator(chunk_size=500):
+        state = combat.state or {}
+        if state.get('status', 'active') not in valid:
+            state['status'] = 'abandoned'
+            Combat.objects.filter(pk=combat.pk).update(status='abandoned', state=state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0045_chat_room_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(abandon_invalid_statuses, migrations.RunPython.noop),
+    ]
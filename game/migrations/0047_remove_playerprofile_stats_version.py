@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:48
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0046_abandon_invalid_combat_statuses'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='playerprofile',
+            name='stats_version',
+        ),
+    ]
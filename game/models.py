@@ -1,4 +1,10 @@
-from django.db import models
+import json
+import zlib
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
@@ -139,6 +145,11 @@ class PlayerProfile(models.Model):
     base_inventory_slots = models.IntegerField(default=500)  # Базовые слоты
     bonus_inventory_slots = models.IntegerField(default=0)   # Бонусные слоты за уровень
 
+    # Бонусы надетой экипировки, уже прибавленные к полям профиля
+    equipment_bonuses = models.JSONField(default=dict, blank=True)
+    # Число надетого оружия (= ударов за ход), обновляется вместе с бонусами
+    equipped_weapons = models.PositiveSmallIntegerField(default=0)
+
     # Константы
     MAX_COINS = 10000000
     MAX_SILVER = 100000
@@ -163,22 +174,157 @@ class PlayerProfile(models.Model):
     def __str__(self):
         return self.name
 
+    # Поля, от которых зависят производные характеристики (derived_stats)
+    STAT_NAMES = ('strength', 'agility', 'intuition', 'endurance', 'intelligence', 'wisdom', 'spirit')
+    STAT_INPUT_FIELDS = tuple(f'{stat}_{part}' for stat in STAT_NAMES for part in ('base', 'mod'))
+    # Поля, которые save() пересчитывает сам
+    DERIVED_FIELDS = ('max_hp', 'max_mp', 'current_hp', 'current_mp')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Значения из БД - для записи только изменённых полей
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_dirty_fields(self):
+        """
+        Имена полей, изменённых после загрузки из БД.
+
+        Для объекта, не загруженного из БД, - None (изменённым считается всё).
+        """
+        loaded = self.__dict__.get('_loaded_values')
+        if loaded is None:
+            return None
+        dirty = []
+        for field in self._meta.concrete_fields:
+            if field.attname in loaded:
+                if getattr(self, field.attname) != loaded[field.attname]:
+                    dirty.append(field.name)
+            elif field.attname in self.__dict__:
+                # Отложенное (only/defer) поле, которому присвоили значение
+                dirty.append(field.name)
+        return dirty
+
+    def _remember_loaded_values(self, attnames=None):
+        loaded = self.__dict__.get('_loaded_values')
+        if loaded is None:
+            return
+        if attnames is None:
+            attnames = [field.attname for field in self._meta.concrete_fields if field.attname in self.__dict__]
+        for attname in attnames:
+            loaded[attname] = getattr(self, attname)
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        if fields is None:
+            self._remember_loaded_values()
+        else:
+            self._remember_loaded_values([self._meta.get_field(name).attname for name in fields])
+
     def save(self, *args, **kwargs):
-        if not self.pk:
+        creating = self._state.adding
+        if creating:
             self.strength_base = 3
             self.agility_base = 3
             self.intuition_base = 3
             self.endurance_base = 3
-        
-        self.max_hp = self.calculate_max_hp()
-        self.max_mp = self.calculate_max_mp()
-        
+
+        dirty = None if creating else self.get_dirty_fields()
+        if dirty is None or set(dirty) & set(self.STAT_INPUT_FIELDS):
+            # max HP/MP пересчитываются только при изменении характеристик
+            stats = self.derived_stats()
+            self.max_hp = stats['max_hp']
+            self.max_mp = stats['max_mp']
+
         if self.current_hp == 0 or self.current_hp > self.max_hp:
             self.current_hp = self.max_hp
         if self.current_mp == 0 or self.current_mp > self.max_mp:
             self.current_mp = self.max_mp
-            
+
+        if not creating and not args:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                # Пишем только изменённые поля; если ничего не изменилось - запроса нет
+                update_fields = self.get_dirty_fields()
+                if update_fields is not None and not update_fields:
+                    return
+            elif update_fields:
+                # Вместе с явными полями пишутся и пересчитанные save()
+                dirty = self.get_dirty_fields()
+                if dirty is None:
+                    dirty = self.DERIVED_FIELDS
+                update_fields = list(update_fields) + [
+                    name for name in self.DERIVED_FIELDS if name in dirty and name not in update_fields
+                ]
+            if update_fields is not None:
+                kwargs['update_fields'] = update_fields
+
         super().save(*args, **kwargs)
+        self._remember_loaded_values()
+
+    def update_stats_from_equipment(self):
+        """
+        Пересчитывает бонусы надетой экипировки.
+
+        Все bonus_* надетых предметов суммируются одним агрегатным
+        запросом; к полям профиля прибавляется разница с бонусами,
+        применёнными в прошлый раз (equipment_bonuses), поэтому базовые
+        значения полей не теряются. Число запросов не зависит от числа
+        надетых предметов.
+        """
+        fields = ['equipment_bonuses', 'equipped_weapons', *EQUIPMENT_BONUS_FIELDS.values()]
+        with transaction.atomic():
+            # Блокировка строки: параллельные надевания не применят бонусы дважды
+            locked = PlayerProfile.objects.select_for_update().only(*fields).get(pk=self.pk)
+            applied = locked.equipment_bonuses or {}
+
+            # self мог быть загружен до чужого надевания/снятия: значения
+            # заблокированной строки становятся и текущими, и «загруженными»,
+            # иначе save() сравнил бы результат со старыми и пропустил поля
+            loaded = self.__dict__.get('_loaded_values')
+            for field in fields:
+                value = getattr(locked, field)
+                setattr(self, field, value)
+                if loaded is not None:
+                    loaded[field] = value
+
+            totals = InventoryItem.objects.filter(owner_id=self.pk, is_equipped=True).aggregate(
+                equipped_weapons=Count('id', filter=Q(item__type='weapon')),
+                **{
+                    field: Coalesce(Sum(f'item__{bonus}'), 0)
+                    for bonus, field in EQUIPMENT_BONUS_FIELDS.items()
+                },
+            )
+            self.equipped_weapons = totals.pop('equipped_weapons')
+
+            # Разница считается от значений заблокированной строки, а не от self
+            for field, total in totals.items():
+                setattr(self, field, getattr(locked, field) + total - applied.get(field, 0))
+            self.equipment_bonuses = {field: total for field, total in totals.items() if total}
+            self.save(update_fields=fields)
+
+    def derived_stats(self):
+        """
+        Итоговые характеристики (база + модификаторы) и max HP/MP.
+
+        Снимок запоминается только в этом экземпляре (save() и бой читают
+        его несколько раз) и пересчитывается при изменении базовых
+        характеристик или модификаторов (экипировка).
+        """
+        key = tuple(getattr(self, field) for field in self.STAT_INPUT_FIELDS)
+        cached = self.__dict__.get('_derived_stats')
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        stats = {
+            stat: getattr(self, f'{stat}_base') + getattr(self, f'{stat}_mod')
+            for stat in self.STAT_NAMES
+        }
+        stats['max_hp'] = stats['endurance'] * 12
+        stats['max_mp'] = stats['intelligence'] * 40
+        self._derived_stats = (key, stats)
+        return stats
 
     def clean(self):
         currency_fields = [
@@ -212,18 +358,19 @@ class PlayerProfile(models.Model):
         return self.spirit_base + self.spirit_mod
 
     def calculate_max_hp(self):
-        return (self.get_total_endurance() * 12)
+        return self.derived_stats()['max_hp']
     
     def calculate_max_mp(self):
-        return (self.get_total_intelligence() * 40)
+        return self.derived_stats()['max_mp']
 
-    def gain_experience(self, amount):
+    def gain_experience(self, amount, save=True):
         self.experience += amount
         while self.experience >= self.experience_to_next_level:
-            self.level_up()
-        self.save()
+            self.level_up(save=False)
+        if save:
+            self.save()
     
-    def level_up(self):
+    def level_up(self, save=True):
         self.experience -= self.experience_to_next_level
         self.level += 1
         self.sublevel = 0
@@ -232,8 +379,9 @@ class PlayerProfile(models.Model):
         self.experience_to_next_level = int(self.experience_to_next_level * 1.2)
         self.current_hp = self.max_hp
         self.current_mp = self.max_mp
-        self.update_inventory_slots()
-        self.save()
+        self.update_inventory_slots(save=False)
+        if save:
+            self.save()
 
     def sublevel_up(self):
         if self.sublevel < 4:
@@ -259,119 +407,55 @@ class PlayerProfile(models.Model):
         """Общее количество слотов инвентаря"""
         return self.base_inventory_slots + self.bonus_inventory_slots
     
-    def update_inventory_slots(self):
+    def update_inventory_slots(self, save=True):
         """Обновляет бонусные слоты в зависимости от уровня"""
         # +20 слотов за каждый уровень после 1-го
         new_bonus_slots = (self.level - 1) * 20
         if new_bonus_slots != self.bonus_inventory_slots:
             self.bonus_inventory_slots = max(0, new_bonus_slots)
-            self.save()
+            if save:
+                self.save()
 
     # Методы для работы с валютой
     def has_enough_currency(self, currency_type, amount):
         return getattr(self, currency_type, 0) >= amount
 
     def add_currency(self, currency_type, amount, description='', related_object=None):
-        if currency_type not in ['coins', 'silver', 'silver_dust', 'gold', 'gold_dust']:
+        """Зачисление валюты (одна транзакция леджера, см. game/ledger.py)"""
+        from .ledger import LEDGER_CURRENCIES, LedgerError, credit
+        if currency_type not in LEDGER_CURRENCIES:
             return False
-            
-        max_attr = f"MAX_{currency_type.upper()}"
-        max_value = getattr(self, max_attr, float('inf'))
-        current = getattr(self, currency_type)
-        new_value = current + amount
-        
-        if new_value > max_value:
+        try:
+            credit(self, currency_type, amount, description, related_object)
+        except LedgerError:
             return False
-            
-        setattr(self, currency_type, new_value)
-        self.save()
-        
-        if description or related_object:
-            self._log_transaction(currency_type, amount, 'add', description, related_object)
         return True
     
     def subtract_currency(self, currency_type, amount, description='', related_object=None):
-        if currency_type not in ['coins', 'silver', 'silver_dust', 'gold', 'gold_dust']:
+        """Списание валюты (одна транзакция леджера, см. game/ledger.py)"""
+        from .ledger import LEDGER_CURRENCIES, LedgerError, debit
+        if currency_type not in LEDGER_CURRENCIES:
             return False
-            
-        current = getattr(self, currency_type)
-        if current < amount:
+        try:
+            debit(self, currency_type, amount, description, related_object)
+        except LedgerError:
             return False
-            
-        setattr(self, currency_type, current - amount)
-        self.save()
-        
-        if description or related_object:
-            self._log_transaction(currency_type, amount, 'subtract', description, related_object)
         return True
     
     def transfer_to_player(self, target_profile, currency_type, amount, description=''):
-        if currency_type not in ['coins', 'silver', 'silver_dust', 'gold', 'gold_dust']:
-            return False, "Эта валюта не может быть передана"
-            
-        if currency_type == 'coins':
-            fee = int(amount * self.TRANSACTION_FEE_RATES['player_to_player'])
-            total_amount = amount + fee
-            
-            if not self.has_enough_currency(currency_type, total_amount):
-                return False, "Недостаточно монет с учетом комиссии"
-                
-            if not self.subtract_currency(currency_type, amount, f"Перевод игроку {target_profile.name}"):
-                return False, "Ошибка при списании средств"
-                
-            if fee > 0 and not self.subtract_currency('coins', fee, f"Комиссия за перевод монет"):
-                self.add_currency(currency_type, amount, "Отмена перевода - ошибка комиссии")
-                return False, "Ошибка при списании комиссии"
-                
-            target_profile.add_currency(currency_type, amount, f"Получено от {self.name}")
-            
-            self._log_transaction(currency_type, amount, 'transfer', f"Перевод игроку {target_profile.name}", target_profile)
-            
-            if fee > 0:
-                self._log_transaction('coins', fee, 'fee', f"Комиссия за перевод {currency_type} игроку {target_profile.name}")
-        else:
-            resource_value = int(amount * self.RESOURCE_RATES[currency_type])
-            fee = int(resource_value * self.TRANSACTION_FEE_RATES['resource_sale'])
-            total_cost = resource_value + fee
-            
-            if not self.has_enough_currency(currency_type, amount):
-                return False, f"Недостаточно {currency_type}"
-                
-            if not self.has_enough_currency('coins', fee):
-                return False, "Недостаточно монет для оплаты комиссии"
-                
-            if not self.subtract_currency(currency_type, amount, f"Перевод {currency_type} игроку {target_profile.name}"):
-                return False, f"Ошибка при списании {currency_type}"
-                
-            if not self.subtract_currency('coins', fee, f"Комиссия за перевод {currency_type}"):
-                self.add_currency(currency_type, amount, "Отмена перевода - ошибка комиссии")
-                return False, "Ошибка при списании комиссии"
-                
-            target_profile.add_currency(currency_type, amount, f"Получено от {self.name}")
-            
-            self._log_transaction(currency_type, amount, 'transfer', f"Перевод {currency_type} игроку {target_profile.name}", target_profile)
-            self._log_transaction('coins', fee, 'fee', f"Комиссия за перевод {currency_type} игроку {target_profile.name}")
-            
-        return True, "Перевод успешно выполнен"
+        """Перевод игроку: списание, комиссия, зачисление и журнал - одна транзакция"""
+        from .ledger import transfer
+        return transfer(self, target_profile, currency_type, amount)
     
     def _log_transaction(self, currency_type, amount, transaction_type, description='', related_object=None):
-        balance_after = getattr(self, currency_type)
-        
-        transaction = CurrencyTransaction.objects.create(
-            player=self,
-            currency_type=currency_type,
-            amount=amount,
-            transaction_type=transaction_type,
-            balance_after=balance_after,
-            description=description
+        """Запись журнала в текущей транзакции (см. game/journal.py)"""
+        from .journal import build_entry, record
+        entry = build_entry(
+            self.pk, currency_type, amount, transaction_type,
+            getattr(self, currency_type), description, related_object,
         )
-        
-        if related_object:
-            transaction.related_object_id = related_object.id
-            transaction.related_content_type = ContentType.objects.get_for_model(related_object)
-            transaction.save()
-        
-        return transaction
+        record(entry)
+        return entry
 
     def get_wallet_summary(self):
         return {
@@ -608,6 +692,22 @@ class Item(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Копии типа в инвентаре (InventoryItem.item_type/item_subtype) - один UPDATE, если тип менялся
+        InventoryItem.objects.filter(item=self).exclude(item_type=self.type, item_subtype=self.subtype).update(
+            item_type=self.type, item_subtype=self.subtype,
+        )
+
+# Поле Item.bonus_* -> поле PlayerProfile, к которому прибавляется бонус
+EQUIPMENT_BONUS_FIELDS = {
+    field.name: (
+        f'{field.name[6:]}_mod' if field.name[6:] in PlayerProfile.STAT_NAMES else field.name[6:]
+    )
+    for field in Item._meta.concrete_fields
+    if field.name.startswith('bonus_')
+}
+
 class TavernItem(models.Model):
     CATEGORY_CHOICES = [
         ('first-course', 'Первые блюда'),
@@ -635,6 +735,20 @@ class TavernItem(models.Model):
     def in_stock(self):
         return self.stock > 0
 
+EQUIPPABLE_TYPES = ('weapon', 'armor', 'jewelry')
+
+
+def equipment_slot_for(item_type, item_subtype):
+    """Слот экипировки по типу и подтипу предмета (None - предмет не надевается)"""
+    if item_type == 'weapon':
+        return 'weapon'
+    elif item_type == 'armor':
+        return item_subtype  # 'helmet', 'chest', 'gloves', etc.
+    elif item_type == 'jewelry':
+        return item_subtype  # 'ring', 'necklace', etc.
+    return None
+
+
 class InventoryItem(models.Model):
     owner = models.ForeignKey(PlayerProfile, on_delete=models.CASCADE, related_name='inventory_items')
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
@@ -644,29 +758,100 @@ class InventoryItem(models.Model):
     max_durability = models.IntegerField(default=100)
     is_equipped = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Копия item.type/subtype: фильтры инвентаря идут по индексу без JOIN с Item
+    item_type = models.CharField(max_length=10, blank=True, default='')
+    item_subtype = models.CharField(max_length=10, blank=True, default='')
     
     class Meta:
         ordering = ['inventory_position']
+        indexes = [
+            # Страницы инвентаря по ключу (owner, inventory_position > курсор)
+            models.Index(fields=['owner', 'inventory_position'], name='inventory_owner_position_idx'),
+            models.Index(fields=['owner', 'item_type', 'item_subtype', 'inventory_position'], name='inventory_owner_type_idx'),
+        ]
     
     def __str__(self):
         return f"{self.owner.name} - {self.item.name} (x{self.quantity})"
+
+    def save(self, *args, **kwargs):
+        if not self.item_type:
+            self.item_type = self.item.type
+            self.item_subtype = self.item.subtype
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'item_type', 'item_subtype'}
+        super().save(*args, **kwargs)
     
     def can_equip(self):
         """Можно ли надеть предмет"""
-        return self.item.type in ['weapon', 'armor', 'jewelry']
+        return self.item_type in EQUIPPABLE_TYPES
     
     def get_equipment_slot(self):
         """Возвращает слот экипировки для этого предмета"""
-        item_type = self.item.type
-        item_subtype = self.item.subtype
-        
-        if item_type == 'weapon':
-            return 'weapon'
-        elif item_type == 'armor':
-            return item_subtype  # 'helmet', 'chest', 'gloves', etc.
-        elif item_type == 'jewelry':
-            return item_subtype  # 'ring', 'necklace', etc.
-        return None
+        return equipment_slot_for(self.item_type, self.item_subtype)
+
+    def equip(self):
+        """
+        Надевает предмет в слот экипировки (вызывать в транзакции).
+
+        Занятое место слота освобождается: его предмет снимается и
+        возвращается. В слоте с несколькими местами (оружие) сначала
+        занимается свободное место. Возвращает снятый предмет или None.
+        """
+        slot = self.get_equipment_slot()
+        capacity = EquipmentSlot.SLOT_CAPACITY.get(slot, 1)
+        # Один индексный запрос по (owner, slot) - строк не больше capacity
+        taken = {
+            equipment.position: equipment
+            for equipment in EquipmentSlot.objects.select_for_update()
+            .filter(owner_id=self.owner_id, slot=slot).select_related('inventory_item')
+        }
+        if any(equipment.inventory_item_id == self.pk for equipment in taken.values()):
+            return None
+
+        free = [position for position in range(capacity) if position not in taken]
+        replaced = None
+        if free:
+            EquipmentSlot.objects.create(owner_id=self.owner_id, slot=slot, position=free[0], inventory_item=self)
+        else:
+            equipment = taken[0]
+            replaced = equipment.inventory_item
+            replaced.is_equipped = False
+            replaced.save(update_fields=['is_equipped'])
+            equipment.inventory_item = self
+            equipment.save(update_fields=['inventory_item'])
+
+        self.is_equipped = True
+        self.save(update_fields=['is_equipped'])
+        return replaced
+
+    def unequip(self):
+        """Снимает предмет и освобождает его место в слоте"""
+        EquipmentSlot.objects.filter(inventory_item=self).delete()
+        self.is_equipped = False
+        self.save(update_fields=['is_equipped'])
+
+
+class EquipmentSlot(models.Model):
+    """Надетый предмет: слот персонажа -> InventoryItem"""
+
+    # Слоты с несколькими местами; остальные слоты - одно место
+    SLOT_CAPACITY = {
+        'weapon': 2,
+    }
+
+    owner = models.ForeignKey(PlayerProfile, on_delete=models.CASCADE, related_name='equipment_slots')
+    slot = models.CharField(max_length=20)  # результат InventoryItem.get_equipment_slot()
+    position = models.PositiveSmallIntegerField(default=0)  # место в слоте (0 - первое)
+    inventory_item = models.OneToOneField(InventoryItem, on_delete=models.CASCADE, related_name='equipment_slot')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'slot', 'position'], name='unique_equipment_slot_position'),
+        ]
+
+    def __str__(self):
+        return f"{self.owner.name}: {self.slot}[{self.position}]"
 
 class ShopItem(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
@@ -696,6 +881,22 @@ class ChatRoom(models.Model):
     class Meta:
         unique_together = ('name', 'room_type')
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding:
+            # Реестр комнат чата держит id по (name, room_type) - переименованная комната ищется заново
+            from .chat import get_room_registry
+            get_room_registry().forget(self.pk)
+
+    def delete(self, *args, **kwargs):
+        from .chat import get_chat_broker, get_room_registry
+        room_id = self.pk
+        result = super().delete(*args, **kwargs)
+        get_room_registry().forget(room_id)
+        get_chat_broker().forget(room_id)
+        return result
+
 class ChatMessage(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -706,7 +907,11 @@ class ChatMessage(models.Model):
     
     class Meta:
         ordering = ['timestamp']
-        indexes = [models.Index(fields=['room', 'timestamp'])]
+        indexes = [
+            models.Index(fields=['room', 'timestamp']),
+            # Новые сообщения комнаты после last_id и последние N - диапазон по индексу
+            models.Index(fields=['room', 'id'], name='chatmsg_room_id_idx'),
+        ]
 
 class AdminAccount(models.Model):
     username = models.CharField(max_length=50, unique=True)
@@ -751,12 +956,48 @@ class CurrencyTransaction(models.Model):
         indexes = [
             models.Index(fields=['player', 'timestamp']),
             models.Index(fields=['currency_type', 'transaction_type']),
+            # Выписка: страница по ключу (id < курсор) без OFFSET
+            models.Index(fields=['player', '-id'], name='currtx_player_id_idx'),
+            models.Index(fields=['player', 'currency_type', '-id'], name='currtx_player_currency_id_idx'),
         ]
     
     def __str__(self):
         return f"{self.player.name}: {self.get_transaction_type_display()} {self.amount} {self.currency_type}"
 
 
+class CurrencyDailyRollup(models.Model):
+    """
+    Дневная сводка журнала валют: игрок, день, валюта, тип операции.
+
+    Обновляется инкрементально при записи журнала (game/statements.py).
+    closing_balance - баланс после последней за день операции этого типа;
+    остаток валюты на конец дня - closing_balance строки с наибольшим
+    last_transaction_id.
+    """
+    player = models.ForeignKey(PlayerProfile, on_delete=models.CASCADE, related_name='currency_rollups')
+    day = models.DateField()
+    currency_type = models.CharField(max_length=20)
+    transaction_type = models.CharField(max_length=15, choices=CurrencyTransaction.TRANSACTION_TYPES)
+    count = models.PositiveIntegerField(default=0)
+    total_amount = models.BigIntegerField(default=0)
+    last_transaction_id = models.BigIntegerField(default=0)
+    closing_balance = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['player', 'day', 'currency_type', 'transaction_type'],
+                name='unique_currency_daily_rollup',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['player', 'currency_type', '-day'], name='rollup_player_currency_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.player_id} {self.day} {self.currency_type}/{self.transaction_type}: {self.count} на {self.total_amount}"
+
+
 
 
 class PriceSettings(models.Model):
@@ -801,6 +1042,124 @@ class Transaction(models.Model):
     total = models.DecimalField(max_digits=15, decimal_places=2)
     transaction_type = models.CharField(max_length=10, choices=TRANSACTION_TYPES)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        """Новая сделка сразу попадает в агрегаты цен и свечи (game/price_stats.py)"""
+        from .price_stats import record_trades
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                record_trades([self])
+
+
+class ExchangeOrder(models.Model):
+    """
+    Заявка биржи ресурсов (цена - монеты за единицу ресурса).
+
+    Средства заявки резервируются при размещении: покупка - монеты
+    price * quantity, продажа - сам ресурс. Книга заявок живёт в памяти
+    процесса (game/exchange.py), таблица - её постоянная копия.
+    """
+    SIDES = [
+        ('buy', 'Покупка'),
+        ('sell', 'Продажа'),
+    ]
+    STATUSES = [
+        ('open', 'Открыта'),
+        ('filled', 'Исполнена'),
+        ('cancelled', 'Отменена'),
+    ]
+
+    player = models.ForeignKey(PlayerProfile, on_delete=models.CASCADE, related_name='exchange_orders')
+    resource_type = models.CharField(max_length=20)
+    side = models.CharField(max_length=4, choices=SIDES)
+    price = models.PositiveIntegerField()
+    quantity = models.PositiveIntegerField()
+    remaining = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUSES, default='open')
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'resource_type', 'id'], name='exchange_open_orders_idx'),
+            models.Index(fields=['player', 'status'], name='exchange_player_orders_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.side} {self.resource_type} {self.remaining}/{self.quantity} по {self.price}"
+
+
+class ExchangeFill(models.Model):
+    """Сделка биржи: журнал только на добавление"""
+    resource_type = models.CharField(max_length=20)
+    buy_order = models.ForeignKey(ExchangeOrder, on_delete=models.CASCADE, related_name='buy_fills')
+    sell_order = models.ForeignKey(ExchangeOrder, on_delete=models.CASCADE, related_name='sell_fills')
+    # Сторона заявки-агрессора (исполнилась по цене стоящей в книге заявки)
+    taker_side = models.CharField(max_length=4, choices=ExchangeOrder.SIDES)
+    price = models.PositiveIntegerField()
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.resource_type}: {self.quantity} по {self.price}"
+
+
+class PriceAggregate(models.Model):
+    """Накопительные агрегаты сделок Transaction по ресурсу"""
+    resource_type = models.CharField(max_length=20, unique=True)
+    trade_count = models.PositiveIntegerField(default=0)
+    volume = models.BigIntegerField(default=0)
+    price_sum = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    turnover = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def average_price(self):
+        """Средняя цена сделки (как считал PriceSettingsAdmin)"""
+        return self.price_sum / self.trade_count if self.trade_count else Decimal(0)
+
+    @property
+    def vwap(self):
+        """Средняя цена, взвешенная по объёму"""
+        return self.turnover / self.volume if self.volume else Decimal(0)
+
+    def __str__(self):
+        return f"{self.resource_type}: {self.trade_count} сделок"
+
+
+class PriceCandle(models.Model):
+    """Свеча OHLC по сделкам ресурса за интервал (час, день)"""
+    INTERVALS = [
+        ('1h', 'Час'),
+        ('1d', 'День'),
+    ]
+
+    resource_type = models.CharField(max_length=20)
+    interval = models.CharField(max_length=3, choices=INTERVALS)
+    bucket_start = models.DateTimeField()
+    open = models.DecimalField(max_digits=10, decimal_places=2)
+    high = models.DecimalField(max_digits=10, decimal_places=2)
+    low = models.DecimalField(max_digits=10, decimal_places=2)
+    close = models.DecimalField(max_digits=10, decimal_places=2)
+    volume = models.BigIntegerField(default=0)
+    turnover = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    trade_count = models.PositiveIntegerField(default=0)
+    # id первой и последней сделки - кто задаёт open и close
+    first_transaction_id = models.BigIntegerField()
+    last_transaction_id = models.BigIntegerField()
+
+    class Meta:
+        ordering = ['-bucket_start']
+        constraints = [
+            models.UniqueConstraint(fields=['resource_type', 'interval', 'bucket_start'], name='unique_price_candle'),
+        ]
+
+    def __str__(self):
+        return f"{self.resource_type} {self.interval} {self.bucket_start:%Y-%m-%d %H:%M}"
     
     
 # Добавьте этот класс в конец game/models.py (после существующих моделей)
@@ -810,12 +1169,84 @@ from django.db import models
 from django.utils import timezone
 
 class Combat(models.Model):
+    STATUS_CHOICES = [
+        ('active', 'Идёт'),
+        ('victory', 'Победа'),
+        ('defeat', 'Поражение'),
+        ('abandoned', 'Брошен'),
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True,
                               on_delete=models.SET_NULL, related_name='combats')
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     state = models.JSONField(default=dict)  # хранит текущее состояние боя
+    seed = models.BigIntegerField(null=True, blank=True, editable=False)  # seed генератора боя
+    inputs = models.JSONField(default=list, blank=True)  # ходы игрока (encode_input) для повтора боя
+    version = models.PositiveIntegerField(default=0)  # число обработанных ходов (ETag и дельты API)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')  # копия state['status'] для индекса
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'status']),
+            # Поиск брошенных активных боёв и архивация завершённых
+            models.Index(fields=['status', 'updated_at']),
+        ]
+        constraints = [
+            # У игрока может быть только один активный бой
+            models.UniqueConstraint(
+                fields=['owner'],
+                condition=models.Q(status='active'),
+                name='unique_active_combat_per_owner',
+            ),
+        ]
 
     def __str__(self):
-        return f"Combat {self.id} ({self.owner.username if self.owner else 'Anonymous'})"
\ No newline at end of file
+        return f"Combat {self.id} ({self.owner.username if self.owner else 'Anonymous'})"
+
+    def save(self, *args, **kwargs):
+        self.status = self.state.get('status', self.status)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'state' in update_fields and 'status' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['status']
+        super().save(*args, **kwargs)
+
+
+class CombatArchive(models.Model):
+    """
+    Итог завершённого боя после архивации (archive_combats).
+
+    Полное состояние боя хранится сжатым в payload (zlib + JSON) либо
+    выгружается в файлы - тогда payload пустой и остаётся только итог.
+    """
+    id = models.UUIDField(primary_key=True, editable=False)  # тот же id, что был у Combat
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True,
+                              on_delete=models.SET_NULL, related_name='archived_combats')
+    created_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=Combat.STATUS_CHOICES)
+    winner = models.CharField(max_length=10, null=True, blank=True)
+    turns = models.PositiveIntegerField(default=0)
+    monster_name = models.CharField(max_length=100, blank=True)
+    xp_reward = models.IntegerField(default=0)
+    coin_reward = models.IntegerField(default=0)
+    seed = models.BigIntegerField(null=True, blank=True)
+    payload = models.BinaryField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['owner', 'finished_at'])]
+
+    def __str__(self):
+        return f"Archived combat {self.id} ({self.status})"
+
+    def to_combat(self):
+        """Несохраняемый Combat с распакованным состоянием (для повтора боя)"""
+        if self.payload is None:
+            raise ValueError("Состояние боя выгружено в файлы архива")
+        data = json.loads(zlib.decompress(bytes(self.payload)))
+        return Combat(
+            id=self.id, owner_id=self.owner_id, created_at=self.created_at,
+            state=data['state'], seed=self.seed, inputs=data['inputs'],
+            version=data['version'], status=self.status,
+        )
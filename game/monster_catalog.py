@@ -0,0 +1,214 @@
+"""
+Каталог монстров для start_battle().
+
+Шаблоны из npc_templates.MONSTER_TEMPLATES один раз разбираются в
+компактные объекты MonsterTemplate и раскладываются по индексам
+«локация -> уровень игрока -> таблица выбора». Выбор монстра - O(1)
+при любом числе шаблонов: таблица находится по уровню через список, а
+взвешенный выбор делается alias-методом (Walker/Vose).
+
+Необязательные ключи шаблона:
+    weight     - относительная частота появления (по умолчанию 1)
+    min_level,
+    max_level  - уровни игрока, для которых монстр подходит
+                 (по умолчанию level ± LEVEL_SPREAD)
+    locations  - список названий Location; без него монстр встречается везде
+
+Файл npc_templates.py перечитывается при изменении (проверка mtime не
+чаще раза в RELOAD_CHECK_INTERVAL секунд), перезапуск сервера не нужен.
+"""
+import importlib
+import logging
+import os
+import random
+import threading
+import time
+
+from . import npc_templates
+
+logger = logging.getLogger(__name__)
+
+# Разброс уровней монстра и игрока по умолчанию
+LEVEL_SPREAD = 2
+
+RELOAD_CHECK_INTERVAL = 5.0
+
+# Ключ индекса для монстров без привязки к локации
+ANY_LOCATION = None
+
+STAT_FIELDS = (
+    'name', 'level', 'hp', 'strength', 'agility', 'intuition', 'endurance',
+    'damage_min', 'damage_max', 'crit_chance', 'dodge_chance', 'armor',
+    'xp_reward', 'coin_reward',
+)
+CATALOG_FIELDS = ('weight', 'min_level', 'max_level', 'locations')
+
+
+class MonsterTemplate:
+    """Шаблон монстра: характеристики для боя и параметры выбора"""
+
+    __slots__ = STAT_FIELDS + CATALOG_FIELDS + ('extra',)
+
+    def __init__(self, data):
+        missing = [field for field in STAT_FIELDS if field not in data]
+        if missing:
+            raise ValueError(f"Шаблон {data.get('name', '?')}: нет полей {', '.join(missing)}")
+
+        for field in STAT_FIELDS:
+            setattr(self, field, data[field])
+        self.weight = float(data.get('weight', 1))
+        if self.weight <= 0:
+            raise ValueError(f"Шаблон {self.name}: weight должен быть больше 0")
+        self.min_level = int(data.get('min_level', self.level - LEVEL_SPREAD))
+        self.max_level = int(data.get('max_level', self.level + LEVEL_SPREAD))
+        locations = data.get('locations')
+        self.locations = frozenset(locations) if locations else None
+        # Прочие ключи шаблона переносятся в состояние боя как есть
+        extra = tuple((k, v) for k, v in data.items() if k not in STAT_FIELDS and k not in CATALOG_FIELDS)
+        self.extra = extra or None
+
+    def to_state(self):
+        """Новый словарь монстра для combat_state['monster']"""
+        monster = {field: getattr(self, field) for field in STAT_FIELDS}
+        if self.extra:
+            monster.update(self.extra)
+        monster['current_hp'] = self.hp
+        monster['max_hp'] = self.hp
+        return monster
+
+    def __repr__(self):
+        return f"<MonsterTemplate {self.name} lvl {self.level}>"
+
+
+class AliasTable:
+    """Взвешенный выбор за O(1) (alias-метод Vose)"""
+
+    __slots__ = ('items', 'prob', 'alias')
+
+    def __init__(self, items, weights):
+        n = len(items)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        prob = [0.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+
+        while small and large:
+            s = small.pop()
+            g = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = g
+            scaled[g] -= 1.0 - scaled[s]
+            (small if scaled[g] < 1.0 else large).append(g)
+        # Остатки из-за округления - вероятность 1
+        for i in small + large:
+            prob[i] = 1.0
+
+        self.items = tuple(items)
+        self.prob = prob
+        self.alias = alias
+
+    def pick(self, rng=random):
+        i = rng.randrange(len(self.items))
+        if rng.random() < self.prob[i]:
+            return self.items[i]
+        return self.items[self.alias[i]]
+
+
+class LevelIndex:
+    """Таблицы выбора по уровню игрока: уровень -> AliasTable за O(1)"""
+
+    __slots__ = ('min_level', 'tables')
+
+    def __init__(self, templates):
+        self.min_level = min(t.min_level for t in templates)
+
+        # Набор подходящих монстров меняется только на границах диапазонов,
+        # между границами все уровни делят одну таблицу
+        bounds = sorted({t.min_level for t in templates} | {t.max_level + 1 for t in templates})
+        self.tables = []
+        table = None
+        for start, end in zip(bounds, bounds[1:]):
+            eligible = [t for t in templates if t.min_level <= start <= t.max_level]
+            # Провал между диапазонами заполняется ближайшей таблицей снизу
+            if eligible:
+                table = AliasTable(eligible, [t.weight for t in eligible])
+            self.tables.extend([table] * (end - start))
+
+    def table_for(self, level):
+        i = min(max(level - self.min_level, 0), len(self.tables) - 1)
+        return self.tables[i]
+
+
+class MonsterCatalog:
+    """Неизменяемый набор шаблонов с индексами по локации и уровню"""
+
+    def __init__(self, templates_data):
+        self.templates = [MonsterTemplate(data) for data in templates_data]
+        if not self.templates:
+            raise ValueError("Каталог монстров пуст")
+        self.by_name = {t.name: t for t in self.templates}
+
+        everywhere = [t for t in self.templates if t.locations is None]
+        locations = set().union(*(t.locations for t in self.templates if t.locations))
+        self.indexes = {}
+        for location in locations:
+            local = [t for t in self.templates if t.locations is None or location in t.locations]
+            self.indexes[location] = LevelIndex(local)
+        # Локации без своих монстров: общие монстры, а если их нет - все
+        self.indexes[ANY_LOCATION] = LevelIndex(everywhere or self.templates)
+
+    def pick(self, level, location=ANY_LOCATION, rng=random):
+        """Случайный шаблон для игрока уровня level в локации location"""
+        index = self.indexes.get(location) or self.indexes[ANY_LOCATION]
+        return index.table_for(level).pick(rng)
+
+    def __len__(self):
+        return len(self.templates)
+
+
+_catalog = None
+_catalog_mtime = None
+_next_check = 0.0
+_reload_lock = threading.Lock()
+
+
+def _source_mtime():
+    try:
+        return os.stat(npc_templates.__file__).st_mtime
+    except OSError:
+        return None
+
+
+def reload_monster_catalog(force_reload_module=True):
+    """Перечитывает npc_templates.py и пересобирает каталог"""
+    global _catalog, _catalog_mtime
+    with _reload_lock:
+        mtime = _source_mtime()
+        if force_reload_module:
+            importlib.reload(npc_templates)
+        # Новый каталог собирается целиком и подменяется одним присваиванием
+        _catalog = MonsterCatalog(npc_templates.MONSTER_TEMPLATES)
+        _catalog_mtime = mtime
+    return _catalog
+
+
+def get_monster_catalog():
+    """Текущий каталог; при изменении npc_templates.py перечитывает его"""
+    global _next_check, _catalog_mtime
+    if _catalog is None:
+        return reload_monster_catalog(force_reload_module=False)
+
+    now = time.monotonic()
+    if now >= _next_check:
+        _next_check = now + RELOAD_CHECK_INTERVAL
+        if _source_mtime() != _catalog_mtime:
+            try:
+                reload_monster_catalog()
+            except Exception as e:
+                # Ошибка в файле шаблонов не должна ломать охоту - работаем со старым каталогом
+                # до следующего изменения файла
+                _catalog_mtime = _source_mtime()
+                logger.error(f"Monster catalog reload failed: {str(e)}", exc_info=True)
+    return _catalog
@@ -0,0 +1,157 @@
+"""
+Агрегаты цен по сделкам Transaction.
+
+PriceAggregate хранит по ресурсу число сделок, объём, сумму цен, оборот,
+минимум и максимум - средняя цена и VWAP считаются из них за O(1).
+PriceCandle - свечи OHLC по часам и дням.
+
+record_trades() добавляет новые сделки: один UPDATE на строку агрегата или
+свечи (F(), Least/Greatest), недостающая строка создаётся. MySQL считает
+SET слева направо и видит уже присвоенные значения, поэтому выражение в
+SET читает только свой столбец или столбцы, присваиваемые после него.
+Правка или удаление сделки задним числом не вычитается из минимума и
+максимума, поэтому тогда агрегаты ресурса пересчитываются целиком
+rebuild_price_stats() - агрегатными запросами в БД.
+"""
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Max, Min, Sum, Value, When
+from django.db.models.functions import Greatest, Least
+
+from .models import PriceAggregate, PriceCandle, PriceSettings, Transaction
+
+# Длина интервала свечи в секундах
+CANDLE_SECONDS = {'1h': 3600, '1d': 86400}
+
+
+def bucket_start(moment, interval):
+    """Начало интервала свечи (UTC), в который попадает момент"""
+    seconds = CANDLE_SECONDS[interval]
+    timestamp = int(moment.timestamp())
+    return datetime.fromtimestamp(timestamp - timestamp % seconds, tz=dt_timezone.utc)
+
+
+def _upsert(queryset, update, create):
+    """UPDATE строки; если её нет - создание, при гонке с другим писателем - повторный UPDATE"""
+    if queryset.update(**update):
+        return
+    try:
+        with transaction.atomic():
+            queryset.model.objects.create(**create)
+    except IntegrityError:
+        queryset.update(**update)
+
+
+def _fold(groups, key, trade):
+    price = Decimal(str(trade.price))
+    total = Decimal(str(trade.total))
+    group = groups.get(key)
+    if group is None:
+        groups[key] = {
+            'count': 1, 'volume': trade.amount, 'price_sum': price, 'turnover': total,
+            'low': price, 'high': price, 'first_id': trade.pk, 'open': price, 'last_id': trade.pk, 'close': price,
+        }
+        return
+    group['count'] += 1
+    group['volume'] += trade.amount
+    group['price_sum'] += price
+    group['turnover'] += total
+    group['low'] = min(group['low'], price)
+    group['high'] = max(group['high'], price)
+    if trade.pk < group['first_id']:
+        group['first_id'], group['open'] = trade.pk, price
+    if trade.pk >= group['last_id']:
+        group['last_id'], group['close'] = trade.pk, price
+
+
+def record_trades(trades):
+    """Добавляет сохранённые сделки в агрегаты и свечи"""
+    totals = {}
+    candles = {}
+    for trade in trades:
+        _fold(totals, trade.resource_type, trade)
+        for interval in CANDLE_SECONDS:
+            _fold(candles, (trade.resource_type, interval, bucket_start(trade.created_at, interval)), trade)
+
+    with transaction.atomic():
+        for resource_type, group in totals.items():
+            _upsert(
+                PriceAggregate.objects.filter(resource_type=resource_type),
+                {
+                    'trade_count': F('trade_count') + group['count'],
+                    'volume': F('volume') + group['volume'],
+                    'price_sum': F('price_sum') + group['price_sum'],
+                    'turnover': F('turnover') + group['turnover'],
+                    'min_price': Least(F('min_price'), Value(group['low'])),
+                    'max_price': Greatest(F('max_price'), Value(group['high'])),
+                },
+                {
+                    'resource_type': resource_type, 'trade_count': group['count'], 'volume': group['volume'],
+                    'price_sum': group['price_sum'], 'turnover': group['turnover'],
+                    'min_price': group['low'], 'max_price': group['high'],
+                },
+            )
+
+        for (resource_type, interval, start), group in candles.items():
+            update = {
+                'open': Case(When(first_transaction_id__gt=group['first_id'], then=Value(group['open'])), default=F('open')),
+                'close': Case(When(last_transaction_id__lte=group['last_id'], then=Value(group['close'])), default=F('close')),
+                'high': Greatest(F('high'), Value(group['high'])),
+                'low': Least(F('low'), Value(group['low'])),
+                'volume': F('volume') + group['volume'],
+                'turnover': F('turnover') + group['turnover'],
+                'trade_count': F('trade_count') + group['count'],
+            }
+            # Django пишет SET в порядке словаря: id сделок присваиваются
+            # последними, чтобы open и close выше читали их старые значения
+            update['first_transaction_id'] = Least(F('first_transaction_id'), Value(group['first_id']))
+            update['last_transaction_id'] = Greatest(F('last_transaction_id'), Value(group['last_id']))
+            _upsert(
+                PriceCandle.objects.filter(resource_type=resource_type, interval=interval, bucket_start=start),
+                update,
+                {
+                    'resource_type': resource_type, 'interval': interval, 'bucket_start': start,
+                    'open': group['open'], 'high': group['high'], 'low': group['low'], 'close': group['close'],
+                    'volume': group['volume'], 'turnover': group['turnover'], 'trade_count': group['count'],
+                    'first_transaction_id': group['first_id'], 'last_transaction_id': group['last_id'],
+                },
+            )
+
+
+def rebuild_price_stats(resource_type):
+    """Пересчёт агрегатов и свечей ресурса с нуля (после правки или удаления сделок)"""
+    trades = Transaction.objects.filter(resource_type=resource_type)
+    with transaction.atomic():
+        PriceCandle.objects.filter(resource_type=resource_type).delete()
+        summary = trades.aggregate(
+            trade_count=Count('id'), volume=Sum('amount'), price_sum=Sum('price'),
+            turnover=Sum('total'), min_price=Min('price'), max_price=Max('price'),
+        )
+        if not summary['trade_count']:
+            PriceAggregate.objects.filter(resource_type=resource_type).delete()
+            return
+        PriceAggregate.objects.update_or_create(resource_type=resource_type, defaults=summary)
+
+        candles = {}
+        for trade in trades.order_by('id').only('id', 'amount', 'price', 'total', 'created_at').iterator(chunk_size=2000):
+            for interval in CANDLE_SECONDS:
+                _fold(candles, (resource_type, interval, bucket_start(trade.created_at, interval)), trade)
+        PriceCandle.objects.bulk_create([
+            PriceCandle(
+                resource_type=resource_type, interval=interval, bucket_start=start,
+                open=group['open'], high=group['high'], low=group['low'], close=group['close'],
+                volume=group['volume'], turnover=group['turnover'], trade_count=group['count'],
+                first_transaction_id=group['first_id'], last_transaction_id=group['last_id'],
+            )
+            for (_, interval, start), group in candles.items()
+        ], batch_size=500)
+
+
+def refresh_average_price(resource_type):
+    """Переносит среднюю цену из агрегата в PriceSettings (одно чтение, один UPDATE)"""
+    aggregate = PriceAggregate.objects.filter(resource_type=resource_type).first()
+    if aggregate is None:
+        return
+    PriceSettings.objects.filter(resource_type=resource_type).update(average_price=aggregate.average_price)
@@ -0,0 +1,152 @@
+"""
+Выписки по валютам и дневные сводки журнала.
+
+Выписка листается по ключу: курсор - id последней показанной записи,
+следующая страница - записи с id меньше курсора (индекс player, -id).
+Стоимость страницы не зависит от её номера и размера истории игрока, в
+отличие от OFFSET по ordering = ['-timestamp'].
+
+История баланса читается из CurrencyDailyRollup - сводки по игроку, дню,
+валюте и типу операции. Журнал (game/journal.py) после каждой записи
+пачки добавляет её в сводки: затронутые строки сводки читаются с
+блокировкой одним запросом, а записываются одним upsert (bulk_create с
+update_conflicts), новые - bulk_create.
+"""
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import CurrencyDailyRollup, CurrencyTransaction
+
+STATEMENT_PAGE_SIZE = 50
+MAX_STATEMENT_PAGE_SIZE = 200
+MAX_HISTORY_DAYS = 90
+
+# Типы операций, уменьшающие баланс (amount в журнале - модуль суммы)
+DEBIT_TYPES = frozenset(('subtract', 'transfer', 'purchase', 'fee', 'bank_deposit', 'exchange_out'))
+
+STATEMENT_FIELDS = ('id', 'timestamp', 'currency_type', 'amount', 'transaction_type', 'balance_after', 'description')
+
+
+def signed_amount(transaction_type, amount):
+    return -amount if transaction_type in DEBIT_TYPES else amount
+
+
+def _merge_rollups(groups):
+    keys = list(groups)
+    existing = {
+        (row.player_id, row.day, row.currency_type, row.transaction_type): row
+        for row in CurrencyDailyRollup.objects.select_for_update().filter(
+            player_id__in={key[0] for key in keys},
+            day__in={key[1] for key in keys},
+            currency_type__in={key[2] for key in keys},
+            transaction_type__in={key[3] for key in keys},
+        )
+    }
+    changed = []
+    created = []
+    for key, (count, total, last_id, balance) in groups.items():
+        row = existing.get(key)
+        if row is None:
+            created.append(CurrencyDailyRollup(
+                player_id=key[0], day=key[1], currency_type=key[2], transaction_type=key[3],
+                count=count, total_amount=total, last_transaction_id=last_id, closing_balance=balance,
+            ))
+            continue
+        if last_id < row.last_transaction_id:
+            last_id, balance = row.last_transaction_id, row.closing_balance
+        changed.append(CurrencyDailyRollup(
+            player_id=key[0], day=key[1], currency_type=key[2], transaction_type=key[3],
+            count=row.count + count, total_amount=row.total_amount + total,
+            last_transaction_id=last_id, closing_balance=balance,
+        ))
+
+    if changed:
+        # Строки заблокированы выше - итоговые значения пишутся одним INSERT ... ON CONFLICT DO UPDATE
+        CurrencyDailyRollup.objects.bulk_create(
+            changed, batch_size=500, update_conflicts=True,
+            unique_fields=['player', 'day', 'currency_type', 'transaction_type'],
+            update_fields=['count', 'total_amount', 'last_transaction_id', 'closing_balance'],
+        )
+    if created:
+        CurrencyDailyRollup.objects.bulk_create(created, batch_size=500)
+
+
+def apply_rollups(entries):
+    """Добавляет сохранённые записи журнала в дневные сводки"""
+    groups = {}
+    for entry in entries:
+        day = timezone.localdate(entry.timestamp or timezone.now())
+        key = (entry.player_id, day, entry.currency_type, entry.transaction_type)
+        count, total, last_id, balance = groups.get(key, (0, 0, 0, 0))
+        # Без id (бэкенд не вернул ключи) последней считается запись позже в пачке
+        entry_id = entry.pk or 0
+        if entry_id >= last_id:
+            last_id, balance = entry_id, entry.balance_after
+        groups[key] = (count + 1, total + entry.amount, last_id, balance)
+
+    try:
+        with transaction.atomic():
+            _merge_rollups(groups)
+    except IntegrityError:
+        # Новую строку сводки успел создать параллельный писатель - теперь она есть и блокируется
+        with transaction.atomic():
+            _merge_rollups(groups)
+
+
+def statement_page(player_id, currency_type=None, transaction_type=None, before=None, limit=STATEMENT_PAGE_SIZE):
+    """
+    Страница выписки: записи новее к старым.
+
+    Возвращает (записи, курсор следующей страницы или None).
+    """
+    limit = max(1, min(limit, MAX_STATEMENT_PAGE_SIZE))
+    queryset = CurrencyTransaction.objects.filter(player_id=player_id)
+    if currency_type:
+        queryset = queryset.filter(currency_type=currency_type)
+    if transaction_type:
+        queryset = queryset.filter(transaction_type=transaction_type)
+    if before:
+        queryset = queryset.filter(id__lt=before)
+
+    rows = list(queryset.order_by('-id').values(*STATEMENT_FIELDS)[:limit + 1])
+    next_cursor = rows[limit - 1]['id'] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def balance_history(player_id, currency_type, before=None, days=30):
+    """
+    Дни с операциями по валюте, новее к старым, из дневных сводок.
+
+    Возвращает (дни, курсор следующей страницы или None); курсор - дата
+    последнего показанного дня.
+    """
+    days = max(1, min(days, MAX_HISTORY_DAYS))
+    rollups = CurrencyDailyRollup.objects.filter(player_id=player_id, currency_type=currency_type)
+    if before:
+        rollups = rollups.filter(day__lt=before)
+
+    day_keys = list(rollups.order_by('-day').values_list('day', flat=True).distinct()[:days + 1])
+    next_cursor = day_keys[days - 1] if len(day_keys) > days else None
+    day_keys = day_keys[:days]
+    if not day_keys:
+        return [], None
+
+    history = {}
+    last_ids = {}
+    for row in rollups.filter(day__gte=day_keys[-1]).values(
+        'day', 'transaction_type', 'count', 'total_amount', 'last_transaction_id', 'closing_balance',
+    ):
+        day = history.setdefault(row['day'], {
+            'day': row['day'].isoformat(), 'closing_balance': 0, 'credit': 0, 'debit': 0, 'count': 0, 'types': {},
+        })
+        day['types'][row['transaction_type']] = {'count': row['count'], 'amount': row['total_amount']}
+        day['count'] += row['count']
+        if row['transaction_type'] in DEBIT_TYPES:
+            day['debit'] += row['total_amount']
+        else:
+            day['credit'] += row['total_amount']
+        if row['last_transaction_id'] >= last_ids.get(row['day'], -1):
+            last_ids[row['day']] = row['last_transaction_id']
+            day['closing_balance'] = row['closing_balance']
+
+    return [history[day] for day in day_keys], next_cursor
@@ -1,3 +1,242 @@
+import random
+
+from django.contrib.auth.models import User
 from django.test import TestCase
 
-# Create your tests here.
+from .combat_logic import (
+    decode_input, encode_input, new_combat_seed, play_turn, replay_battle, start_battle, verify_battle,
+)
+from .combat_sim import make_player_data, simulate_matchup, simulate_matchup_reference
+from .combat_store import CombatStore, LocalMemoryBackend
+from .inventory import inventory_page
+from .ledger import LedgerError, credit, credit_each, transfer
+from .models import Combat, CurrencyTransaction, InventoryItem, Item, PlayerProfile
+from .npc_templates import MONSTER_TEMPLATES
+from .statements import signed_amount
+
+
+def create_profile(username, **fields):
+    """Игрок с пользователем для тестов"""
+    user = User.objects.create_user(username, password='test')
+    return PlayerProfile.objects.create(user=user, name=username, classification='warrior', **fields)
+
+
+class CombatSimulatorTests(TestCase):
+    """Пакетный симулятор против эталонного прогона через handle_player_turn()"""
+
+    def setUp(self):
+        random.seed(20240501)
+        # Игрок, который выигрывает у гоблина примерно каждый второй бой
+        self.player = make_player_data(phys_damage_min=2, phys_damage_max=8)
+        self.monster = MONSTER_TEMPLATES[0]
+
+    def test_matches_reference(self):
+        batch = simulate_matchup(self.player, self.monster, fights=20000, seed=1)
+        reference = simulate_matchup_reference(self.player, self.monster, fights=2000)
+
+        self.assertEqual(batch['wins'] + batch['losses'] + batch['timeouts'], 20000)
+        self.assertEqual(reference['wins'] + reference['losses'] + reference['timeouts'], 2000)
+        # Стандартное отклонение разницы долей ~0.012 - допуск больше 4 сигм
+        self.assertAlmostEqual(batch['win_rate'], reference['win_rate'], delta=0.05)
+        self.assertAlmostEqual(batch['turns']['mean'], reference['turns']['mean'], delta=1.0)
+
+    def test_seed_is_reproducible(self):
+        first = simulate_matchup(self.player, self.monster, fights=5000, seed=7)
+        second = simulate_matchup(self.player, self.monster, fights=5000, seed=7)
+        for key in ('wins', 'losses', 'timeouts', 'turns', 'player_damage', 'monster_damage'):
+            self.assertEqual(first[key], second[key])
+
+
+class BattleReplayTests(TestCase):
+    """Повтор боя по seed и ходам игрока"""
+
+    def setUp(self):
+        self.profile = create_profile('replay')
+        self.store = CombatStore(LocalMemoryBackend(), flush_every=3)
+
+    def play_to_end(self, seed):
+        combat = Combat.objects.create(owner=self.profile.user, state=start_battle(self.profile, seed=seed), seed=seed)
+        entry = self.store.add(combat)
+        rng = random.Random(seed)
+        for _ in range(500):
+            if entry['state']['status'] != 'active':
+                break
+            play_turn(self.store, entry, rng.randint(1, 4), rng.sample(range(1, 5), 2))
+        combat.refresh_from_db()
+        return combat
+
+    def test_finished_battle_verifies(self):
+        combat = self.play_to_end(new_combat_seed())
+        self.assertIn(combat.status, ('victory', 'defeat'))
+        self.assertEqual(len(combat.inputs), combat.state['turn'] - 1)
+
+        matches, replayed = verify_battle(combat)
+        self.assertTrue(matches)
+        self.assertEqual(replayed['events'], combat.state['events'])
+
+    def test_replay_is_deterministic(self):
+        combat = self.play_to_end(12345)
+        first = replay_battle(combat.state, combat.seed, combat.inputs)
+        second = replay_battle(combat.state, combat.seed, combat.inputs)
+        self.assertEqual(first, second)
+
+    def test_changed_inputs_do_not_verify(self):
+        combat = self.play_to_end(12345)
+        # Другая зона атаки на первом ходу - зона пишется в событие удара
+        attack_zone, defense_zones = decode_input(combat.inputs[0])
+        combat.inputs[0] = encode_input(attack_zone % 4 + 1, defense_zones)
+        matches, _ = verify_battle(combat)
+        self.assertFalse(matches)
+
+    def test_battle_without_seed_is_rejected(self):
+        combat = Combat.objects.create(owner=self.profile.user, state=start_battle(self.profile))
+        with self.assertRaises(ValueError):
+            verify_battle(combat)
+
+
+class EquipmentBonusTests(TestCase):
+    """Бонусы экипировки при пересчёте из устаревшего экземпляра профиля"""
+
+    def setUp(self):
+        self.profile = create_profile('equip')
+        ring = Item.objects.create(name='Кольцо силы', description='', type='jewelry', subtype='ring', bonus_strength=5)
+        self.inv_item = InventoryItem.objects.create(owner=self.profile, item=ring)
+
+    def test_unequip_from_stale_instance(self):
+        stale = PlayerProfile.objects.get(pk=self.profile.pk)
+        self.inv_item.equip()
+        self.profile.update_stats_from_equipment()
+        self.assertEqual(PlayerProfile.objects.get(pk=self.profile.pk).strength_mod, 5)
+
+        # stale не видел надевания: без блокировки он вычел бы бонус, которого по его данным нет
+        self.inv_item.unequip()
+        stale.update_stats_from_equipment()
+        fresh = PlayerProfile.objects.get(pk=self.profile.pk)
+        self.assertEqual(fresh.strength_mod, 0)
+        self.assertEqual(fresh.equipment_bonuses, {})
+        self.assertEqual(stale.strength_mod, 0)
+
+    def test_equip_twice_from_stale_instances(self):
+        first = PlayerProfile.objects.get(pk=self.profile.pk)
+        second = PlayerProfile.objects.get(pk=self.profile.pk)
+        self.inv_item.equip()
+        first.update_stats_from_equipment()
+        second.update_stats_from_equipment()
+        self.assertEqual(PlayerProfile.objects.get(pk=self.profile.pk).strength_mod, 5)
+
+
+class LedgerTests(TestCase):
+    """Сохранение денег в операциях леджера и лимит MAX_COINS"""
+
+    def setUp(self):
+        self.sender = create_profile('sender', coins=1000)
+        self.receiver = create_profile('receiver', coins=0)
+
+    def coins(self, profile):
+        return PlayerProfile.objects.values_list('coins', flat=True).get(pk=profile.pk)
+
+    def journal_total(self, profile):
+        return sum(
+            signed_amount(transaction_type, amount)
+            for transaction_type, amount in CurrencyTransaction.objects.filter(
+                player=profile, currency_type='coins',
+            ).values_list('transaction_type', 'amount')
+        )
+
+    def test_transfer_conserves_coins(self):
+        ok, message = transfer(self.sender, self.receiver, 'coins', 500)
+        self.assertTrue(ok, message)
+
+        fee = int(500 * PlayerProfile.TRANSACTION_FEE_RATES['player_to_player'])
+        self.assertEqual(self.coins(self.receiver), 500)
+        self.assertEqual(self.coins(self.sender), 1000 - 500 - fee)
+        # Всё, что ушло от отправителя, пришло получателю или ушло в комиссию
+        self.assertEqual(1000 - self.coins(self.sender) - self.coins(self.receiver), fee)
+        # Журнал сходится с изменением балансов
+        self.assertEqual(self.journal_total(self.sender), self.coins(self.sender) - 1000)
+        self.assertEqual(self.journal_total(self.receiver), self.coins(self.receiver))
+
+    def test_failed_transfer_changes_nothing(self):
+        ok, _ = transfer(self.sender, self.receiver, 'coins', 1000)
+        self.assertFalse(ok)
+        self.assertEqual(self.coins(self.sender), 1000)
+        self.assertEqual(self.coins(self.receiver), 0)
+        self.assertFalse(CurrencyTransaction.objects.exists())
+
+    def test_credit_over_max_coins_is_rejected(self):
+        PlayerProfile.objects.filter(pk=self.receiver.pk).update(coins=PlayerProfile.MAX_COINS - 10)
+        self.receiver.refresh_from_db()
+        with self.assertRaises(LedgerError):
+            credit(self.receiver, 'coins', 11, "Награда", transaction_type='reward')
+        self.assertEqual(self.coins(self.receiver), PlayerProfile.MAX_COINS - 10)
+        self.assertFalse(CurrencyTransaction.objects.exists())
+
+        credit(self.receiver, 'coins', 10, "Награда", transaction_type='reward')
+        self.assertEqual(self.coins(self.receiver), PlayerProfile.MAX_COINS)
+
+    def test_transfer_over_max_coins_keeps_sender_balance(self):
+        PlayerProfile.objects.filter(pk=self.receiver.pk).update(coins=PlayerProfile.MAX_COINS)
+        ok, _ = transfer(self.sender, self.receiver, 'coins', 100)
+        self.assertFalse(ok)
+        self.assertEqual(self.coins(self.sender), 1000)
+        self.assertEqual(self.coins(self.receiver), PlayerProfile.MAX_COINS)
+
+    def test_credit_each_skips_capped_player(self):
+        PlayerProfile.objects.filter(pk=self.receiver.pk).update(coins=PlayerProfile.MAX_COINS)
+        self.receiver.refresh_from_db()
+        paid = credit_each([self.sender, self.receiver], 'coins', 50, "Награда", transaction_type='reward')
+        self.assertEqual(paid, [self.sender])
+        self.assertEqual(self.coins(self.sender), 1050)
+        self.assertEqual(self.coins(self.receiver), PlayerProfile.MAX_COINS)
+
+
+class InventoryPageTests(TestCase):
+    """Страницы инвентаря по ключу (inventory_position, id)"""
+
+    def setUp(self):
+        self.profile = create_profile('pages')
+        item = Item.objects.create(name='Камень', description='', type='resource', subtype='stone')
+        # Одинаковые ячейки - порядок внутри ячейки задаёт id
+        for position in (3, 0, 1, 0, 5, 1, 1):
+            InventoryItem.objects.create(owner=self.profile, item=item, inventory_position=position)
+        self.expected = list(
+            InventoryItem.objects.filter(owner=self.profile).order_by('inventory_position', 'id').values_list('id', flat=True)
+        )
+
+    def walk(self, limit, lean=False):
+        ids, after = [], None
+        while True:
+            rows, next_cursor = inventory_page(self.profile, after=after, limit=limit, lean=lean)
+            ids.extend(row['id'] if lean else row.id for row in rows)
+            if next_cursor is None:
+                return ids
+            position, item_id = next_cursor.split(':')
+            after = (int(position), int(item_id))
+
+    def test_pages_cover_inventory_once(self):
+        for limit in (1, 2, 3, 7, 50):
+            self.assertEqual(self.walk(limit), self.expected)
+            self.assertEqual(self.walk(limit, lean=True), self.expected)
+
+    def test_cursor_is_stable_when_rows_are_added_before_it(self):
+        rows, next_cursor = inventory_page(self.profile, limit=3)
+        item = Item.objects.get(name='Камень')
+        InventoryItem.objects.create(owner=self.profile, item=item, inventory_position=0)
+
+        position, item_id = next_cursor.split(':')
+        rest, _ = inventory_page(self.profile, after=(int(position), int(item_id)), limit=50)
+        self.assertEqual([row.id for row in rows + rest], self.expected)
+
+    def test_api_pages_and_limit_validation(self):
+        self.client.login(username='pages', password='test')
+        ids, url = [], '/api/inventory/?after=&limit=2'
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(row['id'] for row in data['items'])
+            url = f"/api/inventory/?after={data['next_cursor']}&limit=2" if data['next_cursor'] else None
+        self.assertEqual(ids, self.expected)
+
+        for limit in ('abc', '-1', '0'):
+            response = self.client.get(f'/api/inventory/?after=&limit={limit}')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/inventory/?after=bad').status_code, 400)
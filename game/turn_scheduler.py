@@ -0,0 +1,99 @@
+"""
+Планировщик дедлайнов ходов: куча (heapq) с ленивой отменой.
+
+schedule() и pop_expired() стоят O(log n), cancel() - O(1): отменённые и
+перенесённые дедлайны остаются в куче и пропускаются при извлечении,
+а когда их становится слишком много, куча пересобирается за O(n).
+Десятки тысяч одновременных таймеров занимают одну кучу кортежей.
+"""
+import heapq
+import threading
+import time
+
+
+class TurnScheduler:
+    """Дедлайны по ключам (id боя); у ключа действует только последний дедлайн"""
+
+    # Пересборка кучи, когда устаревших записей больше, чем живых, в это число раз
+    COMPACT_RATIO = 2
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._heap = []
+        self._deadlines = {}
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def schedule(self, key, deadline):
+        """Назначает (или переносит) дедлайн ключа"""
+        with self._cond:
+            earliest = self._heap[0][0] if self._heap else None
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, key))
+            self._maybe_compact()
+            # Ожидающий поток должен проснуться раньше, если дедлайн ближе прежнего
+            if earliest is None or deadline < earliest:
+                self._cond.notify_all()
+
+    def cancel(self, key):
+        with self._cond:
+            self._deadlines.pop(key, None)
+
+    def deadline(self, key):
+        return self._deadlines.get(key)
+
+    def next_deadline(self):
+        """Ближайший действующий дедлайн (None - таймеров нет)"""
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now=None):
+        """Извлекает ключи с наступившим дедлайном"""
+        with self._cond:
+            return self._pop_expired(self.clock() if now is None else now)
+
+    def wait_expired(self, max_wait=1.0):
+        """
+        Ждёт ближайший дедлайн (не дольше max_wait секунд) и возвращает
+        истёкшие ключи; пустой список - за max_wait ничего не истекло.
+        """
+        with self._cond:
+            expired = self._pop_expired(self.clock())
+            if expired:
+                return expired
+            delay = max_wait
+            if self._heap:
+                delay = min(max_wait, max(0.0, self._heap[0][0] - self.clock()))
+            self._cond.wait(delay)
+            return self._pop_expired(self.clock())
+
+    def wake(self):
+        """Будит поток в wait_expired() (например, при остановке)"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def _pop_expired(self, now):
+        expired = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, key = heapq.heappop(heap)
+            if self._deadlines.get(key) == deadline:
+                del self._deadlines[key]
+                expired.append(key)
+        return expired
+
+    def _drop_stale(self):
+        heap = self._heap
+        while heap and self._deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def _maybe_compact(self):
+        if len(self._heap) > self.COMPACT_RATIO * len(self._deadlines) + 64:
+            self._heap = [(deadline, key) for key, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
@@ -3,6 +3,7 @@ from django.contrib.auth.views import LogoutView
 from django.contrib.auth.views import LoginView
 from . import views
 from . import combat_api
+from . import exchange_api
 
 urlpatterns = [
     # Основные URL
@@ -27,10 +28,18 @@ urlpatterns = [
     path('api/inventory/', views.inventory_api, name='inventory_api'),
     path('api/inventory/equip/', views.equip_item, name='equip_item'),
     path('api/inventory/unequip/', views.unequip_item, name='unequip_item'),
+    path('api/inventory/split/', views.inventory_split, name='inventory_split'),
+    path('api/inventory/merge/', views.inventory_merge, name='inventory_merge'),
+    path('api/inventory/move/', views.inventory_move, name='inventory_move'),
+    path('api/inventory/compact/', views.inventory_compact, name='inventory_compact'),
+    path('api/items/', views.items_api, name='items_api'),
     path('api/shop/items/', views.shop_items_api, name='shop_items_api'),
+    path('api/currency/statement/', views.currency_statement_api, name='currency_statement_api'),
+    path('api/currency/history/', views.currency_history_api, name='currency_history_api'),
 
     path('chat/get_messages/', views.get_messages, name='get_messages'),
     path('chat/send_message/', views.send_message, name='send_message'),
+    path('chat/stream/', views.chat_stream, name='chat_stream'),
     path('tavern/menu/', views.tavern_menu_api, name='tavern_menu_api'),
     path('tavern/purchase/', views.tavern_purchase, name='tavern_purchase'),
     path('game/admin/authenticate/', views.admin_authenticate, name='admin_authenticate'),
@@ -44,4 +53,8 @@ urlpatterns = [
     path('api/hunt/', combat_api.api_hunt, name='api_hunt'),
     path('api/combat/<uuid:combat_id>/turn/', combat_api.api_combat_turn, name='api_combat_turn'),
     path('api/combat/<uuid:combat_id>/state/', combat_api.api_combat_state, name='api_combat_state'),
+
+    path('api/exchange/orders/', exchange_api.api_exchange_orders, name='api_exchange_orders'),
+    path('api/exchange/orders/<int:order_id>/cancel/', exchange_api.api_cancel_order, name='api_cancel_order'),
+    path('api/exchange/book/<str:resource_type>/', exchange_api.api_order_book, name='api_order_book'),
 ]
\ No newline at end of file
@@ -1,16 +1,35 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, Http404, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from .models import ChatRoom, ChatMessage, PlayerProfile, Item, ShopItem, TavernItem, InventoryItem, Combat
+from django.views.decorators.cache import cache_control
+from .models import ChatMessage, PlayerProfile, Item, ShopItem, TavernItem, InventoryItem, Combat, EQUIPPABLE_TYPES, equipment_slot_for
+from .combat_logic import render_log
+from .combat_api import public_state
+from .group_combat import is_group_state
+from .combat_store import get_combat_store
+from .chat import (
+    CHAT_TABS, get_chat_broker, get_chat_settings, get_room_registry, message_stream, publish_message, recent_events,
+    serialize_message,
+)
+from .inventory import (
+    INVENTORY_PAGE_SIZE, LEAN_FIELDS, MAX_INVENTORY_PAGE_SIZE, InventoryError, compact_inventory,
+    inventory_page, inventory_queryset, merge_stacks, move_item, parse_cursor, split_stack,
+)
+from .statements import STATEMENT_PAGE_SIZE, balance_history, signed_amount, statement_page
 import json
 from datetime import datetime
 import logging
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Least
 
 
 def is_admin(user):
@@ -257,8 +276,14 @@ def arena_panel(request):
 
 @login_required
 def combat_view(request, combat_id):
-    combat = get_object_or_404(Combat, id=combat_id, owner=request.user)
-    state = combat.state
+    # Идущий бой берём из хранилища активных боёв: в БД он может отставать на несколько ходов
+    combat = get_combat_store().load(combat_id, owner_id=request.user.id)
+    if combat is None:
+        raise Http404("Combat not found")
+    state = combat['state']
+    if is_group_state(state):
+        # Экрана группового боя нет, шаблон рассчитан на игрока и монстра
+        return HttpResponseBadRequest("Это групповой бой")
 
     player_hp_percent = (state['player']['current_hp'] / state['player']['max_hp']) * 100
     monster_hp_percent = (state['monster']['current_hp'] / state['monster']['max_hp']) * 100
@@ -266,6 +291,9 @@ def combat_view(request, combat_id):
     context = {
         'combat_id': combat_id,
         'state': state,
+        'log': render_log(state),
+        'client_state': public_state(state),
+        'version': combat['version'],
         'player_hp_percent': player_hp_percent,
         'monster_hp_percent': monster_hp_percent,
     }
@@ -299,82 +327,196 @@ def bank_panel(request):
 def trade_panel(request):
     return render(request, 'trade_panel.html')
 
+def _serialize_inventory_item(inv_item, index, global_slot_index):
+    return {
+        'id': inv_item.id,
+        'item_instance': {
+            'id': inv_item.id,
+            'item': _serialize_item(inv_item.item),
+            'quantity': inv_item.quantity,
+            'current_durability': inv_item.current_durability,
+            'max_durability': inv_item.max_durability,
+            'is_equipped': inv_item.is_equipped,
+            'can_equip': inv_item.can_equip(),
+            'equipment_slot': inv_item.get_equipment_slot()
+        },
+        'slot_index': index,
+        'global_slot_index': global_slot_index,
+        'inventory_position': inv_item.inventory_position
+    }
+
+def _serialize_item(item):
+    return {
+        'id': item.id,
+        'name': item.name,
+        'type': item.type,
+        'subtype': item.subtype,
+        'image': item.image.url if item.image else '/static/img/default_item.png',
+        'is_stackable': item.is_stackable,
+        'description': item.description,
+        'require_level': item.require_level
+    }
+
 @login_required
 @require_http_methods(["GET"])
 def inventory_api(request):
+    """
+    Инвентарь игрока.
+
+    С параметром after - страницы по ключу: after= (пусто) для первой
+    страницы, дальше next_cursor из ответа ('ячейка:id'); limit - размер страницы;
+    счётчики предметов считаются только на первой странице. lean=1 -
+    предметы без статики Item (её отдаёт api/items/?ids=...).
+    Без after - прежние страницы page по 50.
+    """
     try:
         profile = PlayerProfile.objects.get(user=request.user)
-        page = int(request.GET.get('page', 1))
         filter_type = request.GET.get('filter', 'all')
         subfilter = request.GET.get('subfilter', None)
-        
-        items_per_page = 50
-        start_index = (page - 1) * items_per_page
+        lean = request.GET.get('lean') == '1'
         total_slots = profile.get_total_inventory_slots()
+        summary = {
+            'total_slots': total_slots,
+            'base_slots': profile.base_inventory_slots,
+            'bonus_slots': profile.bonus_inventory_slots,
+            'player_level': profile.level
+        }
+
+        if 'after' in request.GET:
+            after = request.GET.get('after')
+            try:
+                after = parse_cursor(after) if after else None
+            except ValueError:
+                return JsonResponse({'error': 'Некорректный курсор'}, status=400)
+            try:
+                limit = int(request.GET.get('limit', INVENTORY_PAGE_SIZE))
+            except ValueError:
+                limit = 0
+            if limit < 1:
+                return JsonResponse({'error': 'Некорректный размер страницы'}, status=400)
+            limit = min(limit, MAX_INVENTORY_PAGE_SIZE)
+            rows, next_cursor = inventory_page(profile, filter_type, subfilter, after, limit, lean=lean)
+            if not lean:
+                rows = [
+                    _serialize_inventory_item(inv_item, index, inv_item.inventory_position)
+                    for index, inv_item in enumerate(rows)
+                ]
+            response = {'items': rows, 'next_cursor': next_cursor, **summary}
+            if after is None:
+                total_items = inventory_queryset(profile, filter_type, subfilter).count()
+                response['total_items'] = response['slots_used'] = total_items
+            return JsonResponse(response)
+
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            page = 0
+        if page < 1:
+            return JsonResponse({'error': 'Некорректный номер страницы'}, status=400)
+        items_per_page = INVENTORY_PAGE_SIZE
+        start_index = (page - 1) * items_per_page
         
-        # Получаем предметы из инвентаря
-        inventory_items = InventoryItem.objects.filter(owner=profile).select_related('item')
-        
-        # Применяем фильтры
-        if filter_type != 'all':
-            inventory_items = inventory_items.filter(item__type=filter_type)
-        
-        if subfilter:
-            inventory_items = inventory_items.filter(item__subtype=subfilter)
+        # Фильтры по копиям типа в строке инвентаря - без JOIN с Item
+        inventory_items = inventory_queryset(profile, filter_type, subfilter)
         
         total_items = inventory_items.count()
         total_pages = max(1, (total_items + items_per_page - 1) // items_per_page)
         
         # Получаем предметы для текущей страницы
         paginated_items = inventory_items.order_by('inventory_position')[start_index:start_index + items_per_page]
-        
-        # Формируем данные для ответа
-        items_data = []
-        for index, inv_item in enumerate(paginated_items):
-            global_slot_index = start_index + index
-            item_data = {
-                'id': inv_item.id,
-                'item_instance': {
-                    'id': inv_item.id,
-                    'item': {
-                        'id': inv_item.item.id,
-                        'name': inv_item.item.name,
-                        'type': inv_item.item.type,
-                        'subtype': inv_item.item.subtype,
-                        'image': inv_item.item.image.url if inv_item.item.image else '/static/img/default_item.png',
-                        'is_stackable': inv_item.item.is_stackable,
-                        'description': inv_item.item.description,
-                        'require_level': inv_item.item.require_level
-                    },
-                    'quantity': inv_item.quantity,
-                    'current_durability': inv_item.current_durability,
-                    'max_durability': inv_item.max_durability,
-                    'is_equipped': inv_item.is_equipped,
-                    'can_equip': inv_item.can_equip(),
-                    'equipment_slot': inv_item.get_equipment_slot()
-                },
-                'slot_index': index,
-                'global_slot_index': global_slot_index,
-                'inventory_position': inv_item.inventory_position
-            }
-            items_data.append(item_data)
+        if lean:
+            items_data = list(paginated_items.values(*LEAN_FIELDS))
+            for row in items_data:
+                row['can_equip'] = row['item_type'] in EQUIPPABLE_TYPES
+                row['equipment_slot'] = equipment_slot_for(row['item_type'], row['item_subtype'])
+        else:
+            items_data = [
+                _serialize_inventory_item(inv_item, index, start_index + index)
+                for index, inv_item in enumerate(paginated_items.select_related('item'))
+            ]
         
         return JsonResponse({
             'items': items_data,
             'total_pages': total_pages,
             'current_page': page,
             'total_items': total_items,
-            'total_slots': total_slots,
             'slots_used': total_items,
-            'base_slots': profile.base_inventory_slots,
-            'bonus_slots': profile.bonus_inventory_slots,
-            'player_level': profile.level
+            **summary
         })
         
     except Exception as e:
         logger.error(f"Error in inventory_api: {str(e)}", exc_info=True)
         return JsonResponse({'error': str(e)}, status=500)
 
+@login_required
+@require_http_methods(["GET"])
+@cache_control(private=True, max_age=3600)
+def items_api(request):
+    """Статика предметов по id (?ids=1,2,3) для лёгкого режима инвентаря; кэшируется браузером"""
+    try:
+        try:
+            ids = [int(item_id) for item_id in request.GET.get('ids', '').split(',') if item_id]
+        except ValueError:
+            ids = [0]
+        if any(item_id < 1 for item_id in ids):
+            return JsonResponse({'error': 'Неверный список предметов'}, status=400)
+        items = Item.objects.filter(id__in=ids[:MAX_INVENTORY_PAGE_SIZE]).only(
+            'id', 'name', 'type', 'subtype', 'image', 'is_stackable', 'description', 'require_level',
+        )
+        return JsonResponse({'items': {item.id: _serialize_item(item) for item in items}})
+    except Exception as e:
+        logger.error(f"Error in items_api: {str(e)}", exc_info=True)
+        return JsonResponse({'error': str(e)}, status=500)
+
+@login_required
+@require_http_methods(["GET"])
+def currency_statement_api(request):
+    """Выписка по журналу валют: ?currency=&type=&before=<курсор>&limit="""
+    try:
+        player_id = PlayerProfile.objects.filter(user=request.user).values_list('id', flat=True).get()
+        try:
+            before = int(request.GET['before']) if request.GET.get('before') else None
+            limit = int(request.GET.get('limit', STATEMENT_PAGE_SIZE))
+        except ValueError:
+            return JsonResponse({'error': 'Некорректные параметры страницы'}, status=400)
+
+        rows, next_cursor = statement_page(
+            player_id,
+            currency_type=request.GET.get('currency'),
+            transaction_type=request.GET.get('type'),
+            before=before,
+            limit=limit,
+        )
+        for row in rows:
+            row['timestamp'] = row['timestamp'].isoformat()
+            row['signed_amount'] = signed_amount(row['transaction_type'], row['amount'])
+
+        return JsonResponse({'transactions': rows, 'next_cursor': next_cursor})
+    except Exception as e:
+        logger.error(f"Error in currency_statement_api: {str(e)}", exc_info=True)
+        return JsonResponse({'error': str(e)}, status=500)
+
+@login_required
+@require_http_methods(["GET"])
+def currency_history_api(request):
+    """История баланса по дням из дневных сводок: ?currency=&before=<YYYY-MM-DD>&days="""
+    try:
+        player_id = PlayerProfile.objects.filter(user=request.user).values_list('id', flat=True).get()
+        try:
+            before = datetime.strptime(request.GET['before'], '%Y-%m-%d').date() if request.GET.get('before') else None
+            days = int(request.GET.get('days', 30))
+        except ValueError:
+            return JsonResponse({'error': 'Некорректные параметры страницы'}, status=400)
+
+        history, next_cursor = balance_history(player_id, request.GET.get('currency', 'coins'), before=before, days=days)
+        return JsonResponse({
+            'days': history,
+            'next_cursor': next_cursor.isoformat() if next_cursor else None,
+        })
+    except Exception as e:
+        logger.error(f"Error in currency_history_api: {str(e)}", exc_info=True)
+        return JsonResponse({'error': str(e)}, status=500)
+
 @login_required
 @require_http_methods(["GET"])
 def shop_items_api(request):
@@ -432,23 +574,11 @@ def equip_item(request):
         
         equipment_slot = item.get_equipment_slot()
         
-        # Проверяем, не надет ли уже предмет в этот слот
-        equipped_in_slot = InventoryItem.objects.filter(
-            owner=profile, 
-            is_equipped=True
-        ).select_related('item').first()
-        
-        # Если есть надетый предмет в этом слоте, снимаем его
-        if equipped_in_slot and equipped_in_slot.get_equipment_slot() == equipment_slot:
-            equipped_in_slot.is_equipped = False
-            equipped_in_slot.save()
-        
-        # Надеваем новый предмет
-        item.is_equipped = True
-        item.save()
-        
-        # Обновляем характеристики персонажа
-        profile.update_stats_from_equipment()
+        # Надеваем предмет: занятое место слота освобождается (поиск по индексу слота)
+        with transaction.atomic():
+            item.equip()
+            # Обновляем характеристики персонажа
+            profile.update_stats_from_equipment()
         
         return JsonResponse({
             'success': True, 
@@ -477,11 +607,10 @@ def unequip_item(request):
             return JsonResponse({'success': False, 'message': 'Предмет не найден или не надет'})
         
         # Снимаем предмет
-        item.is_equipped = False
-        item.save()
-        
-        # Обновляем характеристики персонажа
-        profile.update_stats_from_equipment()
+        with transaction.atomic():
+            item.unequip()
+            # Обновляем характеристики персонажа
+            profile.update_stats_from_equipment()
         
         return JsonResponse({
             'success': True, 
@@ -492,43 +621,92 @@ def unequip_item(request):
         logger.error(f"Error in unequip_item: {str(e)}", exc_info=True)
         return JsonResponse({'success': False, 'message': str(e)}, status=400)
 
+def _inventory_action(request, action, name):
+    """Общая часть POST-операций инвентаря: JSON тела -> action(profile, data) -> ответ"""
+    try:
+        data = json.loads(request.body)
+        profile = PlayerProfile.objects.get(user=request.user)
+        message = action(profile, data)
+        return JsonResponse({'success': True, 'message': message})
+    except InventoryError as e:
+        return JsonResponse({'success': False, 'message': str(e)})
+    except (json.JSONDecodeError, KeyError, ValueError, TypeError):
+        return JsonResponse({'success': False, 'message': 'Некорректные данные'}, status=400)
+    except Exception as e:
+        logger.error(f"Error in {name}: {str(e)}", exc_info=True)
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+@login_required
+@require_http_methods(["POST"])
+def inventory_split(request):
+    """Разделить стопку: {"item_id", "quantity", "position" (необязательно)}"""
+    def action(profile, data):
+        position = data.get('position')
+        split_stack(profile, int(data['item_id']), int(data['quantity']), None if position is None else int(position))
+        return 'Стопка разделена'
+    return _inventory_action(request, action, 'inventory_split')
+
+@login_required
+@require_http_methods(["POST"])
+def inventory_merge(request):
+    """Сложить стопки: {"source_id", "target_id"}"""
+    def action(profile, data):
+        moved = merge_stacks(profile, int(data['source_id']), int(data['target_id']))
+        return f'Перенесено {moved}'
+    return _inventory_action(request, action, 'inventory_merge')
+
+@login_required
+@require_http_methods(["POST"])
+def inventory_move(request):
+    """Переместить предмет: {"item_id", "position"}"""
+    def action(profile, data):
+        move_item(profile, int(data['item_id']), int(data['position']))
+        return 'Предмет перемещён'
+    return _inventory_action(request, action, 'inventory_move')
+
+@login_required
+@require_http_methods(["POST"])
+def inventory_compact(request):
+    """Упорядочить инвентарь: {"sort": true}"""
+    def action(profile, data):
+        compact_inventory(profile, sort=bool(data.get('sort', True)))
+        return 'Инвентарь упорядочен'
+    return _inventory_action(request, action, 'inventory_compact')
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def get_messages(request):
+    """
+    Новые сообщения комнаты после last_id.
+
+    wait - долгий опрос: если новых сообщений нет, запрос ждёт до wait
+    секунд (не больше LONG_POLL_TIMEOUT) публикации в комнате. Сообщения
+    берутся из буфера брокера, БД - только для истории старше буфера.
+    Под ASGI ожидание не используется: синхронные view там выполняются
+    в общем потоке, а для push есть /chat/stream/.
+    """
     try:
         tab = request.GET.get('tab', 'world')
         last_id = int(request.GET.get('last_id', 0))
+        wait = min(float(request.GET.get('wait', 0)), get_chat_settings()['LONG_POLL_TIMEOUT'])
+        if tab not in CHAT_TABS:
+            return JsonResponse({
+                'status': 'error',
+                'error': 'Unknown chat tab'
+            }, status=400)
         
-        room = ChatRoom.objects.get_or_create(
-            name=tab,
-            defaults={'room_type': tab}
-        )[0]
-        
-        last_message = ChatMessage.objects.filter(
-            room=room,
-            id__gt=last_id
-        ).order_by('-id').first()
-        
-        new_last_id = last_message.id if last_message else last_id
-        
-        messages = ChatMessage.objects.filter(
-            room=room,
-            id__gt=last_id,
-            id__lte=new_last_id
-        ).order_by('id')[:100]
+        room_id = get_room_registry().room_id(tab)
         
-        serialized_messages = [{
-            'id': msg.id,
-            'time': msg.timestamp.strftime('%H:%M'),
-            'sender': msg.sender_name,
-            'text': msg.message
-        } for msg in messages]
+        events, new_last_id = recent_events(room_id, last_id)
+        if not events and wait > 0 and not isinstance(request, ASGIRequest):
+            if get_chat_broker().wait_for_message(room_id, last_id, wait):
+                events, new_last_id = recent_events(room_id, last_id)
         
-        return JsonResponse({
-            'status': 'ok',
-            'messages': serialized_messages,
-            'last_id': new_last_id
-        })
+        # Сообщения уже сериализованы в буфере - ответ склеивается из готового JSON
+        return HttpResponse(
+            f'{{"status": "ok", "messages": [{", ".join(event.payload for event in events)}], "last_id": {new_last_id}}}',
+            content_type='application/json'
+        )
     
     except Exception as e:
         return JsonResponse({
@@ -550,27 +728,31 @@ def send_message(request):
                 'status': 'error',
                 'error': 'Message cannot be empty'
             }, status=400)
+        if tab not in CHAT_TABS:
+            return JsonResponse({
+                'status': 'error',
+                'error': 'Unknown chat tab'
+            }, status=400)
         
-        room, created = ChatRoom.objects.get_or_create(
-            name=tab,
-            defaults={'room_type': tab}
-        )
-        
-        message = ChatMessage.objects.create(
-            room=room,
-            user=request.user,
-            sender_name=request.user.username,
-            message=text
-        )
+        registry = get_room_registry()
+        room_id = registry.room_id(tab)
+        try:
+            # Внешний ключ проверяется при коммите - отдельная транзакция ловит удалённую комнату
+            with transaction.atomic():
+                message = ChatMessage.objects.create(
+                    room_id=room_id, user=request.user, sender_name=request.user.username, message=text
+                )
+        except IntegrityError:
+            # Комнату удалили в другом процессе - реестр ищет (или создаёт) её заново
+            registry.forget(room_id)
+            message = ChatMessage.objects.create(
+                room_id=registry.room_id(tab), user=request.user, sender_name=request.user.username, message=text
+            )
+        publish_message(message)
         
         return JsonResponse({
             'status': 'ok',
-            'message': {
-                'id': message.id,
-                'time': message.timestamp.strftime('%H:%M'),
-                'sender': message.sender_name,
-                'text': message.message
-            }
+            'message': serialize_message(message)
         })
     
     except json.JSONDecodeError:
@@ -584,7 +766,42 @@ def send_message(request):
             'status': 'error',
             'error': 'Internal server error'
         }, status=500)
-    
+
+
+@login_required
+@require_http_methods(["GET"])
+async def chat_stream(request):
+    """
+    Поток новых сообщений комнаты (Server-Sent Events).
+
+    Параметры как у get_messages: tab и last_id; при переподключении
+    браузер сам передаёт id последнего события в Last-Event-ID.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({
+            'status': 'error',
+            'error': 'Streaming requires an ASGI server'
+        }, status=400)
+    try:
+        tab = request.GET.get('tab', 'world')
+        last_id = int(request.headers.get('Last-Event-ID') or request.GET.get('last_id', 0))
+    except ValueError:
+        return JsonResponse({
+            'status': 'error',
+            'error': 'Invalid last_id'
+        }, status=400)
+    if tab not in CHAT_TABS:
+        return JsonResponse({
+            'status': 'error',
+            'error': 'Unknown chat tab'
+        }, status=400)
+
+    room_id = await sync_to_async(get_room_registry().room_id)(tab)
+    response = StreamingHttpResponse(message_stream(room_id, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Без буферизации ответа в nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @login_required
@@ -609,14 +826,20 @@ def tavern_purchase(request):
         if profile.gold < total_price:
             return JsonResponse({'success': False, 'message': 'Недостаточно золота'})
         
-        # Совершаем покупку
+        # Совершаем покупку: узкие UPDATE с проверкой остатка прямо в запросе
         with transaction.atomic():
-            profile.gold -= total_price
-            profile.current_hp = min(profile.current_hp + item.hp_restore * quantity, profile.max_hp)
-            profile.current_mp = min(profile.current_mp + item.mp_restore * quantity, profile.max_mp)
-            item.stock -= quantity
-            item.save()
-            profile.save()
+            paid = PlayerProfile.objects.filter(pk=profile.pk, gold__gte=total_price).update(
+                gold=F('gold') - total_price,
+                current_hp=Least(F('current_hp') + item.hp_restore * quantity, F('max_hp')),
+                current_mp=Least(F('current_mp') + item.mp_restore * quantity, F('max_mp')),
+            )
+            if not paid:
+                return JsonResponse({'success': False, 'message': 'Недостаточно золота'})
+            sold = TavernItem.objects.filter(pk=item.pk, stock__gte=quantity).update(stock=F('stock') - quantity)
+            if not sold:
+                transaction.set_rollback(True)
+                return JsonResponse({'success': False, 'message': 'Недостаточно порций в наличии'})
+        profile.refresh_from_db(fields=['gold', 'current_hp', 'current_mp'])
         
         return JsonResponse({
             'success': True,
@@ -11,12 +11,17 @@ let lastMessageIds = {
 };
 
 let currentTab = 'world';
-let pollingInterval = 3000;
+let longPollWait = 25; // Секунды, которые сервер держит запрос без новых сообщений
 let pollingActive = true;
 let pollingTimer = null;
+let pollController = null;
 let autoScrollEnabled = true; // Флаг автоматической прокрутки
 let chatInitialized = false; // Флаг инициализации чата
 
+// Поток новых сообщений (Server-Sent Events); без него - опрос get_messages
+let chatStream = null;
+let streamSupported = typeof EventSource !== 'undefined';
+
 // Флаг для отслеживания ручной прокрутки
 let isManualScrolling = false;
 let manualScrollTimer = null;
@@ -40,11 +45,16 @@ function clearLocalChatHistory() {
     }
 }
 
-// Функция для получения новых сообщений
-function fetchNewMessages() {
-    if (!pollingActive) return;
+// Функция для получения новых сообщений (wait - секунды ожидания на сервере)
+// Возвращает Promise: false - запрос не удался
+function fetchNewMessages(wait = 0) {
+    if (!pollingActive) return Promise.resolve(false);
 
-    fetch(`/chat/get_messages/?tab=${currentTab}&last_id=${lastMessageIds[currentTab]}`)
+    const tab = currentTab;
+    pollController = new AbortController();
+    return fetch(`/chat/get_messages/?tab=${tab}&last_id=${lastMessageIds[tab]}&wait=${wait}`, {
+        signal: pollController.signal
+    })
         .then(response => {
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
@@ -54,19 +64,72 @@ function fetchNewMessages() {
         .then(data => {
             if (data.status === 'ok') {
                 if (data.messages && data.messages.length > 0) {
-                    lastMessageIds[currentTab] = data.last_id;
-                    appendMessages(data.messages, currentTab);
+                    lastMessageIds[tab] = data.last_id;
+                    appendMessages(data.messages, tab);
                 }
-            } else {
-                console.error('Ошибка сервера:', data.error);
+                return true;
             }
+            console.error('Ошибка сервера:', data.error);
+            return false;
         })
         .catch(error => {
+            // Прерванный при смене вкладки запрос - не ошибка
+            if (error.name === 'AbortError') return true;
             console.error('Ошибка при получении сообщений:', error);
-            setTimeout(fetchNewMessages, 10000);
+            return false;
         });
 }
 
+// Долгий опрос: следующий запрос сразу после ответа, после ошибки - через 10 секунд
+function longPoll() {
+    fetchNewMessages(longPollWait).then(ok => {
+        if (pollingActive && !chatStream) {
+            pollingTimer = setTimeout(longPoll, ok ? 0 : 10000);
+        }
+    });
+}
+
+// Подписка на поток сообщений текущей вкладки
+function openChatStream() {
+    closeChatStream();
+    const tab = currentTab;
+    const source = new EventSource(`/chat/stream/?tab=${tab}&last_id=${lastMessageIds[tab]}`);
+
+    source.addEventListener('message', event => {
+        const msg = JSON.parse(event.data);
+        if (msg.id <= lastMessageIds[tab]) return;
+        lastMessageIds[tab] = msg.id;
+        appendMessages([msg], tab);
+    });
+
+    source.onerror = () => {
+        // Обрыв соединения браузер переподключает сам; закрытый поток
+        // означает, что сервер его не поддерживает (не ASGI) - переходим на опрос
+        if (source.readyState === EventSource.CLOSED) {
+            chatStream = null;
+            streamSupported = false;
+            startPolling();
+        }
+    };
+    chatStream = source;
+}
+
+function closeChatStream() {
+    if (chatStream) {
+        chatStream.close();
+        chatStream = null;
+    }
+}
+
+// Поток, если он доступен, иначе опрос
+function startChatUpdates() {
+    if (streamSupported) {
+        openChatStream();
+    } else {
+        startPolling();
+    }
+}
+
 // Функция для добавления сообщений в чат с умной прокруткой
 function appendMessages(messages, tab) {
     const messagesContainer = document.querySelector(`.chat-messages > div[data-tab="${tab}"]`);
@@ -156,8 +219,7 @@ function sendMessage() {
     .then(data => {
         if (data.status === 'ok') {
             input.value = '';
-            // Обновляем сообщения сразу после отправки
-            setTimeout(fetchNewMessages, 500);
+            // Сообщение придёт через поток или ждущий запрос опроса
         } else {
             alert('Ошибка при отправке сообщения: ' + data.error);
         }
@@ -186,15 +248,15 @@ function getCookie(name) {
 
 // Запуск polling
 function startPolling() {
-    if (pollingTimer) clearInterval(pollingTimer);
-    fetchNewMessages(); // Сразу делаем первый запрос
-    pollingTimer = setInterval(fetchNewMessages, pollingInterval);
+    if (pollingTimer) clearTimeout(pollingTimer);
+    longPoll();
 }
 
 // Остановка polling
 function stopPolling() {
-    if (pollingTimer) clearInterval(pollingTimer);
+    if (pollingTimer) clearTimeout(pollingTimer);
     pollingActive = false;
+    if (pollController) pollController.abort();
 }
 
 // Функция переключения вкладок с сохранением состояния скролла
@@ -229,7 +291,12 @@ function setupTabSwitching() {
 
             // Обновляем текущую вкладку и запрашиваем новые сообщения
             currentTab = tabName;
-            fetchNewMessages();
+            // Ждущий запрос прежней вкладки прерывается - опрос продолжится с новой
+            if (chatStream) {
+                openChatStream();
+            } else if (pollController) {
+                pollController.abort();
+            }
 
             // Отображение панели группы только на вкладке "Подземный мир"
             document.getElementById('group-panel').style.display = (tabName === 'group') ? 'block' : 'none';
@@ -276,8 +343,8 @@ document.addEventListener('DOMContentLoaded', function() {
     // Настройка отслеживания скролла
     setupScrollTracking();
     
-    // Запуск polling
-    startPolling();
+    // Запуск получения сообщений
+    startChatUpdates();
     
     // Инициализация системной панели
     const systemToggle = document.getElementById('system-toggle');
@@ -473,5 +540,6 @@ document.addEventListener('DOMContentLoaded', function() {
 
 // Очистка сессии при выходе
 window.addEventListener('beforeunload', function() {
+    closeChatStream();
     sessionStorage.removeItem('chat_history_cleared');
 });
\ No newline at end of file